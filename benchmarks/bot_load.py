@@ -0,0 +1,246 @@
+"""
+Run search, filter, page and /select flows of many users through the handlers of src/main.py, with local stubs
+of Jackett, TorrServer and the Bot API (see stubs.py). Reports latency percentiles per flow, throughput and peak RSS.
+
+Every user searches, presses a size filter, opens the next page of all results and selects the first result.
+"select_files" is the time from /select until the message is edited with the files from TorrServer.
+
+Usage: python benchmarks/bot_load.py [--users 100] [--concurrency 20] [--queries 20] [--results 100]
+                                     [--indexers rutracker=0.3,nyaa=1] [--metadata-delay 1] [--mode all]
+                                     [--bot-api-latency 0] [--prefetch 0] [--think-time 0] [--telegram-limits]
+                                     [--verbose]
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from stubs import FakeBotApi, serve_stubs, DEFAULT_INDEXER_DELAYS  # noqa: E402
+
+FLOWS = ['search', 'filter', 'page', 'select', 'select_files']
+SELECT_COMMAND = re.compile(r'/select_\w+')
+SELECT_FILES_TIMEOUT_SECONDS = 60
+
+update_ids = count(1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=100, help="users, each runs every flow once")
+    parser.add_argument('--concurrency', type=int, default=20, help="users running at the same time")
+    parser.add_argument('--queries', type=int, default=20, help="distinct queries, users share them round robin")
+    parser.add_argument('--results', type=int, default=100, help="results per indexer")
+    parser.add_argument('--files', type=int, default=10, help="files per torrent")
+    parser.add_argument('--indexers', default=','.join(f'{k}={v}' for k, v in DEFAULT_INDEXER_DELAYS.items()),
+                        help="indexer=delay seconds, comma separated")
+    parser.add_argument('--metadata-delay', type=float, default=1.0, help="TorrServer time to metadata, seconds")
+    parser.add_argument('--bot-api-latency', type=float, default=0.0, help="seconds per Bot API call")
+    parser.add_argument('--mode', choices=['all', 'per_indexer'], default='all', help="JACKETT_SEARCH_MODE")
+    parser.add_argument('--prefetch', type=int, default=0, help="PREFETCH_TOP_N, results prefetched per list")
+    parser.add_argument('--think-time', type=float, default=0.0, help="seconds a user reads the list before /select")
+    parser.add_argument('--verbose', action='store_true', help="show the bot's own log")
+    parser.add_argument('--telegram-limits', action='store_true',
+                        help="keep Telegram flood limits of the send queue, they dominate throughput otherwise")
+    return parser.parse_args()
+
+
+def parse_indexer_delays(text) -> dict[str, float]:
+    delays = {}
+    for item in text.split(','):
+        indexer_id, _, delay = item.partition('=')
+        delays[indexer_id.strip()] = float(delay or 0)
+    return delays
+
+
+def start_stubs(args):
+    # Spawned, so the stub process doesn't inherit anything of the bot
+    context = multiprocessing.get_context('spawn')
+    parent, child = context.Pipe()
+    process = context.Process(target=serve_stubs, daemon=True,
+                              args=(child, parse_indexer_delays(args.indexers), args.results, args.metadata_delay,
+                                    args.files))
+    process.start()
+    jackett_url, torrserver_url = parent.recv()
+    return process, parent, jackett_url, torrserver_url
+
+
+def import_bot(args, jackett_url, torrserver_url, bot_api: FakeBotApi):
+    """
+    Configure the bot through the environment, like a deployment does, and import its handlers
+    """
+    os.environ.update({
+        'BOT_TOKEN': '123456:benchmark',
+        'JACKETT_SERVER_URL': jackett_url,
+        'JACKETT_API_KEY': 'benchmark',
+        'JACKETT_SEARCH_MODE': args.mode,
+        'TORRSERVER_URL': torrserver_url,
+        'PREFETCH_TOP_N': str(args.prefetch),
+    })
+    if not args.telegram_limits:
+        os.environ.update({'TELEGRAM_GLOBAL_RATE': '1000000', 'TELEGRAM_CHAT_RATE': '1000000',
+                           'TELEGRAM_CHAT_BURST': '1000000'})
+
+    # The Jackett disk cache is created in the working directory, results of a previous run would be hits
+    os.chdir(tempfile.mkdtemp(prefix='bot-load-'))
+    from telebot import apihelper
+
+    apihelper.API_URL = bot_api.api_url
+    import main
+
+    # Handlers run in the benchmark threads, so their time is measured
+    main.bot.threaded = False
+    return main
+
+
+def make_user(chat_id) -> dict:
+    return {'id': chat_id, 'is_bot': False, 'first_name': 'User', 'language_code': 'en'}
+
+
+def make_message_update(chat_id, message_id, text):
+    from telebot.types import Update
+
+    return Update.de_json({'update_id': next(update_ids), 'message': {
+        'message_id': message_id, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'},
+        'from': make_user(chat_id), 'text': text}})
+
+
+def make_callback_update(chat_id, message_id, data):
+    from telebot.types import Update
+
+    return Update.de_json({'update_id': next(update_ids), 'callback_query': {
+        'id': str(next(update_ids)), 'from': make_user(chat_id), 'chat_instance': str(chat_id), 'data': data,
+        'message': {'message_id': message_id, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'},
+                    'text': ''}}})
+
+
+def get_buttons(params) -> list[str]:
+    markup = json.loads(params.get('reply_markup') or '{}')
+    return [button['callback_data'] for row in markup.get('inline_keyboard', []) for button in row
+            if 'callback_data' in button]
+
+
+def find_results_message(bot_api: FakeBotApi, chat_id, after) -> dict | None:
+    """
+    :return: params of the last results message sent or edited to the chat
+    """
+    for method, call_chat_id, params, _ in reversed(bot_api.get_calls(after)):
+        if call_chat_id == chat_id and method in ('sendMessage', 'editMessageText') and get_buttons(params):
+            return params
+    return None
+
+
+class LoadRun:
+    def __init__(self, bot, bot_api: FakeBotApi, think_time=0.0):
+        self.bot = bot
+        self.bot_api = bot_api
+        self.think_time = think_time
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def measure(self, flow, update) -> bool:
+        start = time.perf_counter()
+        try:
+            self.bot.process_new_updates([update])
+        except Exception as e:
+            print("%s failed: %s" % (flow, e), file=sys.stderr)
+            self.record(flow, None)
+            return False
+        self.record(flow, time.perf_counter() - start)
+        return True
+
+    def record(self, flow, seconds):
+        with self._lock:
+            if seconds is None:
+                self.errors[flow] += 1
+            else:
+                self.latencies[flow].append(seconds)
+
+    def run_user(self, chat_id, query):
+        message_ids = count(1)
+        after = self.bot_api.count_calls()
+        if not self.measure('search', make_message_update(chat_id, next(message_ids), query)):
+            return
+        results = find_results_message(self.bot_api, chat_id, after)
+        if results is None:
+            return self.record('search', None)
+
+        message_id = int(results['message_id'])
+        buttons = get_buttons(results)
+        # Filter state is category, tracker (2), size, min seeds and sort, see result_filters.encode_filter
+        filters = [data for data in buttons if not data.startswith('all:') and data.split(':')[0][3] != '0']
+        pages = [data for data in buttons if data.startswith('all:') and not data.endswith(':0')]
+        if filters:
+            self.measure('filter', make_callback_update(chat_id, message_id, filters[0]))
+        if pages:
+            self.measure('page', make_callback_update(chat_id, message_id, pages[0]))
+
+        select = SELECT_COMMAND.search(results.get('text', ''))
+        if select is None:
+            return
+        time.sleep(self.think_time)
+        after = self.bot_api.count_calls()
+        start = time.perf_counter()
+        if self.measure('select', make_message_update(chat_id, next(message_ids), select.group())):
+            edited = self.bot_api.wait_for_call(chat_id, ('editMessageText',), after, SELECT_FILES_TIMEOUT_SECONDS)
+            self.record('select_files', time.perf_counter() - start if edited is not None else None)
+
+
+def percentile(sorted_values, fraction) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def print_report(run: LoadRun, elapsed, users):
+    print(f"{'flow':<14}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    completed = 0
+    for flow in FLOWS:
+        values = sorted(run.latencies[flow])
+        completed += len(values)
+        if not values:
+            print(f"{flow:<14}{0:>7}{run.errors[flow]:>8}")
+            continue
+        row = [percentile(values, 0.5), percentile(values, 0.95), percentile(values, 0.99), values[-1]]
+        print(f"{flow:<14}{len(values):>7}{run.errors[flow]:>8}" + ''.join(f"{value * 1000:>10.1f}" for value in row))
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    print(f"Users: {users}, elapsed {elapsed:.2f} s, {users / elapsed:.1f} users/s, "
+          f"{completed / elapsed:.1f} flows/s, peak RSS {peak_rss:.1f} MiB")
+
+
+def main():
+    args = parse_args()
+    stubs, stubs_connection, jackett_url, torrserver_url = start_stubs(args)
+    bot_api = FakeBotApi(latency=args.bot_api_latency)
+    bot = import_bot(args, jackett_url, torrserver_url, bot_api).bot
+    print(f"Jackett {jackett_url}, TorrServer {torrserver_url}, Bot API {bot_api.api_url.split('/bot')[0]}")
+
+    run = LoadRun(bot, bot_api, args.think_time)
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            futures = [executor.submit(run.run_user, 1_000_000 + user, f'benchmark query {user % args.queries}')
+                       for user in range(args.users)]
+            for future in futures:
+                future.result()
+    elapsed = time.perf_counter() - start
+
+    print_report(run, elapsed, args.users)
+    stubs_connection.send(None)
+    stubs.join(timeout=5)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Compare parsing of a large Jackett response: whole-body json + parse every row + full sort (previous path)
+against incremental parsing with a bounded top-K heap (current path).
+
+Usage: python benchmarks/jackett_parse.py [results_count] [repeats]
+"""
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import humanize
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from jackett_parser import iter_results, select_top_results, CHUNK_SIZE  # noqa: E402
+
+TRACKERS = ['1337x', 'The Pirate Bay', 'RuTracker', 'Nyaa', 'TorrentGalaxy', 'LimeTorrents']
+
+
+def make_payload(results_count) -> bytes:
+    rnd = random.Random(42)
+    results = []
+    for i in range(results_count):
+        tracker = rnd.choice(TRACKERS)
+        results.append({
+            'FirstSeen': '0001-01-01T00:00:00',
+            'Tracker': tracker,
+            'TrackerId': tracker.lower().replace(' ', ''),
+            'TrackerType': 'public',
+            'CategoryDesc': 'Movies/HD',
+            'Title': f'Some.Movie.Title.{2000 + i % 25}.1080p.BluRay.x264-GROUP{i}',
+            'Guid': f'https://tracker.example/torrent/{i}',
+            'Link': f'http://jackett:9117/dl/{tracker}/?jackett_apikey=abc&path=xyz{i}&file=file{i}',
+            'Details': f'https://tracker.example/details/{i}',
+            'PublishDate': '2024-01-01T00:00:00',
+            'Category': [2000, 2040],
+            'Size': rnd.randint(100_000_000, 80_000_000_000),
+            'Seeders': rnd.randint(0, 5000),
+            'Peers': rnd.randint(0, 6000),
+            'MagnetUri': f'magnet:?xt=urn:btih:{rnd.getrandbits(160):040x}&dn=Some.Movie.{i}' if i % 3 else None,
+            'InfoHash': None,
+        })
+    return json.dumps({'Results': results, 'Indexers': []}).encode()
+
+
+def legacy_parse(body: bytes) -> list[dict]:
+    # Previous path: response.json(), a dict with formatted size for every row, then a full sort
+    parsed_results = []
+    for result in json.loads(body).get('Results', []):
+        size = result.get('Size') if result.get('Size') else 0
+        parsed_results.append({
+            'title': result.get('Title'),
+            'size_bytes': size,
+            'size': humanize.naturalsize(size, format='%.2f', binary=False) if size else "-",
+            'seeds': result.get('Seeders'),
+            'magnet': result.get('MagnetUri'),
+            'torrent': result.get('Link'),
+            'tracker': result.get('Tracker')
+        })
+    return sorted(parsed_results, key=lambda x: x['seeds'], reverse=True)
+
+
+def streaming_parse(body: bytes) -> list[dict]:
+    chunks = (body[i:i + CHUNK_SIZE] for i in range(0, len(body), CHUNK_SIZE))
+    return select_top_results(iter_results(chunks))
+
+
+def measure(name, parse, body, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        parse(body)
+        timings.append(time.perf_counter() - start)
+
+    # The body itself is an input in both cases and not counted
+    tracemalloc.start()
+    results = parse(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{name:<10} best {min(timings) * 1000:8.1f} ms   peak {peak / 1024 / 1024:7.2f} MiB   kept {len(results)}")
+    return results
+
+
+def main():
+    results_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    body = make_payload(results_count)
+    print(f"Payload: {results_count} results, {len(body) / 1024 / 1024:.2f} MiB")
+
+    legacy = measure('legacy', legacy_parse, body, repeats)
+    streaming = measure('streaming', streaming_parse, body, repeats)
+
+    top_legacy = [result['seeds'] for result in legacy[:len(streaming)]]
+    top_streaming = [result['seeds'] for result in streaming]
+    print("Same top results:", top_legacy == top_streaming)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""
+Local stand-ins for Jackett, TorrServer and the Telegram Bot API, used by bot_load.py.
+Jackett and TorrServer can also be started on their own to run the bot against them:
+
+Usage: python benchmarks/stubs.py [jackett_port] [torrserver_port]
+"""
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import bencodepy
+
+DEFAULT_INDEXER_DELAYS = {'rutracker': 0.3, '1337x': 0.6, 'nyaa': 1.0, 'thepiratebay': 2.0}
+# Movies (HD and UHD), TV and audio, so results can be filtered by category
+CATEGORIES = [2040, 2045, 5040, 3000]
+
+
+def start_server(handler_class, port=0) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler_class)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_url(server: ThreadingHTTPServer) -> str:
+    return 'http://%s:%s' % server.server_address
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive, like the real services behind the bot's connection pool
+    protocol_version = 'HTTP/1.1'
+
+    def respond(self, body: bytes, content_type='application/json', status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def get_infohash(query, indexer_id, index) -> str:
+    return hashlib.sha1(f'{query}/{indexer_id}/{index}'.encode()).hexdigest()
+
+
+def make_torrent(infohash, files_count) -> bytes:
+    files = [{b'length': 700_000_000 + i, b'path': [f'Episode {i + 1}.mkv'.encode()]} for i in range(files_count)]
+    info = {b'name': infohash.encode(), b'piece length': 262144, b'pieces': b'\0' * 20, b'files': files}
+    return bencodepy.encode({b'announce': b'http://tracker.example/announce', b'info': info})
+
+
+class FakeJackett:
+    """
+    Every indexer answers after its delay with results_per_indexer results. The aggregated endpoint answers
+    when the slowest indexer does. Every third result has only a .torrent link, served by the stub itself
+    """
+
+    def __init__(self, indexer_delays=None, results_per_indexer=100, files_count=10, port=0):
+        self.indexer_delays = indexer_delays if indexer_delays is not None else DEFAULT_INDEXER_DELAYS
+        self.results_per_indexer = results_per_indexer
+        self.files_count = files_count
+        self.requests = 0
+        self.server = start_server(self._create_request_handler(), port)
+        self.url = get_url(self.server)
+
+    def make_results(self, query, indexer_id) -> list[dict]:
+        rnd = random.Random(f'{query}/{indexer_id}')
+        results = []
+        for index in range(self.results_per_indexer):
+            infohash = get_infohash(query, indexer_id, index)
+            has_magnet = index % 3 != 0
+            results.append({
+                'Tracker': indexer_id,
+                'TrackerId': indexer_id,
+                'Category': [CATEGORIES[index % len(CATEGORIES)]],
+                'CategoryDesc': 'Movies/HD',
+                'Title': f'{query} {2000 + index % 25} 1080p BluRay x264-GROUP{index}',
+                'Link': None if has_magnet else f'{self.url}/dl/{infohash}.torrent',
+                'Size': rnd.randint(100_000_000, 80_000_000_000),
+                'Seeders': rnd.randint(0, 5000),
+                'Peers': rnd.randint(0, 6000),
+                'MagnetUri': f'magnet:?xt=urn:btih:{infohash}&dn=result{index}' if has_magnet else None,
+                'InfoHash': infohash if has_magnet else None,
+            })
+        return results
+
+    def _create_request_handler(self):
+        jackett = self
+
+        class RequestHandler(StubRequestHandler):
+            def do_GET(self):
+                jackett.requests += 1
+                url = urlparse(self.path)
+                parts = url.path.strip('/').split('/')
+                params = parse_qs(url.query)
+                query = params.get('Query', [''])[0]
+                categories = [int(category) for category in params.get('Category[]', [])]
+
+                if url.path.startswith('/dl/'):
+                    infohash = parts[-1].removesuffix('.torrent')
+                    return self.respond(make_torrent(infohash, jackett.files_count), 'application/x-bittorrent')
+                if url.path.endswith('/torznab/api'):
+                    indexers = ''.join(f'<indexer id="{indexer_id}" configured="true"><title>{indexer_id}</title>'
+                                       f'</indexer>' for indexer_id in jackett.indexer_delays)
+                    return self.respond(f'<indexers>{indexers}</indexers>'.encode(), 'application/xml')
+                # /api/v2.0/indexers/<id>/results
+                if len(parts) != 5 or parts[-1] != 'results':
+                    return self.respond(b'{}', status=404)
+
+                indexer_ids = list(jackett.indexer_delays) if parts[3] == 'all' else [parts[3]]
+                if not set(indexer_ids) <= set(jackett.indexer_delays):
+                    return self.respond(b'{}', status=404)
+                time.sleep(max(jackett.indexer_delays[indexer_id] for indexer_id in indexer_ids))
+                results = [result for indexer_id in indexer_ids for result in jackett.make_results(query, indexer_id)
+                           if not categories or result['Category'][0] // 1000 * 1000 in categories]
+                self.respond(json.dumps({'Results': results, 'Indexers': []}).encode())
+
+        return RequestHandler
+
+
+class FakeTorrServer:
+    """
+    Metadata of an added torrent becomes available metadata_delay seconds after it's added
+    """
+
+    def __init__(self, metadata_delay=1.0, files_count=10, port=0):
+        self.metadata_delay = metadata_delay
+        self.files_count = files_count
+        self.added_at = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.server = start_server(self._create_request_handler(), port)
+        self.url = get_url(self.server)
+
+    def get_torrent(self, infohash) -> dict:
+        with self._lock:
+            added_at = self.added_at.setdefault(infohash, time.monotonic())
+        torrent = {'hash': infohash, 'title': infohash, 'stat': 1}
+        if time.monotonic() - added_at >= self.metadata_delay:
+            torrent['torrent_size'] = 700_000_000 * self.files_count
+            torrent['file_stats'] = [{'id': i + 1, 'path': f'{infohash}/Episode {i + 1}.mkv', 'length': 700_000_000}
+                                     for i in range(self.files_count)]
+        return torrent
+
+    def _create_request_handler(self):
+        torrserver = self
+
+        class RequestHandler(StubRequestHandler):
+            def do_POST(self):
+                torrserver.requests += 1
+                request = json.loads(self.read_body() or b'{}')
+                if self.path == '/torrents' and request.get('action') == 'add':
+                    link = request.get('link', '')
+                    infohash = link.split('btih:')[1][:40].lower() if 'btih:' in link else get_infohash(link, '', 0)
+                    return self.respond(json.dumps(torrserver.get_torrent(infohash)).encode())
+                if self.path == '/cache' and request.get('action') == 'get':
+                    return self.respond(json.dumps({'Torrent': torrserver.get_torrent(request['hash'])}).encode())
+                self.respond(b'{}', status=404)
+
+        return RequestHandler
+
+
+class FakeBotApi:
+    """
+    Answers Bot API methods the bot uses and records every call. Set telebot.apihelper.API_URL to api_url
+    """
+
+    def __init__(self, latency=0.0, port=0):
+        self.latency = latency
+        self.calls = []  # (method, chat id, params, time)
+        self._message_ids = {}
+        self._condition = threading.Condition()
+        self.server = start_server(self._create_request_handler(), port)
+        self.api_url = get_url(self.server) + '/bot{0}/{1}'
+
+    def wait_for_call(self, chat_id, methods, after, timeout) -> dict | None:
+        """
+        :param after: number of calls recorded before, only later calls are checked
+        :return: params of the first call of one of the methods to the chat
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                for method, call_chat_id, params, _ in self.calls[after:]:
+                    if method in methods and call_chat_id == chat_id:
+                        return params
+                if not self._condition.wait(deadline - time.monotonic()) and time.monotonic() >= deadline:
+                    return None
+
+    def get_calls(self, after=0) -> list[tuple]:
+        with self._condition:
+            return self.calls[after:]
+
+    def count_calls(self) -> int:
+        with self._condition:
+            return len(self.calls)
+
+    def answer(self, method, params) -> dict | bool:
+        chat_id = int(params.get('chat_id', 0))
+        with self._condition:
+            if method in ('sendMessage', 'sendDocument'):
+                # Recorded with the call, so the benchmark knows which message to press buttons of
+                params['message_id'] = self._message_ids[chat_id] = self._message_ids.get(chat_id, 0) + 1
+            self.calls.append((method, chat_id, params, time.monotonic()))
+            self._condition.notify_all()
+        if method not in ('sendMessage', 'sendDocument', 'editMessageText'):
+            return True
+        return {'message_id': int(params['message_id']), 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')}
+
+    def _create_request_handler(self):
+        bot_api = self
+
+        class RequestHandler(StubRequestHandler):
+            def do_GET(self):
+                self.do_POST()
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                method = url.path.rsplit('/', 1)[-1]
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                body = self.read_body()
+                if self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+                    params.update({key: values[0] for key, values in parse_qs(body.decode()).items()})
+                # Documents are multipart, only chat_id is needed from them
+                elif b'name="chat_id"' in body:
+                    params['chat_id'] = body.split(b'name="chat_id"', 1)[1].split(b'\r\n')[2].decode()
+                if bot_api.latency:
+                    time.sleep(bot_api.latency)
+                self.respond(json.dumps({'ok': True, 'result': bot_api.answer(method, params)}).encode())
+
+        return RequestHandler
+
+
+def serve_stubs(connection, indexer_delays, results_per_indexer, metadata_delay, files_count):
+    """
+    Entry point of a separate process, so memory of the stubs is not counted in the bot's peak RSS
+    """
+    jackett = FakeJackett(indexer_delays, results_per_indexer, files_count)
+    torrserver = FakeTorrServer(metadata_delay, files_count)
+    connection.send((jackett.url, torrserver.url))
+    connection.recv()  # anything, or EOF when the benchmark exits
+
+
+if __name__ == '__main__':
+    jackett = FakeJackett(port=int(sys.argv[1]) if len(sys.argv) > 1 else 9117)
+    torrserver = FakeTorrServer(port=int(sys.argv[2]) if len(sys.argv) > 2 else 8090)
+    print("Jackett: %s, TorrServer: %s" % (jackett.url, torrserver.url))
+    threading.Event().wait()
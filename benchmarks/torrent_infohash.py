@@ -0,0 +1,74 @@
+"""
+Compare infohash calculation of large .torrent files: decode the whole file + encode the info dictionary
+again (previous path) against hashing the raw info dictionary span in place (current path).
+
+Usage: python benchmarks/torrent_infohash.py [size_mb] [repeats]
+"""
+import hashlib
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import bencodepy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from torrent_parser import get_infohash  # noqa: E402
+
+PIECE_HASH_SIZE = 20
+
+
+def make_torrent(size_mb) -> bytes:
+    rnd = random.Random(42)
+    files_count = 500
+    pieces_size = size_mb * 1024 * 1024 // PIECE_HASH_SIZE * PIECE_HASH_SIZE
+    return bencodepy.encode({
+        b'announce': b'http://tracker.example/announce',
+        b'creation date': 1700000000,
+        b'info': {
+            b'name': 'Some Series Season 1 1080p'.encode(),
+            b'piece length': 4 * 1024 * 1024,
+            b'pieces': rnd.randbytes(pieces_size),
+            b'files': [{b'length': rnd.randint(1, 10 ** 10), b'path': [b'Season 1', f'Episode {i}.mkv'.encode()]}
+                       for i in range(files_count)],
+        },
+    })
+
+
+def legacy_infohash(torrent_data: bytes) -> str:
+    torrent = bencodepy.decode(torrent_data)
+    return hashlib.sha1(bencodepy.encode(torrent[b'info'])).hexdigest()
+
+
+def measure(name, get_hash, torrent_data, repeats) -> str:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        get_hash(torrent_data)
+        timings.append(time.perf_counter() - start)
+
+    # The file itself is an input in both cases and not counted
+    tracemalloc.start()
+    infohash = get_hash(torrent_data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{name:<10} best {min(timings) * 1000:8.2f} ms   peak {peak / 1024 / 1024:7.2f} MiB")
+    return infohash
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    torrent_data = make_torrent(size_mb)
+    print(f"Torrent: {len(torrent_data) / 1024 / 1024:.2f} MiB")
+
+    legacy = measure('legacy', legacy_infohash, torrent_data, repeats)
+    in_place = measure('in place', get_infohash, torrent_data, repeats)
+    print("Same infohash:", legacy == in_place)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import asyncio
+import os
+
+import dotenv
+from telebot import apihelper
+
+from metrics import start_metrics_server, register_stats, METRICS_PORT
+from supervisor import Supervisor, ChatUpdates, poll_updates, BOT_WORKERS
+from webhook import WebhookServer, AsyncWebhookServer, WEBHOOK_URL, WEBHOOK_SECRET_TOKEN
+
+dotenv.load_dotenv()
+
+# sync - TeleBot with a handler thread per chat, async - AsyncTeleBot with async clients (see async_main.py)
+BOT_MODE = os.getenv('BOT_MODE', 'sync')
+# polling - long polling of getUpdates, webhook - Telegram posts updates to the built-in HTTP server
+BOT_INGRESS = os.getenv('BOT_INGRESS', 'polling')
+
+
+class BotApp:
+    """
+    Handlers are registered on import of main.py or async_main.py, nothing connects to Telegram until run()
+    """
+
+    def __init__(self, mode=BOT_MODE, ingress=BOT_INGRESS, workers=BOT_WORKERS, webhook_url=WEBHOOK_URL,
+                 **webhook_options):
+        self.mode = mode
+        self.ingress = ingress
+        self.workers = workers
+        self.webhook_url = webhook_url
+        self.webhook_options = webhook_options
+
+    @property
+    def bot(self):
+        if self.mode == 'async':
+            import async_main
+            return async_main.bot
+        import main
+        return main.bot
+
+    def create_webhook_server(self) -> WebhookServer | AsyncWebhookServer:
+        server_class = AsyncWebhookServer if self.mode == 'async' else WebhookServer
+        return server_class(self.bot, **self.webhook_options)
+
+    def run(self):
+        if METRICS_PORT:
+            start_metrics_server()
+        if self.workers > 1:
+            return self.run_supervisor()
+        if self.mode == 'async':
+            return asyncio.run(self.run_async())
+
+        import main
+        from cache_warmer import start_cache_warmer
+
+        bot = self.bot
+        start_cache_warmer(main.search_scheduler)
+        # Same handling as in a worker process: chats in order, a thread for every search that can run or wait
+        chats = ChatUpdates(bot)
+        register_stats('chat_updates', chats.stats)
+        if self.ingress == 'webhook':
+            if self._register_webhook(lambda: bot.set_webhook(self.webhook_url, secret_token=WEBHOOK_SECRET_TOKEN)):
+                return WebhookServer(chats, **self.webhook_options).serve_forever()
+
+        poll_updates(bot.token, chats.process_new_updates)
+
+    async def run_async(self):
+        import async_main
+        from cache_warmer import start_cache_warmer_async
+
+        bot = self.bot
+        start_cache_warmer_async(async_main.search_scheduler)
+        try:
+            if self.ingress == 'webhook':
+                if await self._register_webhook_async(
+                        lambda: bot.set_webhook(self.webhook_url, secret_token=WEBHOOK_SECRET_TOKEN)):
+                    return await self.create_webhook_server().serve_forever()
+
+            await bot.remove_webhook()
+            await bot.infinity_polling(timeout=60)
+        finally:
+            await async_main.close_sessions()
+
+    def run_supervisor(self):
+        """
+        Updates are received here and handled by worker processes, the bot modules are imported only by them
+        """
+        token = os.getenv('BOT_TOKEN')
+        supervisor = Supervisor(self.mode, workers=self.workers)
+        supervisor.start()
+        try:
+            if self.ingress == 'webhook':
+                if self._register_webhook(lambda: apihelper.set_webhook(token, self.webhook_url,
+                                                                        secret_token=WEBHOOK_SECRET_TOKEN)):
+                    return WebhookServer(supervisor, **self.webhook_options).serve_forever()
+            supervisor.poll(token)
+        finally:
+            supervisor.stop()
+
+    def _register_webhook(self, set_webhook) -> bool:
+        """
+        :return: False if the bot should fall back to polling
+        """
+        # Without a public URL the server only receives updates posted locally, e.g. recorded ones
+        if not self.webhook_url:
+            return True
+        try:
+            set_webhook()
+            return True
+        except Exception as e:
+            print("Failed to set webhook %s, falling back to polling: %s" % (self.webhook_url, e))
+            return False
+
+    async def _register_webhook_async(self, set_webhook) -> bool:
+        if not self.webhook_url:
+            return True
+        try:
+            await set_webhook()
+            return True
+        except Exception as e:
+            print("Failed to set webhook %s, falling back to polling: %s" % (self.webhook_url, e))
+            return False
+
+
+def create_app(**options) -> BotApp:
+    return BotApp(**options)
+
+
+if __name__ == '__main__':
+    create_app().run()
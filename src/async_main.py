@@ -0,0 +1,386 @@
+import asyncio
+import os
+
+import dotenv
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+
+from bot_common import prepare_download, find_selected_result, build_select_reply, find_inline_answer, \
+    is_inline_search_slow, build_inline_query_answer, get_progress_title, get_results_title, get_filtered_search, \
+    build_results_message, Download, ProgressEdits, WAIT_TIMEOUT_TO_NOTIFY_SECONDS
+from cache_warmer import record_search_async
+from http_pool import close_async_session
+from file_delivery import download_semaphore, TELEGRAM_UPLOAD_LIMIT_BYTES, UPLOAD_TIMEOUT_SECONDS
+from jackett import search_jackett_async, search_jackett_progressive_async, find_cached_refinement, \
+    is_search_cached_async, JACKETT_SEARCH_MODE, JACKETT_CACHE_TTL_SECONDS, SearchProgress
+from inline_search import Debouncer, InlineResults, INLINE_DEBOUNCE_SECONDS, INLINE_ANSWER_TIMEOUT_SECONDS
+from metrics import traced, stage, register_stats
+from prefetch import AsyncPrefetcher
+from responses import UserResponse, build_keyboard, build_search_time_alert, parse_results_callback, \
+    add_torrent_files_to_response, build_searching_response, is_refresh_callback, parse_refresh_callback, \
+    build_search_rejected_response, build_text_response, build_file_too_large_response
+from result_filters import ResultFilter, NO_FILTER
+from search_scheduler import AsyncSearchScheduler, SearchRejected
+from send_queue import AsyncSendQueue, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from search_state import get_search_eta, clean_text, get_query_hash, save_results_async, get_results_version, \
+    are_results_older_than, get_saved_query, SavedQuery
+from torrent import create_magnet_link_from_url_async, get_result_infohash
+from torrent_provider import get_torrent_info_by_magnet_link_async
+from torrserver import download_file_async, FileTooLargeError
+
+dotenv.load_dotenv()
+
+# Handlers are coroutines: every update is a task, so waiting for Jackett or TorrServer doesn't hold a thread
+bot = AsyncTeleBot(os.getenv('BOT_TOKEN'))
+# All outgoing messages go through it to stay within Telegram flood limits
+send_queue = AsyncSendQueue()
+register_stats('send_queue', send_queue.stats)
+# Top results of every shown list are fetched before they are selected, see PREFETCH_TOP_N
+# Results older than the Jackett cache are likely searched again instead of selected
+prefetcher = AsyncPrefetcher(lambda query_hash: are_results_older_than(query_hash, JACKETT_CACHE_TTL_SECONDS))
+register_stats('prefetch', prefetcher.stats)
+# Jackett searches of all users take turns for a limited number of slots, see SEARCH_MAX_PARALLEL
+search_scheduler = AsyncSearchScheduler()
+register_stats('search_scheduler', search_scheduler.stats)
+# Jackett searches of inline queries once the user stops typing
+inline_debouncer = Debouncer()
+inline_tasks = set()
+# Downloads run in tasks of their own, so later updates of the chat don't wait for the upload
+download_tasks = set()
+
+
+@bot.message_handler(regexp="^/start")
+@traced('start')
+async def start(message):
+    await say(build_text_response(message, 'start_message'))
+
+
+@bot.message_handler(regexp="^/download")
+@traced('download')
+async def download(message):
+    print("Received message from: %s, text: %s" % (message.from_user.id, message.text))
+    request, response = prepare_download(message)
+    message_id = await say(response)
+    if request is None:
+        return
+    task = asyncio.create_task(deliver_file_when_allowed(message, request, message_id))
+    download_tasks.add(task)
+    task.add_done_callback(download_tasks.discard)
+
+
+async def deliver_file_when_allowed(message, request: Download, message_id):
+    # A slot is kept until the file is uploaded, so at most MAX_PARALLEL_DOWNLOADS files are in memory or on disk
+    async with download_semaphore:
+        await deliver_file(message, request, message_id)
+
+
+async def deliver_file(message, request: Download, message_id):
+    chat_id = message.from_user.id
+    try:
+        with stage('file_download'):
+            file = await download_file_async(request.torrent_hash, request.file_id, TELEGRAM_UPLOAD_LIMIT_BYTES)
+    except FileTooLargeError as e:
+        return await say(build_file_too_large_response(message, e.size), message_id)
+    except Exception as e:
+        print("Failed to download file %s of %s: %s" % (request.file_id, request.torrent_hash, e))
+        return await say(build_text_response(message, 'download_failed'), message_id)
+
+    with file:
+        try:
+            # Same as in main.py, the upload doesn't keep other messages to the chat waiting.
+            # aiohttp reads file objects in chunks while uploading
+            await send_queue.reserve(chat_id, PRIORITY_LOW)
+            with stage('file_upload'):
+                await bot.send_document(chat_id, file, visible_file_name=request.file_name,
+                                        timeout=UPLOAD_TIMEOUT_SECONDS)
+        except Exception as e:
+            print("Failed to send file %s of %s: %s" % (request.file_id, request.torrent_hash, e))
+            await say(build_text_response(message, 'download_failed'), message_id)
+
+
+@bot.message_handler(regexp="^/select")
+@traced('select')
+async def select(message):
+    print("Received message from: %s, text: %s" % (message.from_user.id, message.text))
+    selected_result = find_selected_result(message)
+
+    if selected_result is None:
+        return await say(build_text_response(message, 'option_not_found'))
+
+    user_response, magnet_link = build_select_reply(message, selected_result, await create_magnet_link_from_url_async(
+        selected_result["torrent"], selected_result["tracker"], get_result_infohash(selected_result)))
+    message_id = await say(user_response)
+
+    torrent_info = await get_torrent_info_by_magnet_link_async(magnet_link)
+    if torrent_info is not None:
+        await say(add_torrent_files_to_response(message, user_response, torrent_info), message_id, PRIORITY_LOW)
+
+
+@bot.callback_query_handler(func=lambda call: is_refresh_callback(call.data))
+@traced('refresh')
+async def refresh_results(call):
+    query = get_saved_query(parse_refresh_callback(call.data))
+    await bot.answer_callback_query(call.id)
+
+    if query is None:
+        return await say(build_text_response(call, 'search_expired'))
+
+    await search(call, query.text, force_refresh=True)
+
+
+# handle button click
+@bot.callback_query_handler(func=lambda call: True)
+@traced('results_callback')
+async def handle_query(call):
+    result_filter, query_hash, page = parse_results_callback(call.data)
+    await bot.answer_callback_query(call.id)
+
+    if result_filter is None or get_results_version(query_hash) is None:
+        return await say(build_text_response(call, 'search_expired'))
+
+    results_hash = await search_with_filter(query_hash, result_filter, call)
+    # Pages and filters replace the results message instead of sending a new one
+    try:
+        await print_query_results(query_hash, call, None, call.message.message_id, result_filter, page,
+                                  results_hash=results_hash)
+    except ApiTelegramException as e:
+        # Double click on the same button
+        if 'message is not modified' not in str(e):
+            raise
+
+
+async def say(response: UserResponse, message_id_to_edit=None, priority=PRIORITY_HIGH) -> int:
+    return await say_later(response, message_id_to_edit, priority)
+
+
+def say_later(response: UserResponse, message_id_to_edit=None, priority=PRIORITY_HIGH) -> asyncio.Future:
+    """
+    Queue the response to be sent within Telegram rate limits
+    :return: future with the id of the sent or edited message
+    """
+    keyboard = build_keyboard(response)
+
+    if message_id_to_edit is None:
+        async def send():
+            message = await bot.send_message(response.user_id, response.message, parse_mode="HTML",
+                                             reply_markup=keyboard)
+            return message.message_id
+
+        future = send_queue.submit(response.user_id, send, priority)
+    else:
+        async def send():
+            await bot.edit_message_text(response.message, response.user_id, message_id_to_edit, parse_mode="HTML",
+                                        reply_markup=keyboard)
+            return message_id_to_edit
+
+        future = send_queue.submit(response.user_id, send, priority, edit_key=(response.user_id, message_id_to_edit))
+
+    for file in response.files:
+        if file.file_bytes:
+            send_queue.submit(response.user_id, lambda file=file: bot.send_document(
+                response.user_id, file.file_bytes, visible_file_name=file.file_name), priority)
+
+    return future
+
+
+@bot.message_handler(content_types=['text'], regexp="^[^/]")
+@traced('search')
+async def get_text_messages(message):
+    print("Received message from: %s, text: %s" % (message.from_user.id, message.text))
+    await search(message, message.text)
+
+
+@bot.inline_handler(func=lambda inline_query: True)
+@traced('inline')
+async def inline_search(inline_query):
+    text = clean_text(inline_query.query)
+    # Caches and saved results may be read from disk
+    answer_now, found = await asyncio.to_thread(find_inline_answer, inline_query, text)
+    if answer_now:
+        inline_debouncer.replace(inline_query.from_user.id)
+        return await answer_inline_query(inline_query, found)
+
+    # Not cached: Jackett is searched only for the last query of a user who stopped typing
+    inline_debouncer.replace(inline_query.from_user.id, asyncio.get_running_loop().call_later(
+        INLINE_DEBOUNCE_SECONDS, start_inline_search, inline_query, text))
+
+
+def start_inline_search(inline_query, text):
+    task = asyncio.create_task(search_inline(inline_query, text))
+    inline_tasks.add(task)
+    task.add_done_callback(inline_tasks.discard)
+
+
+async def search_inline(inline_query, text):
+    """
+    Same as search_inline of main.py
+    """
+    await record_search_async(text)
+    answered = is_inline_search_slow()
+    if answered:
+        await answer_inline_query(inline_query, None, 'inline_still_searching')
+
+    cached = await is_search_cached_async(text)
+    try:
+        async with search_scheduler.slot(inline_query.from_user.id, text, cached=cached):
+            if JACKETT_SEARCH_MODE == 'per_indexer':
+                progress = await search_jackett_progressive_async(text, deadline_seconds=INLINE_ANSWER_TIMEOUT_SECONDS)
+                results = progress.results
+            else:
+                results = await search_jackett_async(text)
+    except SearchRejected:
+        if not answered:
+            await answer_inline_query(inline_query, None, 'inline_busy')
+        return
+
+    await save_results_async(get_query_hash(text), results, SavedQuery(text))
+    if not answered:
+        await answer_inline_query(inline_query, InlineResults(text, results))
+
+
+async def answer_inline_query(inline_query, found: InlineResults | None, button_key=None):
+    """
+    Same parameters as of build_inline_query_answer
+    """
+    answer = build_inline_query_answer(inline_query, found, button_key)
+    try:
+        await bot.answer_inline_query(inline_query.id, answer.results, next_offset=answer.next_offset,
+                                      button=answer.button, cache_time=answer.cache_time)
+    except ApiTelegramException as e:
+        # Queries answered too late are rejected, the user has typed something else meanwhile
+        print("Failed to answer inline query %s: %s" % (inline_query.query, e))
+
+
+async def search(message, text, force_refresh=False):
+    """
+    :param force_refresh: search Jackett even if the query can be answered from cached results
+    """
+    await record_search_async(clean_text(text))
+    derived = find_cached_refinement(clean_text(text)) if not force_refresh else None
+    if derived is not None:
+        query_hash = get_query_hash(derived.query)
+        await save_results_async(query_hash, derived.results, SavedQuery(derived.query, derived.base_query))
+        return await print_query_results(query_hash, message, get_results_title(message))
+
+    searching_message_id = await say(build_searching_response(message, text, get_search_eta()))
+
+    text = clean_text(text)
+    if JACKETT_SEARCH_MODE == 'per_indexer':
+        return await search_jackett_per_indexer(text, message, searching_message_id, force_refresh)
+
+    try:
+        results = await search_jackett_with_progress_alert(
+            text, message, lambda query: search_jackett_async(query, force_refresh=force_refresh),
+            searching_message_id, cached=not force_refresh and await is_search_cached_async(text))
+    except SearchRejected as e:
+        return await say(build_search_rejected_response(message, e), searching_message_id)
+    query_hash = get_query_hash(text)
+    await save_results_async(query_hash, results, SavedQuery(text))
+
+    if not results:
+        return await say(build_text_response(message, 'nothing_found'))
+
+    await print_query_results(query_hash, message, get_results_title(message))
+
+
+async def search_jackett_per_indexer(text, message, searching_message_id, force_refresh=False):
+    """
+    Show results of the fastest indexers right away by editing the "searching for..." message
+    """
+    query_hash = get_query_hash(text)
+    edits = ProgressEdits()
+
+    async def show_progress(progress: SearchProgress):
+        if not edits.is_due(progress):
+            return
+
+        # Partial results can already be selected
+        await save_results_async(query_hash, progress.results, SavedQuery(text))
+        try:
+            await print_query_results(query_hash, message, get_progress_title(message, text, progress),
+                                      searching_message_id, priority=PRIORITY_NORMAL)
+        except ApiTelegramException as e:
+            print("Failed to show search progress: %s" % e)
+
+    try:
+        progress = await search_jackett_with_progress_alert(
+            text, message,
+            lambda query: search_jackett_progressive_async(query, show_progress, force_refresh=force_refresh),
+            searching_message_id, cached=not force_refresh and await is_search_cached_async(text))
+    except SearchRejected as e:
+        return await say(build_search_rejected_response(message, e), searching_message_id)
+    await save_results_async(query_hash, progress.results, SavedQuery(text))
+
+    if not progress.results:
+        return await say(build_text_response(message, 'nothing_found'), searching_message_id)
+
+    await print_query_results(query_hash, message, get_results_title(message, progress), searching_message_id)
+
+
+async def search_jackett_with_progress_alert(text, message, search=search_jackett_async, searching_message_id=None,
+                                             cached=False):
+    """
+    Same as search_jackett_with_progress_alert of main.py, the search waits for its slot in the event loop
+    """
+    queue_position_shown = False
+
+    # Notify the user only if the search is still running after the timeout
+    def say_warning():
+        alert = build_search_time_alert(message, get_search_eta(WAIT_TIMEOUT_TO_NOTIFY_SECONDS))
+        say_later(alert, priority=PRIORITY_NORMAL)
+
+    async def show_queue_position(position):
+        nonlocal queue_position_shown
+        queue_position_shown = True
+        say_later(build_searching_response(message, text, get_search_eta(), position), searching_message_id,
+                  PRIORITY_NORMAL)
+
+    alert_handle = asyncio.get_running_loop().call_later(WAIT_TIMEOUT_TO_NOTIFY_SECONDS, say_warning)
+    try:
+        async with search_scheduler.slot(message.from_user.id, text,
+                                         show_queue_position if searching_message_id is not None else None, cached):
+            if queue_position_shown:
+                say_later(build_searching_response(message, text, get_search_eta()), searching_message_id,
+                          PRIORITY_NORMAL)
+            result = await search(text)
+    finally:
+        alert_handle.cancel()
+
+    return result
+
+
+async def search_with_filter(query_hash, result_filter: ResultFilter, message) -> str:
+    """
+    Same as search_with_filter of main.py
+    """
+    filtered_hash, filtered = get_filtered_search(query_hash, result_filter)
+    if filtered is None:
+        return filtered_hash
+
+    try:
+        results = await search_jackett_with_progress_alert(
+            filtered.text, message, lambda text: search_jackett_async(text, search_filter=filtered.search_filter),
+            cached=await is_search_cached_async(filtered.text, filtered.search_filter))
+    except SearchRejected as e:
+        print("Filtered search of %s is not run: %s" % (filtered.text, e.reason))
+        return query_hash
+    if not results:
+        return query_hash
+    await save_results_async(filtered_hash, results, SavedQuery(filtered.text))
+    return filtered_hash
+
+
+async def print_query_results(query_hash, message, title_to_show=None, message_id_to_edit=None, result_filter=NO_FILTER,
+                              page=0, priority=PRIORITY_HIGH, results_hash=None):
+    """
+    Same parameters as of build_results_message
+    """
+    results = build_results_message(query_hash, message, title_to_show, result_filter, page, results_hash)
+    await say(results.response, message_id_to_edit, priority)
+    if prefetcher.enabled:
+        prefetcher.prefetch(results.results_hash, results.get_shown_results())
+
+
+async def close_sessions():
+    await close_async_session()
+    await bot.close_session()
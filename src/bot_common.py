@@ -0,0 +1,199 @@
+import os
+import time
+from dataclasses import dataclass
+
+from file_delivery import parse_download_command, TELEGRAM_UPLOAD_LIMIT_BYTES
+from inline_search import find_inline_results, get_inline_offset, InlineResults, INLINE_MIN_QUERY_LENGTH, \
+    INLINE_ANSWER_TIMEOUT_SECONDS, INLINE_CACHE_TIME_SECONDS
+from jackett import SearchProgress
+from localization import localized
+from responses import UserResponse, InlineAnswer, ResultPages, build_text_response, build_file_too_large_response, \
+    build_select_response, build_inline_answer, build_results_page, get_result_pages, get_result_index, \
+    get_filter_title, get_page_results
+from result_filters import ResultFilter, SearchFilter, NO_FILTER
+from search_state import get_search_eta, get_query_hash, get_results, get_results_version, get_saved_query, \
+    get_filtered_query_hash, find_item_by_select_key
+from torrent_provider import find_torrent_file
+
+# Steps of the bot handlers that don't talk to Telegram, Jackett or TorrServer, shared by main.py (threads)
+# and async_main.py (event loop). The two modules only make the calls, each in its own way
+
+WAIT_TIMEOUT_TO_NOTIFY_SECONDS = 15
+# Don't edit the "searching for..." message more often than this while indexers are answering
+PROGRESS_EDIT_INTERVAL_SECONDS = 1.5
+
+
+@dataclass
+class Download:
+    torrent_hash: str
+    file_id: int
+    file_name: str
+
+
+@dataclass
+class FilteredSearch:
+    """
+    Jackett search of a saved query with the categories and the indexer of a results filter
+    """
+    text: str
+    search_filter: SearchFilter
+
+
+@dataclass
+class ResultsMessage:
+    response: UserResponse
+    results_hash: str  # hash of the shown results
+    pages: ResultPages
+    page: int
+
+    def get_shown_results(self) -> list[dict]:
+        return get_page_results(get_results(self.results_hash), self.pages, self.page)
+
+
+class ProgressEdits:
+    """
+    Tells when to edit the "searching for..." message with partial results: only while some indexers are still
+    searching, and at most once per interval
+    """
+
+    def __init__(self, interval_seconds=PROGRESS_EDIT_INTERVAL_SECONDS):
+        self.interval_seconds = interval_seconds
+        self._edited_at = 0.0
+
+    def is_due(self, progress: SearchProgress) -> bool:
+        if not progress.results or not progress.pending:
+            return False
+        now = time.monotonic()
+        if now - self._edited_at < self.interval_seconds:
+            return False
+        self._edited_at = now
+        return True
+
+
+def prepare_download(message) -> tuple[Download | None, UserResponse]:
+    """
+    :param message: /download_<torrent hash>_<file id>
+    :return: the file to download and the reply that it's being downloaded, or None and the reply why it's not
+    """
+    command = parse_download_command(message.text)
+    file_info = find_torrent_file(*command) if command is not None else None
+    if file_info is None:
+        return None, build_text_response(message, 'option_not_found')
+    if file_info.length > TELEGRAM_UPLOAD_LIMIT_BYTES:
+        return None, build_file_too_large_response(message, file_info.length)
+
+    file_name = os.path.basename(file_info.title)
+    return Download(*command, file_name), build_text_response(message, 'downloading_file', file_name)
+
+
+def find_selected_result(message) -> dict | None:
+    """
+    :param message: /select_<query hash>_<item id>
+    """
+    return find_item_by_select_key(message.text.split("/select_")[1])
+
+
+def build_select_reply(message, selected_result, created_magnet: tuple) -> tuple[UserResponse, str]:
+    """
+    :param created_magnet: magnet link, whether the .torrent file was downloaded and its content, see
+                           create_magnet_link_from_url
+    :return: the reply and the magnet link to get the files of the torrent with
+    """
+    magnet_link = selected_result["magnet"]
+    torrent_link = selected_result["torrent"]
+
+    # Create magnet link from torrent of not present
+    magnet_link_from_torrent, is_torrent_file_present, torrent_file_content = created_magnet
+    if torrent_link and not magnet_link:
+        magnet_link = magnet_link_from_torrent if magnet_link_from_torrent else localized(message,
+                                                                                          'missing_magnet_link')
+
+    # Upload torrent file document
+    torrent_file_bytes = torrent_file_content if is_torrent_file_present else None
+
+    return build_select_response(message, selected_result, magnet_link, torrent_file_bytes), magnet_link
+
+
+def find_inline_answer(inline_query, text) -> tuple[bool, InlineResults | None]:
+    """
+    :param text: cleaned query
+    :return: whether the query is answered without searching Jackett, and the results to answer it with
+    """
+    found = find_inline_results(text) if len(text) >= INLINE_MIN_QUERY_LENGTH else None
+    return found is not None or len(text) < INLINE_MIN_QUERY_LENGTH or bool(get_inline_offset(inline_query)), found
+
+
+def is_inline_search_slow() -> bool:
+    # Answered right away if the search usually takes too long, the next query finds the results cached
+    eta = get_search_eta()
+    return eta is not None and eta > INLINE_ANSWER_TIMEOUT_SECONDS
+
+
+def build_inline_query_answer(inline_query, found: InlineResults | None, button_key=None) -> InlineAnswer:
+    """
+    :param found: None if the query is not searched yet
+    :param button_key: text of a button that opens the bot
+    """
+    query_hash = get_query_hash(found.query) if found is not None else None
+    if query_hash is not None and get_results_version(query_hash) is None:
+        query_hash = None  # only cached, can't be selected in the bot
+    # /select links are made of the ids of the saved results, cached ones have none
+    results = get_results(query_hash) if query_hash is not None else found.results if found is not None else None
+    return build_inline_answer(inline_query, query_hash, results, get_inline_offset(inline_query), button_key,
+                               INLINE_CACHE_TIME_SECONDS if found is not None else 0)
+
+
+def get_progress_title(message, text, progress: SearchProgress) -> str:
+    return localized(message, 'search_in_progress', text, ', '.join(progress.pending))
+
+
+def get_results_title(message, progress: SearchProgress = None) -> str:
+    """
+    :param progress: of a search per indexer, mentions the indexers that didn't answer in time
+    """
+    title = localized(message, 'results_by_popularity')
+    if progress is not None and progress.timed_out:
+        title += "\n" + localized(message, 'search_timed_out_indexers', ', '.join(progress.timed_out))
+    return title
+
+
+def get_filtered_search(query_hash, result_filter: ResultFilter) -> tuple[str, FilteredSearch | None]:
+    """
+    Jackett is searched again with the category and the tracker of the filter, if the saved results are only
+    the best seeded ones and may miss results of them
+    :return: hash of the results to filter and the search to save them with, None if they are saved
+    """
+    query = get_saved_query(query_hash)
+    version = get_results_version(query_hash)
+    index = get_result_index(query_hash, version, lambda: get_results(query_hash))
+    search_filter = index.get_search_filter(result_filter)
+    if query is None or search_filter is None:
+        return query_hash, None
+
+    filtered_hash = get_filtered_query_hash(query_hash, version, search_filter)
+    if get_results_version(filtered_hash) is not None:
+        return filtered_hash, None
+    return filtered_hash, FilteredSearch(query.text, search_filter)
+
+
+def build_results_message(query_hash, message, title_to_show=None, result_filter=NO_FILTER, page=0,
+                          results_hash=None) -> ResultsMessage:
+    """
+    :param title_to_show: title of the filter if None
+    :param results_hash: hash of the results searched with the filter, the query hash if none were
+    """
+    results_hash = results_hash or query_hash
+    # Saved results are read back only when their pages are not rendered yet
+    pages = get_result_pages(results_hash, get_results_version(results_hash), message, result_filter,
+                             lambda: get_results(results_hash))
+    # Filters stay the ones of all the query results, even if only the filtered ones were searched for
+    index = get_result_index(query_hash, get_results_version(query_hash), lambda: get_results(query_hash)) \
+        if results_hash != query_hash else pages.index
+    if title_to_show is None:
+        title_to_show = get_filter_title(message, result_filter, index)
+    query = get_saved_query(query_hash)
+    derived = query is not None and query.is_derived
+    if derived:
+        title_to_show += "\n" + localized(message, 'derived_results', query.base_query)
+    response = build_results_page(query_hash, message, pages, title_to_show, page, result_filter, derived, index)
+    return ResultsMessage(response, results_hash, pages, page)
@@ -0,0 +1,200 @@
+import asyncio
+import os
+import threading
+import time
+from collections import Counter
+
+import dotenv
+
+from jackett import search_jackett, search_jackett_async, search_jackett_progressive, \
+    search_jackett_progressive_async, get_cached_age, JACKETT_SEARCH_MODE, JACKETT_CACHE_TTL_SECONDS
+from latency_model import latency_model, SEARCH_KEY
+from metrics import register_stats
+from query_log import QueryLog
+from search_scheduler import SearchScheduler, AsyncSearchScheduler, SearchRejected
+
+dotenv.load_dotenv()
+
+# Most popular queries of the query log kept in the Jackett cache, 0 - the cache is not warmed up and
+# searched queries are not logged
+CACHE_WARMER_QUERIES = int(os.getenv('CACHE_WARMER_QUERIES', 0))
+# Pause between two searches of the warmer, so it never takes more than one search slot of Jackett
+CACHE_WARMER_INTERVAL_SECONDS = float(os.getenv('CACHE_WARMER_INTERVAL_SECONDS', 10))
+# Cached results older than this are searched again, before they expire after JACKETT_CACHE_TTL_SECONDS
+CACHE_WARMER_REFRESH_AGE_SECONDS = float(os.getenv('CACHE_WARMER_REFRESH_AGE_SECONDS',
+                                                   JACKETT_CACHE_TTL_SECONDS * 0.8))
+# The warmer pauses while recent searches take this many times longer than the median one
+CACHE_WARMER_MAX_LATENCY_FACTOR = float(os.getenv('CACHE_WARMER_MAX_LATENCY_FACTOR', 2))
+# Time between checks of the top queries, and the pause while Jackett is slow or users wait for a search
+CACHE_WARMER_CHECK_SECONDS = 60
+# Searches of the warmer take their turn in the search queue as this user
+WARMER_USER_ID = 0
+
+query_log = QueryLog() if CACHE_WARMER_QUERIES else None
+if query_log is not None:
+    register_stats('query_log', query_log.stats)
+
+
+def record_search(text):
+    """
+    Log a searched query for the warmer, nothing if it's disabled
+    :param text: cleaned query text
+    """
+    if query_log is not None:
+        query_log.record(text)
+
+
+async def record_search_async(text):
+    """
+    Same as record_search, the write runs in a thread of the default executor
+    """
+    if query_log is not None:
+        await asyncio.to_thread(query_log.record, text)
+
+
+class CacheWarmer:
+    """
+    Keeps results of the most popular queries in the Jackett cache, so they are fresh after a restart and
+    don't expire between searches of users. Searches one query at a time in a background thread, each in a slot of
+    the search scheduler, and only while no user waits for one
+    """
+
+    def __init__(self, scheduler: SearchScheduler, log: QueryLog = None, queries=CACHE_WARMER_QUERIES,
+                 interval_seconds=CACHE_WARMER_INTERVAL_SECONDS, refresh_age_seconds=CACHE_WARMER_REFRESH_AGE_SECONDS,
+                 max_latency_factor=CACHE_WARMER_MAX_LATENCY_FACTOR):
+        self.scheduler = scheduler
+        self.log = log or query_log
+        self.queries = queries
+        self.interval_seconds = interval_seconds
+        self.refresh_age_seconds = refresh_age_seconds
+        self.max_latency_factor = max_latency_factor
+        self._counters = Counter()
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._run, name='cache-warmer', daemon=True).start()
+
+    def warm_up(self) -> bool:
+        """
+        Search the top queries that are not cached or are about to expire
+        :return: False if stopped because Jackett got slow or users wait for a search
+        """
+        for text, refreshed in self.get_due_queries():
+            if self._is_paused(self.scheduler.stats()['queued'], self.is_upstream_slow()):
+                return False
+            try:
+                with self.scheduler.slot(WARMER_USER_ID, text):
+                    self._search(text)
+            except SearchRejected:
+                self._count('rejected')
+                return False
+            self._count('refreshed' if refreshed else 'warmed')
+            time.sleep(self.interval_seconds)
+        return True
+
+    def get_due_queries(self) -> list[tuple[str, bool]]:
+        """
+        :return: text of the top queries to search and whether they are cached, most popular first
+        """
+        due = []
+        for logged in self.log.get_top(self.queries):
+            age = get_cached_age(logged.text)
+            if age is None or age >= self.refresh_age_seconds:
+                due.append((logged.text, age is not None))
+        return due
+
+    def is_upstream_slow(self) -> bool:
+        stats = latency_model.get_stats(SEARCH_KEY)
+        if not stats.known:
+            return False
+        return stats.seconds_ewma > self.max_latency_factor * stats.percentile(0.5)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counters)
+
+    def _is_paused(self, queued, slow) -> bool:
+        if queued:
+            self._count('paused_busy')
+        elif slow:
+            self._count('paused_slow')
+        return bool(queued or slow)
+
+    def _search(self, text):
+        # Forced, so results about to expire are replaced even if they are still fresh
+        if JACKETT_SEARCH_MODE == 'per_indexer':
+            search_jackett_progressive(text, force_refresh=True)
+        else:
+            search_jackett(text, force_refresh=True)
+
+    def _run(self):
+        while True:
+            try:
+                self.warm_up()
+            except Exception as e:
+                print("Cache warmer: failed to warm up: %s" % e)
+            time.sleep(CACHE_WARMER_CHECK_SECONDS)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+
+class AsyncCacheWarmer(CacheWarmer):
+    """
+    Same as CacheWarmer, but searches in a task of the running event loop. Reads of the query log and
+    the latency model run in threads of the default executor
+    """
+    scheduler: AsyncSearchScheduler
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def warm_up(self) -> bool:
+        for text, refreshed in await asyncio.to_thread(self.get_due_queries):
+            if self._is_paused(self.scheduler.stats()['queued'], await asyncio.to_thread(self.is_upstream_slow)):
+                return False
+            try:
+                async with self.scheduler.slot(WARMER_USER_ID, text):
+                    await self._search(text)
+            except SearchRejected:
+                self._count('rejected')
+                return False
+            self._count('refreshed' if refreshed else 'warmed')
+            await asyncio.sleep(self.interval_seconds)
+        return True
+
+    async def _search(self, text):
+        if JACKETT_SEARCH_MODE == 'per_indexer':
+            await search_jackett_progressive_async(text, force_refresh=True)
+        else:
+            await search_jackett_async(text, force_refresh=True)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.warm_up()
+            except Exception as e:
+                print("Cache warmer: failed to warm up: %s" % e)
+            await asyncio.sleep(CACHE_WARMER_CHECK_SECONDS)
+
+
+def start_cache_warmer(scheduler: SearchScheduler) -> CacheWarmer | None:
+    """
+    :param scheduler: the scheduler of user searches, the warmer waits for its turn in it
+    :return: None if warming up is disabled
+    """
+    return _start(CacheWarmer(scheduler)) if CACHE_WARMER_QUERIES else None
+
+
+def start_cache_warmer_async(scheduler: AsyncSearchScheduler) -> AsyncCacheWarmer | None:
+    """
+    Same as start_cache_warmer, must be called in the running event loop
+    """
+    return _start(AsyncCacheWarmer(scheduler)) if CACHE_WARMER_QUERIES else None
+
+
+def _start(warmer: CacheWarmer) -> CacheWarmer:
+    register_stats('cache_warmer', warmer.stats)
+    warmer.start()
+    return warmer
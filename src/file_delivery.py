@@ -0,0 +1,94 @@
+import asyncio
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Iterator
+
+import dotenv
+from telebot import apihelper
+from telebot.apihelper import ApiTelegramException
+
+from http_pool import session
+
+dotenv.load_dotenv()
+
+# Bot API accepts files up to 50 MB, a local Bot API server up to 2000 MB
+TELEGRAM_UPLOAD_LIMIT_BYTES = int(os.getenv('TELEGRAM_UPLOAD_LIMIT_BYTES', 50 * 1024 * 1024))
+MAX_PARALLEL_DOWNLOADS = int(os.getenv('MAX_PARALLEL_DOWNLOADS', 2))
+UPLOAD_TIMEOUT_SECONDS = int(os.getenv('UPLOAD_TIMEOUT_SECONDS', 600))
+UPLOAD_CHUNK_SIZE = 256 * 1024
+DEFAULT_API_URL = "https://api.telegram.org/bot{0}/{1}"
+
+# Every download keeps a worker (sync bot) or a semaphore slot (async bot) until the file is uploaded
+download_executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_DOWNLOADS, thread_name_prefix='download')
+download_semaphore = asyncio.Semaphore(MAX_PARALLEL_DOWNLOADS)
+
+
+def parse_download_command(text) -> tuple[str, int] | None:
+    """
+    :param text: /download_<torrent hash>_<file id>
+    :return: torrent hash and file id
+    """
+    try:
+        torrent_hash, file_id = text.split("/download_")[1].split('_')
+        return torrent_hash.lower(), int(file_id)
+    except (IndexError, ValueError):
+        return None
+
+
+def get_file_size(file: BinaryIO) -> int:
+    size = file.seek(0, os.SEEK_END)
+    file.seek(0)
+    return size
+
+
+class MultipartFileBody:
+    """
+    multipart/form-data body with one file, read from the file in chunks while it's being sent.
+    requests sends an iterable with a length as is, instead of building the whole body in memory
+    """
+
+    def __init__(self, fields: dict, file_field, file_name, file: BinaryIO):
+        self.boundary = uuid.uuid4().hex
+        self.file = file
+        self.file_size = get_file_size(file)
+        safe_file_name = file_name.replace('"', "'").replace('\r', ' ').replace('\n', ' ')
+        head = ''.join(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+                       for name, value in fields.items() if value is not None)
+        head += (f'--{self.boundary}\r\n'
+                 f'Content-Disposition: form-data; name="{file_field}"; filename="{safe_file_name}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n')
+        self.head = head.encode('utf-8')
+        self.tail = f'\r\n--{self.boundary}--\r\n'.encode()
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return len(self.head) + self.file_size + len(self.tail)
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self.head
+        self.file.seek(0)
+        while chunk := self.file.read(UPLOAD_CHUNK_SIZE):
+            yield chunk
+        yield self.tail
+
+
+def send_document_stream(token, chat_id, file: BinaryIO, file_name) -> dict:
+    """
+    Same as TeleBot.send_document, but the file isn't read into memory to build the request
+    :return: sent message as a dict
+    """
+    body = MultipartFileBody({'chat_id': chat_id}, 'document', file_name, file)
+    url = (apihelper.API_URL or DEFAULT_API_URL).format(token, 'sendDocument')
+    response = session.post(url, data=body, headers={'Content-Type': body.content_type},
+                            timeout=UPLOAD_TIMEOUT_SECONDS)
+    result = json.loads(response.text)
+    if not result.get('ok'):
+        # Same error as the bot raises, so the send queue retries it on 429
+        raise ApiTelegramException('sendDocument', response, result)
+    return result['result']
+
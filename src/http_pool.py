@@ -0,0 +1,139 @@
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import aiohttp
+import dotenv
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+dotenv.load_dotenv()
+
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 100))
+# Longest request of the async clients, longest wait for a connection or for the next bytes of the sync ones
+HTTP_TIMEOUT_SECONDS = int(os.getenv('HTTP_TIMEOUT_SECONDS', 120))
+HTTP_CONNECT_TIMEOUT_SECONDS = 10
+
+
+class CancellableRequests:
+    """
+    Sync requests that another thread can cut while they wait for the answer or read it: their sockets are shut down,
+    so the threads waiting in them are freed instead of waiting for the timeout
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self):
+        """
+        Requests made in the block by this thread are cut by cancel()
+        """
+        connections = set()
+        token = _tracked_connections.set((self, connections))
+        try:
+            yield
+        finally:
+            _tracked_connections.reset(token)
+            with self._lock:
+                self._connections -= connections
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except (AttributeError, OSError):
+                pass  # not connected or already closed
+
+    def _add(self, connection, connections: set) -> bool:
+        with self._lock:
+            if not self.cancelled:
+                self._connections.add(connection)
+                connections.add(connection)
+            return not self.cancelled
+
+
+# Requests of the current CancellableRequests.track() block and its connections
+_tracked_connections: ContextVar[tuple[CancellableRequests, set] | None] = ContextVar('tracked_connections',
+                                                                                      default=None)
+
+
+class CancellableConnectionMixin:
+    def getresponse(self, *args, **kwargs):
+        tracked = _tracked_connections.get()
+        if tracked is not None and not tracked[0]._add(self, tracked[1]):
+            raise ConnectionAbortedError("Request cancelled")
+        return super().getresponse(*args, **kwargs)
+
+
+class CancellableHTTPConnection(CancellableConnectionMixin, HTTPConnection):
+    pass
+
+
+class CancellableHTTPSConnection(CancellableConnectionMixin, HTTPSConnection):
+    pass
+
+
+class CancellableHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = CancellableHTTPConnection
+
+
+class CancellableHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = CancellableHTTPSConnection
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    Applies a default timeout to requests made without one, requests waits forever otherwise.
+    Its connections can be cut, see CancellableRequests
+    """
+
+    def __init__(self, timeout, **kwargs):
+        super().__init__(**kwargs)
+        self.timeout = timeout
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': CancellableHTTPConnectionPool,
+                                                   'https': CancellableHTTPSConnectionPool}
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=timeout if timeout is not None else self.timeout, **kwargs)
+
+
+# Keep-alive pool shared by all sync clients (Jackett, TorrServer, torrent downloads)
+session = requests.Session()
+_adapter = TimeoutHTTPAdapter((min(HTTP_CONNECT_TIMEOUT_SECONDS, HTTP_TIMEOUT_SECONDS), HTTP_TIMEOUT_SECONDS),
+                              pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+session.mount('http://', _adapter)
+session.mount('https://', _adapter)
+
+_async_session: aiohttp.ClientSession | None = None
+
+
+def get_async_session() -> aiohttp.ClientSession:
+    """
+    Keep-alive pool shared by all async clients. Must be called from the running event loop
+    """
+    global _async_session
+    if _async_session is None or _async_session.closed:
+        connector = aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT_SECONDS)
+        _async_session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _async_session
+
+
+async def close_async_session():
+    global _async_session
+    if _async_session is not None:
+        await _async_session.close()
+        _async_session = None
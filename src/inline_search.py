@@ -0,0 +1,78 @@
+import os
+import threading
+from dataclasses import dataclass
+
+import dotenv
+from cachetools import LRUCache
+
+from jackett import get_cached_results, find_cached_completion
+from search_state import get_query_hash, get_results, get_results_version
+
+dotenv.load_dotenv()
+
+# Inline queries shorter than this are not searched
+INLINE_MIN_QUERY_LENGTH = int(os.getenv('INLINE_MIN_QUERY_LENGTH', 3))
+# Telegram sends an inline query on every keystroke, Jackett is searched only for a query that isn't followed
+# by another one of the same user for this long
+INLINE_DEBOUNCE_SECONDS = float(os.getenv('INLINE_DEBOUNCE_SECONDS', 1))
+# Telegram drops answers given much later than the query, a search expected to take longer is answered right away
+# and only fills the cache for the next query
+INLINE_ANSWER_TIMEOUT_SECONDS = float(os.getenv('INLINE_ANSWER_TIMEOUT_SECONDS', 8))
+# Telegram keeps answers with results for everyone who sends the same query
+INLINE_CACHE_TIME_SECONDS = int(os.getenv('INLINE_CACHE_TIME_SECONDS', 300))
+# Settled inline queries searched at the same time, they still wait for a slot of the search scheduler
+INLINE_SEARCH_WORKERS = int(os.getenv('INLINE_SEARCH_WORKERS', 4))
+INLINE_PENDING_SIZE = 10000
+
+
+@dataclass
+class InlineResults:
+    query: str  # query the results are cached or saved for, they are selected from its results
+    results: list[dict]
+
+
+def find_inline_results(query) -> InlineResults | None:
+    """
+    Results of an inline query without searching Jackett: of the query from the Jackett cache, of a fetched query
+    the typed one completes or refines, or saved by an earlier search in the bot
+    :return: None if the query has to be searched
+    """
+    results = get_cached_results(query)
+    if results is not None:
+        return InlineResults(query, results)
+    completion = find_cached_completion(query)
+    if completion is not None:
+        return InlineResults(completion.base_query, completion.results)
+    query_hash = get_query_hash(query)
+    if get_results_version(query_hash) is not None:
+        return InlineResults(query, get_results(query_hash))
+    return None
+
+
+def get_inline_offset(inline_query) -> int:
+    # Offset of the next page is set by the bot, anything else is the first page
+    try:
+        return max(0, int(inline_query.offset or 0))
+    except ValueError:
+        return 0
+
+
+class Debouncer:
+    """
+    Pending delayed call of every user, a new one cancels the previous one
+    """
+
+    def __init__(self, size=INLINE_PENDING_SIZE):
+        self._pending = LRUCache(maxsize=size)
+        self._lock = threading.Lock()
+
+    def replace(self, user_id, call=None):
+        """
+        :param call: handle of the delayed call with cancel(), None to only cancel the pending one
+        """
+        with self._lock:
+            previous = self._pending.pop(user_id, None)
+            if call is not None:
+                self._pending[user_id] = call
+        if previous is not None:
+            previous.cancel()
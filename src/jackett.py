@@ -1,68 +1,444 @@
+import asyncio
 import os
-import string
-from random import random, choice
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from typing import Callable, Awaitable
+from xml.etree import ElementTree
 
+import aiohttp
 import dotenv
-import humanize
 import requests
-from cachetools import cached, TTLCache
-from cachetools_ext.fs import FSLRUCache
+from cachetools import TTLCache
 import hashlib
 
+from http_pool import session, get_async_session, CancellableRequests
+from jackett_parser import read_results, read_results_async, JACKETT_TOP_K
+from latency_model import latency_model, get_indexer_key, SEARCH_KEY
+from metrics import stage, record_stage, register_stats, submit_traced
+from query_index import QueryIndex, DerivedResults, normalize_query
+from ranking import rank_results, SearchResults, is_truncated
+from result_filters import SearchFilter, NO_SEARCH_FILTER
+from search_cache import SearchCache
+from shared_store import SqliteCache, SHARED_STORE_PATH
+
 dotenv.load_dotenv()
 
 JACKETT_SERVER_URL = os.getenv('JACKETT_SERVER_URL')
 JACKETT_API_KEY = os.getenv('JACKETT_API_KEY')
+# all - one request to the aggregated endpoint, per_indexer - parallel request per indexer with progressive results
+JACKETT_SEARCH_MODE = os.getenv('JACKETT_SEARCH_MODE', 'all')
+JACKETT_SEARCH_DEADLINE_SECONDS = int(os.getenv('JACKETT_SEARCH_DEADLINE_SECONDS', 60))
+# Comma separated indexer ids to search in per_indexer mode, all configured indexers if empty
+JACKETT_INDEXERS = [indexer.strip() for indexer in os.getenv('JACKETT_INDEXERS', '').split(',') if indexer.strip()]
+# Stop waiting for the indexers still searching once they usually bring less than this part of all results
+JACKETT_STRAGGLERS_RESULTS_SHARE = float(os.getenv('JACKETT_STRAGGLERS_RESULTS_SHARE', 0.1))
+# ...after this many more seconds. Negative - always wait until JACKETT_SEARCH_DEADLINE_SECONDS
+JACKETT_STRAGGLERS_GRACE_SECONDS = float(os.getenv('JACKETT_STRAGGLERS_GRACE_SECONDS', 1))
+JACKETT_MAX_PARALLEL_REQUESTS = int(os.getenv('JACKETT_MAX_PARALLEL_REQUESTS', 32))
+JACKETT_CACHE_TTL_SECONDS = int(os.getenv('JACKETT_CACHE_TTL_SECONDS', 900))
+# Older results are still shown right away while a fresh search runs in the background
+JACKETT_CACHE_STALE_TTL_SECONDS = int(os.getenv('JACKETT_CACHE_STALE_TTL_SECONDS', 3600))
+JACKETT_CACHE_MEMORY_SIZE = int(os.getenv('JACKETT_CACHE_MEMORY_SIZE', 32))
+JACKETT_CACHE_DISK_SIZE = int(os.getenv('JACKETT_CACHE_DISK_SIZE', 50))
+JACKETT_REFRESH_WORKERS = 4
+
+indexers_cache = TTLCache(maxsize=1, ttl=3600)  # configured indexers rarely change
+
+executor = ThreadPoolExecutor(max_workers=JACKETT_MAX_PARALLEL_REQUESTS, thread_name_prefix='jackett')
+# Background refreshes of stale results have threads of their own: a per-indexer refresh waits for requests
+# it submits to the executor above, it would starve there when all of its threads are busy
+refresh_executor = ThreadPoolExecutor(max_workers=JACKETT_REFRESH_WORKERS, thread_name_prefix='jackett-refresh')
+
+# Worker processes share the disk tier, so a search made by one of them is a cache hit for the others
+shared_disk = SqliteCache(SHARED_STORE_PATH, 'jackett', maxsize=JACKETT_CACHE_DISK_SIZE,
+                          ttl=JACKETT_CACHE_STALE_TTL_SECONDS) if SHARED_STORE_PATH else None
+cache = SearchCache(refresh_executor, memory_size=JACKETT_CACHE_MEMORY_SIZE, disk_size=JACKETT_CACHE_DISK_SIZE,
+                    ttl=JACKETT_CACHE_TTL_SECONDS, stale_ttl=JACKETT_CACHE_STALE_TTL_SECONDS, disk=shared_disk)
+register_stats('jackett_cache', cache.stats)
+# Narrower queries are answered from fetched results of this process while the cache would return them as fresh
+query_index = QueryIndex(ttl=JACKETT_CACHE_TTL_SECONDS)
+
+
+class JackettError(Exception):
+    pass
+
+
+@dataclass
+class SearchProgress:
+    """
+    State of a per-indexer search: ranked results merged so far and indexers still not answered
+    """
+    results: list[dict] = field(default_factory=SearchResults)
+    pending: list[str] = field(default_factory=list)
+    failed: list[str] = field(default_factory=list)
+    timed_out: list[str] = field(default_factory=list)
+
+    def add_batch(self, indexer_id, batch: list[dict]):
+        self.pending.remove(indexer_id)
+        # Same releases from different indexers are collapsed into one result
+        merged = rank_results(self.results + batch)
+        truncated = is_truncated(self.results) or is_truncated(batch) or len(merged) > JACKETT_TOP_K
+        self.results = SearchResults(merged[:JACKETT_TOP_K], truncated)
+
+    def add_failure(self, indexer_id):
+        self.pending.remove(indexer_id)
+        self.failed.append(indexer_id)
+
+    def time_out_pending(self):
+        self.timed_out.extend(self.pending)
+        self.pending.clear()
+
+
+def get_cache_key(query, search_filter: SearchFilter = NO_SEARCH_FILTER):
+    # Queries differing only in case, punctuation or order of words share the cache entry and the in-flight request
+    key = normalize_query(query) if search_filter == NO_SEARCH_FILTER else f'{normalize_query(query)}|{search_filter}'
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def find_cached_refinement(query) -> DerivedResults | None:
+    """
+    :return: fresh results of a broader query filtered by the rest of the words, None if Jackett should be searched
+    """
+    return query_index.find_refinement(query)
+
+
+def find_cached_completion(query) -> DerivedResults | None:
+    """
+    :return: fresh results of a fetched query that answer a query being typed, see QueryIndex.find_completion
+    """
+    return query_index.find_completion(query)
+
+
+def get_cached_results(query) -> list[dict] | None:
+    """
+    :return: results of the query from the cache, without searching Jackett, None if it's not cached
+    """
+    return cache.get(get_cache_key(query))
+
+
+def get_cached_age(query) -> float | None:
+    """
+    :return: seconds since the cached results of the query were fetched, None if it's not cached
+    """
+    return cache.get_age(get_cache_key(query))
+
 
-cache = FSLRUCache(maxsize=50, ttl=900)  # cahce for 15 minutes (900 seconds)
+def is_search_cached(query, search_filter: SearchFilter = NO_SEARCH_FILTER) -> bool:
+    """
+    :return: True if the search is answered without a new Jackett request
+    """
+    return cache.is_cached(get_cache_key(query, search_filter))
 
 
-@cached(cache, key=lambda query: hashlib.md5(query.encode()).hexdigest())
-def search_jackett(query):
-    print("Jackett: Searching for:", query)
+async def is_search_cached_async(query, search_filter: SearchFilter = NO_SEARCH_FILTER) -> bool:
+    """
+    Same as is_search_cached, the disk tier of the cache is read outside the event loop
+    """
+    return await cache.is_cached_async(get_cache_key(query, search_filter))
+
+
+def get_search_params(query, categories=()) -> list[tuple[str, str]]:
+    return [('apikey', JACKETT_API_KEY), ('Query', query)] + [('Category[]', str(category)) for category in categories]
+
+
+def search_jackett(query, force_refresh=False, search_filter: SearchFilter = NO_SEARCH_FILTER) -> list[dict]:
+    """
+    :param force_refresh: search Jackett even if the query is cached
+    :param search_filter: categories and indexer to search in, cached separately
+    """
+    try:
+        return cache.get_or_fetch(get_cache_key(query, search_filter), lambda: fetch_jackett(query, search_filter),
+                                  force=force_refresh)
+    except (JackettError, OSError, ValueError) as e:
+        print("Jackett: Query: %s, failed: %s" % (query, e))
+        return []
+
+
+async def search_jackett_async(query, force_refresh=False,
+                               search_filter: SearchFilter = NO_SEARCH_FILTER) -> list[dict]:
+    """
+    Same as search_jackett, but doesn't block a thread while waiting for Jackett. Shares the same cache
+    """
+    try:
+        return await cache.get_or_fetch_async(get_cache_key(query, search_filter),
+                                              lambda: fetch_jackett_async(query, search_filter), force=force_refresh)
+    except (JackettError, aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        print("Jackett: Query: %s, failed: %s" % (query, e))
+        return []
+
+
+def fetch_jackett(query, search_filter: SearchFilter = NO_SEARCH_FILTER) -> list[dict]:
+    print("Jackett: Searching for:", query, search_filter)
     # Construct the URL for the search API
-    search_url = f"{JACKETT_SERVER_URL}/api/v2.0/indexers/all/results?apikey={JACKETT_API_KEY}&Query={query}"
-
-    # Make the request to the Jackett API
-    response = requests.get(search_url)
-
-    # Initialize an empty list to hold the parsed results
-    parsed_results = []
-
-    print("Jackett: Query: %s, Status: %s" % (query, response.status_code))
-
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Parse the JSON response
-        results = response.json()
-
-        # Iterate through the results and extract the desired information
-        for result in results.get('Results', []):
-            # Extracting the required fields from each result
-            size = result.get('Size') if result.get('Size') else 0
-            # Convert size to human-readable format
-            human_readable_size = humanize.naturalsize(size, format='%.2f', binary=False) if size else "-"
-            # Generate UUID
-            id = ''.join(choice(string.ascii_uppercase + string.digits) for _ in range(6))
-            parsed_result = {
-                'id': id,
-                'title': result.get('Title'),
-                'size_bytes': size,  # Size in bytes
-                'size': human_readable_size,  # Size in bytes
-                'seeds': result.get('Seeders'),
-                'magnet': result.get('MagnetUri'),
-                'torrent': result.get('Link'),
-                'tracker': result.get('Tracker')
-            }
-            if parsed_result['torrent'] and parsed_result['torrent'].startswith('magnet:'):
-                parsed_result['torrent'] = None
-                parsed_results['magnet'] = result.get('Link')
-
-            parsed_results.append(parsed_result)
-
-        # Sort by seeds
-        parsed_results = sorted(parsed_results, key=lambda x: x['seeds'], reverse=True)
-
-        return parsed_results
-    else:
-        return f"Error: Received status code {response.status_code}"
+    search_url = f"{JACKETT_SERVER_URL}/api/v2.0/indexers/{search_filter.indexer}/results"
+
+    # Make the request to the Jackett API, the body is parsed while it's being downloaded
+    start_time = time.monotonic()
+    params = get_search_params(query, search_filter.categories)
+    with stage('jackett_search', search_filter.indexer), session.get(search_url, params=params,
+                                                                     stream=True) as response:
+        print("Jackett: Query: %s, Status: %s" % (query, response.status_code))
+
+        # Check if the request was successful
+        if response.status_code != 200:
+            raise JackettError(f"Received status code {response.status_code}")
+
+        results = rank_results(read_results(response))
+    remember_search(query, search_filter, results, time.monotonic() - start_time)
+    return results
+
+
+async def fetch_jackett_async(query, search_filter: SearchFilter = NO_SEARCH_FILTER) -> list[dict]:
+    print("Jackett: Searching for:", query, search_filter)
+    search_url = f"{JACKETT_SERVER_URL}/api/v2.0/indexers/{search_filter.indexer}/results"
+
+    start_time = time.monotonic()
+    with stage('jackett_search', search_filter.indexer):
+        params = get_search_params(query, search_filter.categories)
+        async with get_async_session().get(search_url, params=params) as response:
+            print("Jackett: Query: %s, Status: %s" % (query, response.status))
+            if response.status != 200:
+                raise JackettError(f"Received status code {response.status}")
+            results = rank_results(await read_results_async(response))
+    remember_search(query, search_filter, results, time.monotonic() - start_time, latency_model.record_later)
+    return results
+
+
+def remember_search(query, search_filter: SearchFilter, results: list[dict], seconds, record=latency_model.record):
+    """
+    :param record: records the duration in the latency model, latency_model.record_later in the event loop
+    """
+    # Filtered searches are neither usual searches nor a superset of narrower queries
+    if search_filter == NO_SEARCH_FILTER:
+        record(SEARCH_KEY, seconds, len(results))
+        query_index.add(query, results)
+
+
+def get_configured_indexers() -> list[str]:
+    if JACKETT_INDEXERS:
+        return JACKETT_INDEXERS
+    if 'indexers' in indexers_cache:
+        return indexers_cache['indexers']
+
+    response = session.get(get_indexers_url(), params=get_indexers_params())
+    response.raise_for_status()
+    indexers = indexers_cache['indexers'] = parse_indexers(response.text)
+    return indexers
+
+
+async def get_configured_indexers_async() -> list[str]:
+    if JACKETT_INDEXERS:
+        return JACKETT_INDEXERS
+    if 'indexers' in indexers_cache:
+        return indexers_cache['indexers']
+
+    async with get_async_session().get(get_indexers_url(), params=get_indexers_params()) as response:
+        response.raise_for_status()
+        indexers = indexers_cache['indexers'] = parse_indexers(await response.text())
+    return indexers
+
+
+def get_indexers_url():
+    # Torznab "indexers" capability works with the API key, unlike the admin /api/v2.0/indexers endpoint
+    return f"{JACKETT_SERVER_URL}/api/v2.0/indexers/all/results/torznab/api"
+
+
+def get_indexers_params():
+    return {'apikey': JACKETT_API_KEY, 't': 'indexers', 'configured': 'true'}
+
+
+def parse_indexers(xml_text) -> list[str]:
+    root = ElementTree.fromstring(xml_text)
+    return [indexer.get('id') for indexer in root.iter('indexer')]
+
+
+def get_indexer_search_url(indexer_id):
+    return f"{JACKETT_SERVER_URL}/api/v2.0/indexers/{indexer_id}/results"
+
+
+def search_indexer(indexer_id, query, timeout, cancellable: CancellableRequests = None) -> list[dict]:
+    """
+    :param cancellable: cuts the request when the search stops waiting for the indexer
+    """
+    url = get_indexer_search_url(indexer_id)
+    start_time = time.monotonic()
+    cancellable = cancellable or CancellableRequests()
+    try:
+        with stage('jackett_indexer', indexer_id), cancellable.track(), \
+                session.get(url, params=get_search_params(query), timeout=timeout, stream=True) as response:
+            print("Jackett: Indexer: %s, Query: %s, Status: %s" % (indexer_id, query, response.status_code))
+            response.raise_for_status()
+            results = read_results(response)
+    except Exception as e:
+        if isinstance(e, requests.Timeout) or cancellable.cancelled:
+            # Cut by the deadline, it would have taken at least this long
+            latency_model.record(get_indexer_key(indexer_id), time.monotonic() - start_time)
+        raise
+    latency_model.record(get_indexer_key(indexer_id), time.monotonic() - start_time, len(results))
+    return results
+
+
+async def search_indexer_async(indexer_id, query) -> list[dict]:
+    start_time = time.monotonic()
+    try:
+        with stage('jackett_indexer', indexer_id):
+            async with get_async_session().get(get_indexer_search_url(indexer_id),
+                                               params=get_search_params(query)) as response:
+                print("Jackett: Indexer: %s, Query: %s, Status: %s" % (indexer_id, query, response.status))
+                response.raise_for_status()
+                results = await read_results_async(response)
+    except (asyncio.CancelledError, asyncio.TimeoutError):
+        # Cut by the deadline, it would have taken at least this long
+        latency_model.record_later(get_indexer_key(indexer_id), time.monotonic() - start_time)
+        raise
+    latency_model.record_later(get_indexer_key(indexer_id), time.monotonic() - start_time, len(results))
+    return results
+
+
+def search_jackett_progressive(query, on_progress: Callable[[SearchProgress], None] = None,
+                               deadline_seconds=JACKETT_SEARCH_DEADLINE_SECONDS, force_refresh=False) -> SearchProgress:
+    """
+    Search every configured indexer in parallel and merge results as they arrive
+    :param on_progress: called after every answered indexer with the merged state
+    :param deadline_seconds: indexers that don't answer in time are reported as timed out
+    :param force_refresh: search Jackett even if the query is cached
+    """
+    progress = None
+
+    def fetch():
+        nonlocal progress
+        progress = fan_out_search(query, on_progress, deadline_seconds)
+        return get_results_to_cache(query, progress)
+
+    def refresh():
+        return get_results_to_cache(query, fan_out_search(query, None, deadline_seconds))
+
+    try:
+        results = cache.get_or_fetch(get_cache_key(query), fetch, refresh, force=force_refresh)
+    except (JackettError, OSError, ValueError) as e:
+        print("Jackett: Query: %s, failed: %s" % (query, e))
+        return progress or SearchProgress()
+
+    # Cached or shared with a concurrent search of the same query
+    return progress or SearchProgress(results=results)
+
+
+async def search_jackett_progressive_async(query, on_progress: Callable[[SearchProgress], Awaitable] = None,
+                                           deadline_seconds=JACKETT_SEARCH_DEADLINE_SECONDS,
+                                           force_refresh=False) -> SearchProgress:
+    """
+    Same as search_jackett_progressive, but every indexer request is a task in the running event loop
+    """
+    progress = None
+
+    async def fetch():
+        nonlocal progress
+        progress = await fan_out_search_async(query, on_progress, deadline_seconds)
+        return get_results_to_cache(query, progress)
+
+    async def refresh():
+        return get_results_to_cache(query, await fan_out_search_async(query, None, deadline_seconds))
+
+    try:
+        results = await cache.get_or_fetch_async(get_cache_key(query), fetch, refresh, force=force_refresh)
+    except (JackettError, aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        print("Jackett: Query: %s, failed: %s" % (query, e))
+        return progress or SearchProgress()
+
+    # Cached or shared with a concurrent search of the same query
+    return progress or SearchProgress(results=results)
+
+
+def fan_out_search(query, on_progress, deadline_seconds) -> SearchProgress:
+    print("Jackett: Searching per indexer for:", query)
+    indexers = get_configured_indexers()
+    progress = SearchProgress(pending=list(indexers))
+    start_time = time.monotonic()
+    deadline = start_time + deadline_seconds
+
+    cancellable = CancellableRequests()
+    futures = {submit_traced(executor, search_indexer, indexer_id, query, deadline_seconds, cancellable): indexer_id
+               for indexer_id in indexers}
+    not_done = set(futures)
+    while not_done and (timeout := deadline - time.monotonic()) > 0:
+        done, not_done = wait(not_done, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            collect_indexer_result(progress, futures[future], future)
+        if done:
+            deadline = get_adaptive_deadline(progress, indexers, deadline)
+        if done and on_progress is not None:
+            on_progress(progress)
+
+    # Requests still waiting for a thread are dropped, the ones in progress are cut to free their threads
+    for future in not_done:
+        future.cancel()
+    cancellable.cancel()
+
+    return finish_fan_out(query, progress, start_time)
+
+
+async def fan_out_search_async(query, on_progress, deadline_seconds) -> SearchProgress:
+    print("Jackett: Searching per indexer for:", query)
+    indexers = await get_configured_indexers_async()
+    progress = SearchProgress(pending=list(indexers))
+    start_time = time.monotonic()
+    deadline = start_time + deadline_seconds
+
+    tasks = {asyncio.create_task(search_indexer_async(indexer_id, query)): indexer_id for indexer_id in indexers}
+    not_done = set(tasks)
+    while not_done and (timeout := deadline - time.monotonic()) > 0:
+        done, not_done = await asyncio.wait(not_done, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            collect_indexer_result(progress, tasks[task], task)
+        if done:
+            deadline = get_adaptive_deadline(progress, indexers, deadline)
+        if done and on_progress is not None:
+            await on_progress(progress)
+
+    for task in not_done:
+        task.cancel()
+
+    return finish_fan_out(query, progress, start_time, latency_model.record_later)
+
+
+def collect_indexer_result(progress: SearchProgress, indexer_id, future):
+    try:
+        progress.add_batch(indexer_id, future.result())
+    except Exception as e:
+        print("Jackett: Indexer %s failed: %s" % (indexer_id, e))
+        progress.add_failure(indexer_id)
+
+
+def get_adaptive_deadline(progress: SearchProgress, indexers, deadline) -> float:
+    """
+    :return: earlier deadline if the indexers still searching are the ones that usually bring few results
+    """
+    if not progress.pending or JACKETT_STRAGGLERS_GRACE_SECONDS < 0:
+        return deadline
+    share = latency_model.get_results_share([get_indexer_key(indexer_id) for indexer_id in progress.pending],
+                                            [get_indexer_key(indexer_id) for indexer_id in indexers])
+    if share is None or share > JACKETT_STRAGGLERS_RESULTS_SHARE:
+        return deadline
+    return min(deadline, time.monotonic() + JACKETT_STRAGGLERS_GRACE_SECONDS)
+
+
+def finish_fan_out(query, progress: SearchProgress, start_time, record=latency_model.record) -> SearchProgress:
+    """
+    :param record: same as of remember_search
+    """
+    progress.time_out_pending()
+    if progress.timed_out:
+        print("Jackett: Query: %s, timed out indexers: %s" % (query, progress.timed_out))
+    for indexer_id in progress.timed_out:
+        record_stage('jackett_indexer', indexer_id, None, 'timeout')
+    record(SEARCH_KEY, time.monotonic() - start_time, len(progress.results))
+    return progress
+
+
+def get_results_to_cache(query, progress: SearchProgress) -> list[dict]:
+    # Don't remember "nothing found" when it's caused by broken or slow indexers
+    if not progress.results and (progress.failed or progress.timed_out):
+        raise JackettError("No indexer answered in time")
+    query_index.add(query, progress.results)
+    return progress.results
@@ -0,0 +1,175 @@
+import codecs
+import heapq
+import json
+import os
+import re
+from itertools import count
+from typing import Iterable, Iterator, AsyncIterable
+
+import dotenv
+
+from ranking import extract_infohash, SearchResults
+
+dotenv.load_dotenv()
+
+# Only this many best seeded results are kept per response, the rest is dropped while parsing
+JACKETT_TOP_K = int(os.getenv('JACKETT_TOP_K', 1000))
+CHUNK_SIZE = 64 * 1024
+
+
+class JsonArrayStreamParser:
+    """
+    Incremental parser of {"<key>": [ {...}, {...} ], ...} documents.
+    Text is fed in chunks and every complete array item is returned as soon as it's available,
+    so only one item and one chunk are kept in memory instead of the whole document
+    """
+
+    def __init__(self, key='Results'):
+        self._key_pattern = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+        self._key_length = len(key) + 8
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._state = 'seek_key'
+
+    def feed(self, text: str) -> list[dict]:
+        self._buffer += text
+        items = []
+
+        if self._state == 'seek_key':
+            match = self._key_pattern.search(self._buffer)
+            if match is None:
+                # Keep the tail, the key can be split between chunks
+                self._buffer = self._buffer[-self._key_length:]
+                return items
+            self._buffer = self._buffer[match.end():]
+            self._state = 'in_array'
+
+        if self._state == 'in_array':
+            position = self._read_items(items)
+            self._buffer = self._buffer[position:]
+
+        return items
+
+    def close(self):
+        if self._state == 'in_array':
+            raise ValueError("Unexpected end of JSON array")
+
+    def _read_items(self, items: list) -> int:
+        buffer = self._buffer
+        position = 0
+        length = len(buffer)
+        while True:
+            # Skip separators between items
+            while position < length and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == length:
+                return position
+            if buffer[position] == ']':
+                self._state = 'done'
+                return length
+            try:
+                item, position = self._decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Item is not complete yet, wait for the next chunk
+                return position
+            items.append(item)
+
+
+def iter_results(chunks: Iterable[bytes], key='Results') -> Iterator[dict]:
+    parser = JsonArrayStreamParser(key)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for chunk in chunks:
+        yield from parser.feed(decoder.decode(chunk))
+    yield from parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+
+
+async def iter_results_async(chunks: AsyncIterable[bytes], key='Results'):
+    parser = JsonArrayStreamParser(key)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    async for chunk in chunks:
+        for item in parser.feed(decoder.decode(chunk)):
+            yield item
+    for item in parser.feed(decoder.decode(b'', final=True)):
+        yield item
+    parser.close()
+
+
+def parse_result(result) -> dict:
+    # Extracting the required fields from each result
+    size = result.get('Size') if result.get('Size') else 0
+    parsed_result = {
+        'title': result.get('Title'),
+        'size_bytes': size,  # Size in bytes, human-readable size is made only for shown results
+        'seeds': result.get('Seeders') or 0,
+        'magnet': result.get('MagnetUri'),
+        'torrent': result.get('Link'),
+        'tracker': result.get('Tracker'),
+        'tracker_id': result.get('TrackerId'),
+        # Standard Torznab category if there is one, indexers add their own ones above 100000
+        'category': min(result.get('Category') or [0]),
+    }
+    if parsed_result['torrent'] and parsed_result['torrent'].startswith('magnet:'):
+        parsed_result['torrent'] = None
+        parsed_result['magnet'] = result.get('Link')
+    parsed_result['infohash'] = extract_infohash(result.get('InfoHash'), parsed_result['magnet'])
+    return parsed_result
+
+
+class TopResults:
+    """
+    Bounded min-heap of the best seeded raw Jackett results. Only kept results get parsed
+    """
+
+    def __init__(self, limit=JACKETT_TOP_K):
+        self.limit = limit
+        self.truncated = False  # some results were dropped
+        self._heap = []
+        self._sequence = count()  # keeps the original order for equal seeds
+
+    def push(self, result: dict):
+        entry = (result.get('Seeders') or 0, -next(self._sequence), result)
+        if len(self._heap) < self.limit:
+            heapq.heappush(self._heap, entry)
+        else:
+            self.truncated = True
+            if entry > self._heap[0]:
+                heapq.heapreplace(self._heap, entry)
+
+    def extend(self, results: Iterable[dict]):
+        for result in results:
+            self.push(result)
+
+    def to_list(self) -> SearchResults:
+        """
+        :return: parsed results sorted by seeds
+        """
+        return SearchResults([parse_result(result) for _, _, result in sorted(self._heap, reverse=True)],
+                             self.truncated)
+
+
+def select_top_results(results: Iterable[dict], limit=JACKETT_TOP_K) -> SearchResults:
+    top_results = TopResults(limit)
+    top_results.extend(results)
+    return top_results.to_list()
+
+
+def parse_results(results) -> SearchResults:
+    """
+    Parse an already decoded Jackett response
+    """
+    return select_top_results(results.get('Results', []))
+
+
+def read_results(response) -> SearchResults:
+    """
+    Parse a streamed requests response (stream=True) without loading the whole body
+    """
+    return select_top_results(iter_results(response.iter_content(chunk_size=CHUNK_SIZE)))
+
+
+async def read_results_async(response) -> SearchResults:
+    top_results = TopResults()
+    async for result in iter_results_async(response.content.iter_chunked(CHUNK_SIZE)):
+        top_results.push(result)
+    return top_results.to_list()
@@ -0,0 +1,200 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import dotenv
+
+from metrics import register_stats
+from shared_store import open_shared_db, SHARED_STORE_PATH
+
+dotenv.load_dotenv()
+
+# Samples are kept across restarts and shared by worker processes, ':memory:' keeps them in this process only
+LATENCY_MODEL_DB_PATH = os.getenv('LATENCY_MODEL_DB_PATH') or SHARED_STORE_PATH or os.path.join('cache', 'latency.db')
+# Recent samples per source the estimates are made of
+LATENCY_SAMPLES = int(os.getenv('LATENCY_SAMPLES', 100))
+# Fewer samples than this give no estimate, e.g. for a new indexer
+LATENCY_MIN_SAMPLES = int(os.getenv('LATENCY_MIN_SAMPLES', 5))
+LATENCY_EWMA_ALPHA = float(os.getenv('LATENCY_EWMA_ALPHA', 0.2))
+# Samples are read from the database in the background at most this often, samples of other workers are seen after it
+SNAPSHOT_TTL_SECONDS = 10
+
+SEARCH_KEY = 'search'  # whole Jackett search, as long as the user waits for it
+
+
+def get_indexer_key(indexer_id) -> str:
+    return f'indexer:{indexer_id}'
+
+
+def get_ewma(values, alpha=LATENCY_EWMA_ALPHA) -> float | None:
+    average = None
+    for value in values:
+        average = value if average is None else alpha * value + (1 - alpha) * average
+    return average
+
+
+class LatencyStats:
+    """
+    Estimates of one source made of its recent samples (oldest first)
+    """
+
+    def __init__(self, seconds: list[float], results: list[int]):
+        self.seconds = seconds
+        self.results = results
+        self._sorted = sorted(seconds)
+
+    @property
+    def known(self) -> bool:
+        return len(self.seconds) >= LATENCY_MIN_SAMPLES
+
+    @property
+    def seconds_ewma(self) -> float | None:
+        return get_ewma(self.seconds)
+
+    @property
+    def results_ewma(self) -> float | None:
+        return get_ewma(self.results)
+
+    def percentile(self, fraction) -> float | None:
+        if not self._sorted:
+            return None
+        return self._sorted[min(len(self._sorted) - 1, int(fraction * len(self._sorted)))]
+
+    def get_eta(self, elapsed=0.0) -> float | None:
+        """
+        :return: median remaining time of the samples that took longer than elapsed,
+        None if there is no estimate or it already takes longer than ever before
+        """
+        if not self.known:
+            return None
+        longer = [seconds for seconds in self._sorted if seconds > elapsed]
+        if not longer:
+            return None
+        return longer[len(longer) // 2] - elapsed
+
+    def summary(self) -> dict:
+        return {'samples': len(self.seconds), 'ewma': round(self.seconds_ewma or 0, 3),
+                'p50': self.percentile(0.5) or 0, 'p95': self.percentile(0.95) or 0}
+
+
+class LatencyModel:
+    """
+    Durations and result counts of searches and of every indexer, kept in SQLite.
+    Durations of timed out or cancelled requests are recorded as they were at that moment.
+    Estimates are made of the samples in memory, so they never wait for the database (e.g. in the event loop):
+    samples of this process are added right away, all of them are read again in the background
+    """
+
+    def __init__(self, path=LATENCY_MODEL_DB_PATH, samples=LATENCY_SAMPLES):
+        self.samples = samples
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()  # database
+        # Writes of record_later and background reads, one at a time and in the order they came
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='latency-writer')
+        self._samples_lock = threading.Lock()
+        self._samples: dict[str, deque[tuple[float, int | None]]] = {}  # key -> (seconds, results), oldest first
+        self._stats: dict[str, LatencyStats] = {}
+        self._read_at = 0.0
+        self._reading = False
+        self._db = open_shared_db(path)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS latency_samples (
+                key TEXT NOT NULL,
+                recorded_at REAL NOT NULL,
+                seconds REAL NOT NULL,
+                results INTEGER
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS latency_samples_key ON latency_samples (key, recorded_at)")
+        self._read_samples()
+
+    def record(self, key, seconds, results=None):
+        """
+        :param results: number of results, None if the request didn't finish
+        """
+        self._add_sample(key, seconds, results)
+        with self._lock:
+            try:
+                self._db.execute("BEGIN IMMEDIATE")
+                self._db.execute("INSERT INTO latency_samples VALUES (?, ?, ?, ?)",
+                                 (key, time.time(), seconds, results))
+                self._db.execute("""
+                    DELETE FROM latency_samples WHERE key = ? AND rowid NOT IN (
+                        SELECT rowid FROM latency_samples WHERE key = ? ORDER BY recorded_at DESC LIMIT ?)""",
+                                 (key, key, self.samples))
+                self._db.execute("COMMIT")
+            except sqlite3.Error as e:
+                print("Latency model: failed to record %s: %s" % (key, e))
+                if self._db.in_transaction:
+                    self._db.execute("ROLLBACK")
+
+    def record_later(self, key, seconds, results=None):
+        """
+        Same as record, but returns right away and writes in a background thread, for the event loop
+        """
+        self._writer.submit(self.record, key, seconds, results)
+
+    def get_stats(self, key) -> LatencyStats:
+        if time.monotonic() - self._read_at > SNAPSHOT_TTL_SECONDS:
+            self._read_later()
+        with self._samples_lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                samples = self._samples.get(key, ())
+                stats = self._stats[key] = LatencyStats([seconds for seconds, _ in samples],
+                                                        [results for _, results in samples if results is not None])
+        return stats
+
+    def get_eta(self, key, elapsed=0.0) -> float | None:
+        return self.get_stats(key).get_eta(elapsed)
+
+    def get_results_share(self, keys, all_keys) -> float | None:
+        """
+        :return: part of all results the keys usually bring, None if some of them are not known yet
+        """
+        expected = {}
+        for key in all_keys:
+            stats = self.get_stats(key)
+            if key in keys and not stats.known:
+                return None
+            expected[key] = stats.results_ewma or 0
+        total = sum(expected.values())
+        return sum(expected[key] for key in keys) / total if total else None
+
+    def _add_sample(self, key, seconds, results):
+        with self._samples_lock:
+            self._samples.setdefault(key, deque(maxlen=self.samples)).append((seconds, results))
+            self._stats.pop(key, None)
+
+    def _read_later(self):
+        with self._samples_lock:
+            if self._reading:
+                return
+            self._reading = True
+        self._writer.submit(self._read_samples)
+
+    def _read_samples(self):
+        # Samples of all processes, the table keeps at most self.samples of every key
+        try:
+            with self._lock:
+                rows = self._db.execute("SELECT key, seconds, results FROM latency_samples ORDER BY recorded_at"
+                                        ).fetchall()
+        except sqlite3.Error as e:
+            print("Latency model: failed to read samples: %s" % e)
+            rows = None
+        samples = {}
+        for key, seconds, results in rows or ():
+            samples.setdefault(key, deque(maxlen=self.samples)).append((seconds, results))
+        with self._samples_lock:
+            if rows is not None:
+                self._samples = samples
+                self._stats = {}
+            self._read_at = time.monotonic()
+            self._reading = False
+
+
+latency_model = LatencyModel()
+register_stats('search_latency', lambda: latency_model.get_stats(SEARCH_KEY).summary())
@@ -12,8 +12,12 @@ def load_locales(filepath):
 
 locales = load_locales(yaml_path)
 
-def localized(message, string_key, *args):
+def get_language(message):
     default_lang = 'en'
-    user_lang = message.from_user.language_code if message.from_user.language_code in locales else default_lang
+    return message.from_user.language_code if message.from_user.language_code in locales else default_lang
+
+
+def localized(message, string_key, *args):
+    user_lang = get_language(message)
     localized_string = locales.get(user_lang, {}).get(string_key, string_key)
     return localized_string.format(*args)
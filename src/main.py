@@ -1,312 +1,378 @@
-import dataclasses
-import hashlib
 import os
 import threading
-import time
-from collections import deque
-from dataclasses import dataclass, field
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import dotenv
 import telebot
-from cachetools import TTLCache
-
-from jackett import search_jackett
-from localization import localized
+from telebot.apihelper import ApiTelegramException
+
+from bot_common import prepare_download, find_selected_result, build_select_reply, find_inline_answer, \
+    is_inline_search_slow, build_inline_query_answer, get_progress_title, get_results_title, get_filtered_search, \
+    build_results_message, Download, ProgressEdits, WAIT_TIMEOUT_TO_NOTIFY_SECONDS
+from cache_warmer import record_search
+from file_delivery import send_document_stream, download_executor, TELEGRAM_UPLOAD_LIMIT_BYTES
+from jackett import search_jackett, search_jackett_progressive, find_cached_refinement, is_search_cached, \
+    JACKETT_SEARCH_MODE, JACKETT_CACHE_TTL_SECONDS, SearchProgress
+from inline_search import Debouncer, InlineResults, INLINE_DEBOUNCE_SECONDS, INLINE_ANSWER_TIMEOUT_SECONDS, \
+    INLINE_SEARCH_WORKERS
+from metrics import traced, stage, register_stats, submit_traced
+from prefetch import ThreadPrefetcher
+from responses import UserResponse, build_keyboard, build_search_time_alert, parse_results_callback, \
+    add_torrent_files_to_response, build_searching_response, is_refresh_callback, parse_refresh_callback, \
+    build_search_rejected_response, build_text_response, build_file_too_large_response
+from result_filters import ResultFilter, NO_FILTER
+from search_scheduler import SearchScheduler, SearchRejected
+from search_state import get_search_eta, clean_text, get_query_hash, save_results, get_results_version, \
+    are_results_older_than, get_saved_query, SavedQuery
+from send_queue import SendQueue, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from timers import scheduler
 from torrent_provider import get_torrent_info_by_magnet_link
-from torrserver import get_file_as_link
-from torrent import create_magnet_link_from_url
+from torrserver import download_file, FileTooLargeError
+from torrent import create_magnet_link_from_url, get_result_infohash
 
 dotenv.load_dotenv()
 
 bot = telebot.TeleBot(os.getenv('BOT_TOKEN'))
-
-results_cache = TTLCache(maxsize=10000, ttl=2_592_000)  # cache for 30 days
-
-MAX_QUERY_TEXT_LENGTH = 255
-WAIT_TIMEOUT_TO_NOTIFY_SECONDS = 15
-search_execution_times = deque(maxlen=5)
-
-
-def get_average_search_execution_time():
-    return round(sum(search_execution_times) / len(search_execution_times)) if search_execution_times else 0
-
-
-@dataclass
-class ResponseControl:
-    title: str = ""
-    action_key: str = ""
-    action_url: str = ""
-
-
-@dataclass
-class UserResponse:
-    user_id: int
-    message: str = ""
-    controls: list[ResponseControl] = field(default_factory=list)
-    files: list = field(default_factory=list)
-
-
-@dataclass
-class ResponseFile:
-    file_name: str = ""
-    file_bytes: bytes = ""
+# All outgoing messages go through it to stay within Telegram flood limits
+send_queue = SendQueue()
+register_stats('send_queue', send_queue.stats)
+# Top results of every shown list are fetched before they are selected, see PREFETCH_TOP_N
+# Results older than the Jackett cache are likely searched again instead of selected
+prefetcher = ThreadPrefetcher(lambda query_hash: are_results_older_than(query_hash, JACKETT_CACHE_TTL_SECONDS))
+register_stats('prefetch', prefetcher.stats)
+# Jackett searches of all users take turns for a limited number of slots, see SEARCH_MAX_PARALLEL
+search_scheduler = SearchScheduler()
+register_stats('search_scheduler', search_scheduler.stats)
+# Jackett searches of inline queries once the user stops typing
+inline_executor = ThreadPoolExecutor(max_workers=INLINE_SEARCH_WORKERS, thread_name_prefix='inline')
+inline_debouncer = Debouncer()
 
 
 @bot.message_handler(regexp="^/start")
-def select(message):
-    say(UserResponse(
-        user_id=message.from_user.id,
-        message=localized(message, 'start_message')
-    ))
+@traced('start')
+def start(message):
+    say(build_text_response(message, 'start_message'))
 
 
-@bot.message_handler(regexp="^/test_upload")
-def select(message):
-    print("Getting a file")
-    file_bytes = get_file_as_link('92656c49d99a3b30eee6d66b614d8d15afcaa794', 1)
-    print("Sending file")
-    bot.send_document(message.from_user.id, file_bytes, visible_file_name='test')
-
+@bot.message_handler(regexp="^/download")
+@traced('download')
+def download(message):
+    print("Received message from: %s, text: %s" % (message.from_user.id, message.text))
+    request, response = prepare_download(message)
+    message_id = say(response)
+    if request is not None:
+        # Downloads wait for a free worker, bot threads are not blocked
+        submit_traced(download_executor, deliver_file, message, request, message_id)
+
+
+def deliver_file(message, request: Download, message_id):
+    chat_id = message.from_user.id
+    try:
+        with stage('file_download'):
+            file = download_file(request.torrent_hash, request.file_id, TELEGRAM_UPLOAD_LIMIT_BYTES)
+    except FileTooLargeError as e:
+        return say(build_file_too_large_response(message, e.size), message_id)
+    except Exception as e:
+        print("Failed to download file %s of %s: %s" % (request.file_id, request.torrent_hash, e))
+        return say(build_text_response(message, 'download_failed'), message_id)
+
+    with file:
+        try:
+            # The upload takes minutes, it runs in this download thread once the flood limits allow it,
+            # so other messages to the chat don't wait for it
+            send_queue.reserve(chat_id, PRIORITY_LOW).result()
+            with stage('file_upload'):
+                send_document_stream(bot.token, chat_id, file, request.file_name)
+        except Exception as e:
+            print("Failed to send file %s of %s: %s" % (request.file_id, request.torrent_hash, e))
+            say(build_text_response(message, 'download_failed'), message_id)
 
 
 @bot.message_handler(regexp="^/select")
+@traced('select')
 def select(message):
     print("Received message from: %s, text: %s" % (message.from_user.id, message.text))
-    select_key = message.text.split("/select_")[1]
-
-    selected_result = find_item_by_select_key(select_key)
+    selected_result = find_selected_result(message)
 
     if selected_result is None:
-        return say(UserResponse(
-            user_id=message.from_user.id,
-            message=localized(message, 'option_not_found')
-        ))
-
-    title = selected_result["title"]
-    size = selected_result["size"]
-    seeds = selected_result["seeds"]
-    tracker = selected_result["tracker"] or 'Unknown tracker'
-    magnet_link = selected_result["magnet"]
-    torrent_link = selected_result["torrent"]
-
-    # Create magnet link from torrent of not present
-    magnet_link_from_torrent, is_torrent_file_present, torrent_file_content = create_magnet_link_from_url(torrent_link)
-    if torrent_link and not magnet_link:
-        magnet_link = magnet_link_from_torrent if magnet_link_from_torrent else localized(message,
-                                                                                          'missing_magnet_link')
-
-    # Upload torrent file document
-    torrent_file_bytes = torrent_file_content if is_torrent_file_present else None
-
-    html_hex = f'<a href="{magnet_link}">&#129522; Your magnet link</a>'.encode('utf-8').hex()
-
-    user_response = UserResponse(user_id=message.from_user.id,
-                                 message=f'<b>{title}</b>\n\n📄️{size} 🌱{seeds} 🏁<i>{tracker}</i>',
-                                 controls=[ResponseControl(title=localized(message, 'magnet_link'),
-                                                           action_url=f'https://asidko.github.io/html-render/?title=Download%20link&content={html_hex}')],
-                                 files=[ResponseFile(file_name=f'{title}.torrent', file_bytes=torrent_file_bytes)])
+        return say(build_text_response(message, 'option_not_found'))
+
+    user_response, magnet_link = build_select_reply(message, selected_result, create_magnet_link_from_url(
+        selected_result["torrent"], selected_result["tracker"], get_result_infohash(selected_result)))
     message_id = say(user_response)
 
     def edit_response_with_updated_data(current_response, message_id, torrent_info):
-        new_message = current_response.message
-        new_message += f'\n\n🗂️Files in torrent:\n'
-        new_message += '<code>'
-        limit = 10
-        for f in torrent_info.files:
-            if (limit := limit - 1) < 0:
-                new_message += '...'
-                break
-            new_message += f'{f.size} {f.title}\n'
-        new_message += '</code>'
-
-        new_response = dataclasses.replace(current_response, message=new_message)
-        say(new_response, message_id)
+        # Not worth waiting for, search results of other users go first
+        say_later(add_torrent_files_to_response(message, current_response, torrent_info), message_id, PRIORITY_LOW)
 
     get_torrent_info_by_magnet_link(magnet_link, lambda torrent_info: edit_response_with_updated_data(user_response,
                                                                                                       message_id,
                                                                                                       torrent_info))
 
 
-def find_item_by_select_key(select_key):
-    query_cache_key, item_id = select_key.split('_')
-    results = results_cache.get(query_cache_key, [])
-    return next((result for result in results if result['id'] == item_id), None)
+@bot.callback_query_handler(func=lambda call: is_refresh_callback(call.data))
+@traced('refresh')
+def refresh_results(call):
+    query = get_saved_query(parse_refresh_callback(call.data))
+    bot.answer_callback_query(call.id)
+
+    if query is None:
+        return say(build_text_response(call, 'search_expired'))
+
+    search(call, query.text, force_refresh=True)
 
 
 # handle button click
 @bot.callback_query_handler(func=lambda call: True)
+@traced('results_callback')
 def handle_query(call):
-    command, query_hash = call.data.split(':')
-    results = results_cache.get(query_hash, [])
+    result_filter, query_hash, page = parse_results_callback(call.data)
+    bot.answer_callback_query(call.id)
 
-    if not results:
-        return say(UserResponse(
-            user_id=call.from_user.id,
-            message=localized(call, 'search_expired')
-        ))
-
-    if command == "filter_less_size_2":
-        title = localized(call, 'filter_less_than_2gb')
-        results = list(filter(lambda x: x['size_bytes'] < 2 * 1024 * 1024 * 1024, results))
-        print_query_results(query_hash, call, results, title)
-        return
+    if result_filter is None or get_results_version(query_hash) is None:
+        return say(build_text_response(call, 'search_expired'))
 
-    if command == "filter_more_size_4":
-        title = localized(call, 'filter_more_than_4gb')
-        results = list(filter(lambda x: x['size_bytes'] > 4 * 1024 * 1024 * 1024, results))
-        print_query_results(query_hash, call, results, title)
-        return
+    results_hash = search_with_filter(query_hash, result_filter, call)
+    # Pages and filters replace the results message instead of sending a new one
+    try:
+        print_query_results(query_hash, call, None, call.message.message_id, result_filter, page,
+                            results_hash=results_hash)
+    except ApiTelegramException as e:
+        # Double click on the same button
+        if 'message is not modified' not in str(e):
+            raise
 
-    if command == "filter_more_size_10":
-        title = localized(call, 'filter_more_than_10gb')
-        results = list(filter(lambda x: x['size_bytes'] > 10 * 1024 * 1024 * 1024, results))
-        print_query_results(query_hash, call, results, title)
-        return
 
+def say(response: UserResponse, message_id_to_edit=None, priority=PRIORITY_HIGH) -> int:
+    return say_later(response, message_id_to_edit, priority).result()
 
-def say(response: UserResponse, message_id_to_edit=None) -> int:
-    keyboard = None
 
-    if len(response.controls) > 0:
-        keyboard = telebot.types.InlineKeyboardMarkup(row_width=2)
-        for control in response.controls:
-            params = {'text': control.title, 'callback_data': control.action_key} if control.action_key else {
-                'text': control.title, 'url': control.action_url}
-            keyboard.add(telebot.types.InlineKeyboardButton(**params))
+def say_later(response: UserResponse, message_id_to_edit=None, priority=PRIORITY_HIGH) -> Future:
+    """
+    Queue the response to be sent within Telegram rate limits
+    :return: future with the id of the sent or edited message
+    """
+    keyboard = build_keyboard(response)
 
     if message_id_to_edit is None:
-        message = bot.send_message(response.user_id, response.message, parse_mode="HTML", reply_markup=keyboard)
+        def send():
+            return bot.send_message(response.user_id, response.message, parse_mode="HTML",
+                                    reply_markup=keyboard).message_id
+
+        future = send_queue.submit(response.user_id, send, priority)
     else:
-        message = bot.edit_message_text(response.message, response.user_id, message_id_to_edit, parse_mode="HTML",
-                                        reply_markup=keyboard)
+        def send():
+            bot.edit_message_text(response.message, response.user_id, message_id_to_edit, parse_mode="HTML",
+                                  reply_markup=keyboard)
+            return message_id_to_edit
+
+        future = send_queue.submit(response.user_id, send, priority, edit_key=(response.user_id, message_id_to_edit))
 
     for file in response.files:
         if file.file_bytes:
-            bot.send_document(response.user_id, file.file_bytes, visible_file_name=file.file_name)
+            send_queue.submit(response.user_id, lambda file=file: bot.send_document(
+                response.user_id, file.file_bytes, visible_file_name=file.file_name), priority)
 
-    return message.message_id
+    return future
 
 
 @bot.message_handler(content_types=['text'], regexp="^[^/]")
+@traced('search')
 def get_text_messages(message):
-    text = message.text
-
     print("Received message from: %s, text: %s" % (message.from_user.id, message.text))
+    search(message, message.text)
+
+
+@bot.inline_handler(func=lambda inline_query: True)
+@traced('inline')
+def inline_search(inline_query):
+    text = clean_text(inline_query.query)
+    answer_now, found = find_inline_answer(inline_query, text)
+    if answer_now:
+        inline_debouncer.replace(inline_query.from_user.id)
+        return answer_inline_query(inline_query, found)
+
+    # Not cached: Jackett is searched only for the last query of a user who stopped typing
+    inline_debouncer.replace(inline_query.from_user.id, scheduler.call_later(
+        INLINE_DEBOUNCE_SECONDS, submit_traced, inline_executor, search_inline, inline_query, text))
+
+
+def search_inline(inline_query, text):
+    """
+    Search Jackett for a settled inline query and answer it with the results
+    """
+    record_search(text)
+    answered = is_inline_search_slow()
+    if answered:
+        answer_inline_query(inline_query, None, 'inline_still_searching')
+
+    try:
+        with search_scheduler.slot(inline_query.from_user.id, text, cached=is_search_cached(text)):
+            if JACKETT_SEARCH_MODE == 'per_indexer':
+                results = search_jackett_progressive(text, deadline_seconds=INLINE_ANSWER_TIMEOUT_SECONDS).results
+            else:
+                results = search_jackett(text)
+    except SearchRejected:
+        if not answered:
+            answer_inline_query(inline_query, None, 'inline_busy')
+        return
 
-    say(UserResponse(
-        user_id=message.from_user.id,
-        message=localized(message, 'searching_for', text)
-    ))
+    save_results(get_query_hash(text), results, SavedQuery(text))
+    if not answered:
+        answer_inline_query(inline_query, InlineResults(text, results))
+
+
+def answer_inline_query(inline_query, found: InlineResults | None, button_key=None):
+    """
+    Same parameters as of build_inline_query_answer
+    """
+    answer = build_inline_query_answer(inline_query, found, button_key)
+    try:
+        bot.answer_inline_query(inline_query.id, answer.results, next_offset=answer.next_offset, button=answer.button,
+                                cache_time=answer.cache_time)
+    except ApiTelegramException as e:
+        # Queries answered too late are rejected, the user has typed something else meanwhile
+        print("Failed to answer inline query %s: %s" % (inline_query.query, e))
+
+
+def search(message, text, force_refresh=False):
+    """
+    :param force_refresh: search Jackett even if the query can be answered from cached results
+    """
+    record_search(clean_text(text))
+    derived = find_cached_refinement(clean_text(text)) if not force_refresh else None
+    if derived is not None:
+        query_hash = get_query_hash(derived.query)
+        save_results(query_hash, derived.results, SavedQuery(derived.query, derived.base_query))
+        return print_query_results(query_hash, message, get_results_title(message))
+
+    searching_message_id = say(build_searching_response(message, text, get_search_eta()))
 
     text = clean_text(text)
-    results = threaded_search_jackett(text, message)
-    query_hash = hashlib.md5(text.encode()).hexdigest()
-    results_cache[query_hash] = results
+    if JACKETT_SEARCH_MODE == 'per_indexer':
+        return search_jackett_per_indexer(text, message, searching_message_id, force_refresh)
+
+    try:
+        results = search_jackett_with_progress_alert(
+            text, message, lambda query: search_jackett(query, force_refresh=force_refresh), searching_message_id,
+            cached=not force_refresh and is_search_cached(text))
+    except SearchRejected as e:
+        return say(build_search_rejected_response(message, e), searching_message_id)
+    query_hash = get_query_hash(text)
+    save_results(query_hash, results, SavedQuery(text))
 
     if not results:
-        return say(UserResponse(
-            user_id=message.from_user.id,
-            message=localized(message, 'nothing_found')
-        ))
-
-    print_query_results(query_hash, message, results, localized(message, 'results_by_popularity'))
-
-
-def threaded_search_jackett(text, message) -> list[dict]:
-    start_time = time.time()
-    result = []
-
-    def run_search():
-        nonlocal result
-        result = search_jackett(text)
-
-    search_thread = threading.Thread(target=run_search)
-    search_thread.start()
-
-    # Start a separate thread to log a warning message after 8 seconds
+        return say(build_text_response(message, 'nothing_found'))
+
+    print_query_results(query_hash, message, get_results_title(message))
+
+
+def search_jackett_per_indexer(text, message, searching_message_id, force_refresh=False):
+    """
+    Show results of the fastest indexers right away by editing the "searching for..." message
+    """
+    query_hash = get_query_hash(text)
+    edits = ProgressEdits()
+
+    def show_progress(progress: SearchProgress):
+        if not edits.is_due(progress):
+            return
+
+        # Partial results can already be selected
+        save_results(query_hash, progress.results, SavedQuery(text))
+        try:
+            print_query_results(query_hash, message, get_progress_title(message, text, progress),
+                                searching_message_id, priority=PRIORITY_NORMAL)
+        except ApiTelegramException as e:
+            print("Failed to show search progress: %s" % e)
+
+    try:
+        progress = search_jackett_with_progress_alert(
+            text, message, lambda query: search_jackett_progressive(query, show_progress, force_refresh=force_refresh),
+            searching_message_id, cached=not force_refresh and is_search_cached(text))
+    except SearchRejected as e:
+        return say(build_search_rejected_response(message, e), searching_message_id)
+    save_results(query_hash, progress.results, SavedQuery(text))
+
+    if not progress.results:
+        return say(build_text_response(message, 'nothing_found'), searching_message_id)
+
+    print_query_results(query_hash, message, get_results_title(message, progress), searching_message_id)
+
+
+def search_jackett_with_progress_alert(text, message, search=search_jackett, searching_message_id=None, cached=False):
+    """
+    Search in a slot of the search scheduler
+    :param searching_message_id: "searching for..." message to show the queue position in while waiting
+    :param cached: the search is answered without asking Jackett, it doesn't wait for a slot
+    :raise SearchRejected: if the search is not run
+    """
+    search_finished = threading.Event()
+    queue_position_shown = False
+
+    # Notify the user only if the search is still running after the timeout
     def say_warning():
-        time.sleep(WAIT_TIMEOUT_TO_NOTIFY_SECONDS)
-        if search_thread.is_alive():
-
-            average_time = get_average_search_execution_time()
+        if search_finished.is_set():
+            return
+        say_later(build_search_time_alert(message, get_search_eta(WAIT_TIMEOUT_TO_NOTIFY_SECONDS)),
+                  priority=PRIORITY_NORMAL)
+
+    def show_queue_position(position):
+        nonlocal queue_position_shown
+        queue_position_shown = True
+        say_later(build_searching_response(message, text, get_search_eta(), position), searching_message_id,
+                  PRIORITY_NORMAL)
+
+    alert_call = scheduler.call_later(WAIT_TIMEOUT_TO_NOTIFY_SECONDS, say_warning)
+    try:
+        with search_scheduler.slot(message.from_user.id, text,
+                                   show_queue_position if searching_message_id is not None else None, cached):
+            if queue_position_shown:
+                say_later(build_searching_response(message, text, get_search_eta()), searching_message_id,
+                          PRIORITY_NORMAL)
+            result = search(text)
+    finally:
+        search_finished.set()
+        alert_call.cancel()
 
-            if average_time < WAIT_TIMEOUT_TO_NOTIFY_SECONDS:
-                alert = localized(message, 'search_time_alert_takes_longer')
-            else:
-                alert = localized(message, 'search_time_alert', average_time)
+    return result
 
-            say(UserResponse(
-                user_id=message.from_user.id,
-                message=alert
-            ))
 
-    alert_thread = threading.Thread(target=say_warning)
-    alert_thread.start()
+def search_with_filter(query_hash, result_filter: ResultFilter, message) -> str:
+    """
+    Search Jackett with the filter if needed, see get_filtered_search
+    :return: hash of the results to filter
+    """
+    filtered_hash, filtered = get_filtered_search(query_hash, result_filter)
+    if filtered is None:
+        return filtered_hash
+
+    try:
+        results = search_jackett_with_progress_alert(
+            filtered.text, message, lambda text: search_jackett(text, search_filter=filtered.search_filter),
+            cached=is_search_cached(filtered.text, filtered.search_filter))
+    except SearchRejected as e:
+        print("Filtered search of %s is not run: %s" % (filtered.text, e.reason))
+        return query_hash
+    if not results:
+        return query_hash
+    save_results(filtered_hash, results, SavedQuery(filtered.text))
+    return filtered_hash
 
-    search_thread.join()
-    alert_thread.join()
 
-    end_time_seconds = time.time() - start_time
-    if end_time_seconds >= 5:  # ignore fast cached searches
-        search_execution_times.append(end_time_seconds)
+def print_query_results(query_hash, message, title_to_show=None, message_id_to_edit=None, result_filter=NO_FILTER,
+                        page=0, priority=PRIORITY_HIGH, results_hash=None):
+    """
+    Same parameters as of build_results_message
+    """
+    results = build_results_message(query_hash, message, title_to_show, result_filter, page, results_hash)
+    say(results.response, message_id_to_edit, priority)
+    if prefetcher.enabled:
+        prefetcher.prefetch(results.results_hash, results.get_shown_results())
 
-    return result
 
+if __name__ == '__main__':
+    # Kept for existing deployments, see app.py
+    from app import create_app
 
-def clean_text(text):
-    text = text[:MAX_QUERY_TEXT_LENGTH]
-    text = text.lower().strip()
-    return text
-
-
-def print_query_results(query_hash, message, results, title_to_show):
-    def make_row(result):
-        id = result.get('id')
-        title = result.get('title')
-        size = result.get('size')
-        seeds = result.get('seeds')
-        tracker = result.get('tracker')
-        command = f"/select_{query_hash}_{id}"
-        m_t_indicator = "Ⓜ" if result.get('magnet') else ""
-        m_t_indicator += "Ⓣ" if result.get('torrent') else ""
-
-        return f"{title}\n{command}\n📄️{size} 🌱{seeds} 🏁<i>{tracker}</i> {m_t_indicator}\n\n"
-
-    result_message = title_to_show + "\n\n"
-    for result in results:
-        row = make_row(result)
-        if len(result_message) + len(row) > 4096:
-            break
-        result_message += row
-
-    controls = create_filter_controls(query_hash, message, results)
-    say(UserResponse(
-        user_id=message.from_user.id,
-        message=result_message,
-        controls=controls
-    ))
-
-
-def create_filter_controls(query_hash, message, results) -> list[ResponseControl]:
-    sizes_gb = [result['size_bytes'] / (1024 ** 3) for result in results if result['size_bytes']]
-    hasLessThan2GB = any(size < 2 for size in sizes_gb)
-    hasMoreThan4GB = any(size > 4 for size in sizes_gb)
-    hasMoreThan10GB = any(size > 10 for size in sizes_gb)
-    allAreLessThan2GB = all(size < 2 for size in sizes_gb)
-    allAreMoreThan4GB = all(size > 4 for size in sizes_gb)
-    allAreMoreThan10GB = all(size > 10 for size in sizes_gb)
-
-    controls = []
-    if hasLessThan2GB and not allAreLessThan2GB:
-        controls.append(
-            ResponseControl(title=localized(message, 'less_than_2_gb'), action_key=f"filter_less_size_2:{query_hash}"))
-    if hasMoreThan4GB and not allAreMoreThan4GB:
-        controls.append(
-            ResponseControl(title=localized(message, 'more_than_4_gb'), action_key=f"filter_more_size_4:{query_hash}"))
-    if hasMoreThan10GB and not allAreMoreThan10GB:
-        controls.append(ResponseControl(title=localized(message, 'more_than_10_gb'),
-                                        action_key=f"filter_more_size_10:{query_hash}"))
-    return controls
-
-
-bot.infinity_polling(timeout=60, long_polling_timeout=2)
+    create_app().run()
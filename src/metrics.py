@@ -0,0 +1,238 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable
+
+import dotenv
+
+dotenv.load_dotenv()
+
+# Port of the Prometheus endpoint (GET /metrics), 0 - disabled
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+# Print every finished stage with the trace id of the request it belongs to
+METRICS_TRACE_LOG = os.getenv('METRICS_TRACE_LOG', 'false').lower() == 'true'
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+current_trace_id = contextvars.ContextVar('trace_id', default=None)
+
+
+def format_labels(labelnames, labelvalues) -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(labelnames, labelvalues)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        lines += [f'{self.name}{format_labels(self.labelnames, key)} {value}' for key, value in values]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket..., count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[index] += 1
+            values[-2] += 1
+            values[-1] += value
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for key, counts in values:
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                bucket_labels = format_labels(self.labelnames + ('le',), key + (bound,))
+                lines.append(f'{self.name}_bucket{bucket_labels} {count}')
+            lines.append(f'{self.name}_count{format_labels(self.labelnames, key)} {counts[-2]}')
+            lines.append(f'{self.name}_sum{format_labels(self.labelnames, key)} {counts[-1]}')
+        return lines
+
+
+class StatsGauge:
+    """
+    Numbers from stats() of the bot components (caches, queues), read when metrics are scraped
+    """
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._sources: dict[str, Callable[[], dict]] = {}
+
+    def register(self, component, stats: Callable[[], dict]):
+        self._sources[component] = stats
+
+    def collect(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        for component, stats in list(self._sources.items()):
+            try:
+                values = stats()
+            except Exception as e:
+                print("Metrics: failed to read stats of %s: %s" % (component, e))
+                continue
+            lines += [f'{self.name}{format_labels(("component", "stat"), (component, stat))} {value}'
+                      for stat, value in values.items() if isinstance(value, (int, float))]
+        return lines
+
+
+stage_seconds = Histogram('bot_stage_seconds', 'Duration of a request stage', ['stage', 'source'])
+stage_total = Counter('bot_stage_total', 'Finished request stages by outcome', ['stage', 'source', 'outcome'])
+component_stats = StatsGauge('bot_component', 'Counters, in-flight counts and queue depths of bot components')
+metrics = [stage_seconds, stage_total, component_stats]
+
+
+def register_stats(component, stats: Callable[[], dict]):
+    component_stats.register(component, stats)
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in metrics:
+        lines += metric.collect()
+    return '\n'.join(lines) + '\n'
+
+
+class Stage:
+    __slots__ = ('name', 'source', 'outcome', 'started_at')
+
+    def __init__(self, name, source):
+        self.name = name
+        self.source = source
+        self.outcome = 'ok'  # can be changed inside the block, e.g. to 'timeout'
+        self.started_at = time.perf_counter()
+
+
+@contextmanager
+def stage(name, source=''):
+    """
+    Measure a stage of the current request, an exception is counted as 'error' outcome
+    """
+    current = Stage(name, source)
+    try:
+        yield current
+    except asyncio.CancelledError:
+        current.outcome = 'cancelled'
+        raise
+    except BaseException:
+        current.outcome = 'error'
+        raise
+    finally:
+        record_stage(name, source, time.perf_counter() - current.started_at, current.outcome)
+
+
+def record_stage(name, source, seconds, outcome='ok'):
+    if seconds is not None:
+        stage_seconds.observe(seconds, stage=name, source=source)
+    stage_total.inc(stage=name, source=source, outcome=outcome)
+    trace_id = current_trace_id.get()
+    if METRICS_TRACE_LOG and trace_id is not None:
+        print("Trace %s: %s %s in %.3f s" % (trace_id, f'{name} {source}' if source else name, outcome, seconds or 0))
+
+
+@contextmanager
+def trace(trace_id=None):
+    token = current_trace_id.set(trace_id or uuid.uuid4().hex[:12])
+    try:
+        yield
+    finally:
+        current_trace_id.reset(token)
+
+
+def get_request_trace_id(message) -> str:
+    # Callback queries have their own id, messages are unique within a chat
+    if getattr(message, 'message_id', None) is not None:
+        return f'{message.chat.id}-{message.message_id}'
+    return str(message.id)
+
+
+def traced(stage_name):
+    """
+    Decorator of a bot handler: the update gets a trace id and the whole handler is measured as a stage
+    """
+    def decorator(handler):
+        if asyncio.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def async_wrapper(message, *args, **kwargs):
+                with trace(get_request_trace_id(message)), stage(stage_name):
+                    return await handler(message, *args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(handler)
+        def wrapper(message, *args, **kwargs):
+            with trace(get_request_trace_id(message)), stage(stage_name):
+                return handler(message, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def submit_traced(executor: Executor, fn, *args) -> Future:
+    """
+    executor.submit that keeps the trace id of the caller in the worker thread
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def start_metrics_server(port=METRICS_PORT):
+    class RequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = render_metrics().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), RequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    print("Metrics: listening on port %s" % port)
+    return server
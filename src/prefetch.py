@@ -0,0 +1,150 @@
+import asyncio
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from typing import Callable
+
+import dotenv
+from cachetools import LRUCache
+
+from torrent import create_magnet_link_from_url, create_magnet_link_from_url_async, get_result_infohash
+from torrent_provider import prefetch_torrent_info, prefetch_torrent_info_async
+
+dotenv.load_dotenv()
+
+# Magnet links, .torrent files and file lists of this many top results of a shown list are fetched
+# before they are selected, 0 - disabled
+PREFETCH_TOP_N = int(os.getenv('PREFETCH_TOP_N', 0))
+# Results prefetched at the same time by all users together, they don't take workers of /select
+PREFETCH_MAX_PARALLEL = int(os.getenv('PREFETCH_MAX_PARALLEL', 2))
+# Results waiting to be prefetched, more are not prefetched at all
+PREFETCH_QUEUE_SIZE = int(os.getenv('PREFETCH_QUEUE_SIZE', 50))
+PREFETCH_LISTS_SIZE = 1000
+
+
+class Prefetcher:
+    """
+    Warms torrent and TorrServer caches for the top results of a list while the user reads it.
+    Results of a list that is shown again (next progress update, another page) replace the queued ones,
+    and prefetching stops once the results are expired. A /select waiting for a stopped prefetch resolves the torrent
+    itself
+    """
+
+    def __init__(self, is_expired: Callable[[str], bool], top_n=PREFETCH_TOP_N, queue_size=PREFETCH_QUEUE_SIZE):
+        """
+        :param is_expired: tells if the results of a query hash can't be selected anymore
+        """
+        self.top_n = top_n
+        self.queue_size = queue_size
+        self._is_expired = is_expired
+        # query hash -> number of the last shown list of it, queued results of earlier lists are skipped
+        self._lists = LRUCache(maxsize=PREFETCH_LISTS_SIZE)
+        self._list_numbers = count(1)
+        self._queued = 0
+        self._lock = threading.Lock()
+        self._counters = Counter()
+
+    @property
+    def enabled(self) -> bool:
+        return self.top_n > 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counters, queued=self._queued)
+
+    def _queue(self, query_hash, results: list[dict]) -> list[tuple[int, dict]]:
+        """
+        :return: list number and results to prefetch, within the queue size
+        """
+        with self._lock:
+            list_number = self._lists[query_hash] = next(self._list_numbers)
+            results = results[:self.top_n]
+            queued = results[:max(0, self.queue_size - self._queued)]
+            self._queued += len(queued)
+            self._counters['queued_total'] += len(queued)
+            self._counters['dropped'] += len(results) - len(queued)
+        return [(list_number, result) for result in queued]
+
+    def _is_outdated(self, query_hash, list_number) -> bool:
+        with self._lock:
+            self._queued -= 1
+            outdated = self._lists.get(query_hash) != list_number
+        if outdated or self._is_expired(query_hash):
+            self._count('cancelled')
+            return True
+        return False
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+
+class ThreadPrefetcher(Prefetcher):
+    def __init__(self, is_expired: Callable[[str], bool], top_n=PREFETCH_TOP_N, max_parallel=PREFETCH_MAX_PARALLEL,
+                 queue_size=PREFETCH_QUEUE_SIZE):
+        super().__init__(is_expired, top_n, queue_size)
+        # Own workers, so prefetching never delays a /select of another user
+        self._executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix='prefetch')
+
+    def prefetch(self, query_hash, results: list[dict]):
+        """
+        :param results: shown results, best first
+        """
+        for list_number, result in self._queue(query_hash, results):
+            self._executor.submit(self._prefetch_result, query_hash, list_number, result)
+
+    def _prefetch_result(self, query_hash, list_number, result):
+        if self._is_outdated(query_hash, list_number):
+            return
+        try:
+            magnet_link = result['magnet']
+            if result['torrent']:
+                magnet_link_from_torrent, _, _ = create_magnet_link_from_url(result['torrent'], result['tracker'],
+                                                                            get_result_infohash(result))
+                magnet_link = magnet_link or magnet_link_from_torrent
+            if magnet_link and not self._is_expired(query_hash):
+                prefetch_torrent_info(magnet_link, lambda: self._is_expired(query_hash))
+            self._count('prefetched')
+        except Exception as e:
+            self._count('failed')
+            print("Prefetch: failed for %s: %s" % (result.get('title'), e))
+
+
+class AsyncPrefetcher(Prefetcher):
+    """
+    Same as ThreadPrefetcher, but prefetches in tasks of the running event loop
+    """
+
+    def __init__(self, is_expired: Callable[[str], bool], top_n=PREFETCH_TOP_N, max_parallel=PREFETCH_MAX_PARALLEL,
+                 queue_size=PREFETCH_QUEUE_SIZE):
+        super().__init__(is_expired, top_n, queue_size)
+        self._semaphore = asyncio.Semaphore(max_parallel)
+        self._tasks = set()
+
+    def prefetch(self, query_hash, results: list[dict]):
+        """
+        :param results: shown results, best first
+        """
+        for list_number, result in self._queue(query_hash, results):
+            task = asyncio.create_task(self._prefetch_result(query_hash, list_number, result))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _prefetch_result(self, query_hash, list_number, result):
+        async with self._semaphore:
+            if self._is_outdated(query_hash, list_number):
+                return
+            try:
+                magnet_link = result['magnet']
+                if result['torrent']:
+                    magnet_link_from_torrent, _, _ = await create_magnet_link_from_url_async(
+                        result['torrent'], result['tracker'], get_result_infohash(result))
+                    magnet_link = magnet_link or magnet_link_from_torrent
+                if magnet_link and not self._is_expired(query_hash):
+                    await prefetch_torrent_info_async(magnet_link, lambda: self._is_expired(query_hash))
+                self._count('prefetched')
+            except Exception as e:
+                self._count('failed')
+                print("Prefetch: failed for %s: %s" % (result.get('title'), e))
@@ -0,0 +1,179 @@
+import bisect
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, Counter
+from dataclasses import dataclass
+
+import dotenv
+
+from ranking import SearchResults, is_truncated
+
+dotenv.load_dotenv()
+
+# Recently fetched queries whose results can answer narrower queries without Jackett
+QUERY_INDEX_SIZE = int(os.getenv('QUERY_INDEX_SIZE', 200))
+# A narrower query with fewer local matches than this is searched in Jackett
+QUERY_INDEX_MIN_RESULTS = int(os.getenv('QUERY_INDEX_MIN_RESULTS', 5))
+# Shorter query words must match a title word exactly, longer ones match its beginning ("2160" - "2160p")
+PREFIX_MATCH_MIN_LENGTH = 3
+
+# Letters and digits, everything else (spaces, dots of release names, dashes, brackets) separates words
+WORD_PATTERN = re.compile(r'[^\W_]+')
+
+
+def get_query_tokens(text) -> list[str]:
+    # NFKC folds full-width and compatibility forms, casefold is lower() for all scripts
+    text = unicodedata.normalize('NFKC', text).casefold().replace('ё', 'е')
+    return WORD_PATTERN.findall(text)
+
+
+def normalize_query(text) -> str:
+    """
+    :return: the same string for queries that differ only in case, whitespace, punctuation, unicode forms
+    or order of words
+    """
+    return ' '.join(sorted(set(get_query_tokens(text))))
+
+
+@dataclass
+class DerivedResults:
+    query: str
+    base_query: str  # fetched query the results are filtered from
+    results: list[dict]
+
+
+class IndexedQuery:
+    """
+    Results of a fetched query with a word index of their titles, built on the first refinement
+    """
+    __slots__ = ('query', 'tokens', 'results', 'fetched_at', '_words', '_positions')
+
+    def __init__(self, query, tokens: frozenset[str], results: list[dict], fetched_at: float):
+        self.query = query
+        self.tokens = tokens
+        self.results = results
+        self.fetched_at = fetched_at
+        self._words = None  # sorted distinct title words
+        self._positions = None  # title word -> positions of results
+
+    def filter(self, tokens) -> list[dict]:
+        """
+        :return: results, in their order, whose titles have every token
+        """
+        if not tokens:
+            return SearchResults(self.results, is_truncated(self.results))
+        if self._words is None:
+            self._build()
+        positions = None
+        for token in tokens:
+            matches = set()
+            for word in self._get_matching_words(token):
+                matches |= self._positions[word]
+            positions = matches if positions is None else positions & matches
+            if not positions:
+                return []
+        return SearchResults([self.results[position] for position in sorted(positions)], is_truncated(self.results))
+
+    def _build(self):
+        positions = {}
+        for position, result in enumerate(self.results):
+            for word in get_query_tokens(result.get('title') or ''):
+                positions.setdefault(word, set()).add(position)
+        self._positions = positions
+        self._words = sorted(positions)
+
+    def _get_matching_words(self, token) -> list[str]:
+        if len(token) < PREFIX_MATCH_MIN_LENGTH:
+            return [token] if token in self._positions else []
+        start = bisect.bisect_left(self._words, token)
+        end = start
+        while end < len(self._words) and self._words[end].startswith(token):
+            end += 1
+        return self._words[start:end]
+
+
+class QueryIndex:
+    """
+    Answers a query with the fresh results of a fetched query whose words are a part of it,
+    e.g. "ubuntu 24.04 desktop" with the results of "ubuntu 24.04" that have "desktop" in the title
+    """
+
+    def __init__(self, ttl, size=QUERY_INDEX_SIZE, min_results=QUERY_INDEX_MIN_RESULTS):
+        self.ttl = ttl
+        self.size = size
+        self.min_results = min_results
+        self._queries: OrderedDict[str, IndexedQuery] = OrderedDict()  # normalized query -> entry
+        self._queries_by_token: dict[str, set[str]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, query, results: list[dict], fetched_at=None):
+        tokens = frozenset(get_query_tokens(query))
+        if not tokens:
+            return
+        key = ' '.join(sorted(tokens))
+        entry = IndexedQuery(query, tokens, results, fetched_at or time.time())
+        with self._lock:
+            self._remove(key)
+            self._queries[key] = entry
+            for token in tokens:
+                self._queries_by_token.setdefault(token, set()).add(key)
+            while len(self._queries) > self.size:
+                self._remove(next(iter(self._queries)))
+
+    def find_refinement(self, query) -> DerivedResults | None:
+        tokens = frozenset(get_query_tokens(query))
+        now = time.time()
+        with self._lock:
+            exact = self._queries.get(' '.join(sorted(tokens)))
+            if exact is not None and now - exact.fetched_at <= self.ttl:
+                return None  # the search cache has it as is
+            # Fetched queries that have only words of this query, counted by words in common
+            common = Counter(key for token in tokens for key in self._queries_by_token.get(token, ()))
+            candidates = [self._queries[key] for key, count in common.items()
+                          if count == len(self._queries[key].tokens) < len(tokens)
+                          and now - self._queries[key].fetched_at <= self.ttl]
+
+        # The closest query first, it has the fewest results to filter out
+        for entry in sorted(candidates, key=lambda entry: (-len(entry.tokens), -entry.fetched_at)):
+            results = entry.filter(tokens - entry.tokens)
+            if len(results) >= self.min_results:
+                return DerivedResults(query, entry.query, results)
+        return None
+
+    def find_completion(self, query) -> DerivedResults | None:
+        """
+        Same as find_refinement for a query that is still being typed: its last word may be the beginning of a word
+        of a fetched query, "ubuntu desk" is answered with the results of "ubuntu desktop" too. The exact query counts
+        :return: fresh results of the fetched query with the most words in common, None if there are none
+        """
+        tokens = get_query_tokens(query)
+        if not tokens:
+            return None
+        complete, last = frozenset(tokens[:-1]), tokens[-1]
+        now = time.time()
+        with self._lock:
+            candidates = [entry for entry in self._queries.values() if now - entry.fetched_at <= self.ttl
+                          and all(token in complete or token == last
+                                  or (len(last) >= PREFIX_MATCH_MIN_LENGTH and token.startswith(last))
+                                  for token in entry.tokens)]
+
+        for entry in sorted(candidates, key=lambda entry: (-len(entry.tokens), -entry.fetched_at)):
+            # The last word is matched by a word of the query, or by beginnings of title words
+            completed = any(token == last or token.startswith(last) for token in entry.tokens)
+            results = entry.filter(complete - entry.tokens if completed else (complete | {last}) - entry.tokens)
+            if results:
+                return DerivedResults(query, entry.query, results)
+        return None
+
+    def _remove(self, key):
+        entry = self._queries.pop(key, None)
+        if entry is None:
+            return
+        for token in entry.tokens:
+            keys = self._queries_by_token.get(token)
+            keys.discard(key)
+            if not keys:
+                del self._queries_by_token[token]
@@ -0,0 +1,108 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+import dotenv
+
+from query_index import normalize_query
+from shared_store import open_shared_db, SHARED_STORE_PATH
+
+dotenv.load_dotenv()
+
+# Searched queries are kept across restarts and shared by worker processes, ':memory:' keeps them in this process only
+QUERY_LOG_DB_PATH = os.getenv('QUERY_LOG_DB_PATH') or SHARED_STORE_PATH or os.path.join('cache', 'queries.db')
+# Queries kept in the log, the least popular ones are dropped beyond it
+QUERY_LOG_SIZE = int(os.getenv('QUERY_LOG_SIZE', 1000))
+# A search counts half as much after this time, so recent searches outweigh old ones
+QUERY_LOG_HALF_LIFE_SECONDS = int(os.getenv('QUERY_LOG_HALF_LIFE_SECONDS', 24 * 3600))
+# The log is trimmed to its size after this many new queries
+TRIM_INTERVAL = 100
+
+
+@dataclass
+class LoggedQuery:
+    text: str  # as last typed, to search Jackett with
+    searches: int
+    searched_at: float
+
+
+class QueryLog:
+    """
+    Searched queries with their popularity, kept in SQLite: one row per normalized query.
+    The score is log2 of the sum of 2^(t / half_life) over the times t of its searches, so ordering by it is ordering
+    by the number of searches decayed to now, and a search only updates its own row
+    """
+
+    def __init__(self, path=QUERY_LOG_DB_PATH, size=QUERY_LOG_SIZE, half_life=QUERY_LOG_HALF_LIFE_SECONDS):
+        self.size = size
+        self.half_life = half_life
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._added = 0
+        self._db = open_shared_db(path)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS query_log (
+                key TEXT NOT NULL PRIMARY KEY,
+                text TEXT NOT NULL,
+                searches INTEGER NOT NULL,
+                searched_at REAL NOT NULL,
+                score REAL NOT NULL
+            ) WITHOUT ROWID""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS query_log_score ON query_log (score)")
+
+    def record(self, text):
+        """
+        :param text: cleaned query text
+        """
+        key = normalize_query(text)
+        if not key:
+            return
+        now = time.time()
+        with self._lock:
+            try:
+                self._db.execute("BEGIN IMMEDIATE")
+                row = self._db.execute("SELECT score FROM query_log WHERE key = ?", (key,)).fetchone()
+                score = self._add_search(row[0] if row is not None else None, now)
+                self._db.execute("""
+                    INSERT INTO query_log VALUES (?, ?, 1, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET text = excluded.text, searches = searches + 1,
+                        searched_at = excluded.searched_at, score = excluded.score""", (key, text, now, score))
+                if row is None:
+                    self._added += 1
+                    if self._added % TRIM_INTERVAL == 0:
+                        self._trim()
+                self._db.execute("COMMIT")
+            except sqlite3.Error as e:
+                print("Query log: failed to record %s: %s" % (text, e))
+                if self._db.in_transaction:
+                    self._db.execute("ROLLBACK")
+
+    def get_top(self, count) -> list[LoggedQuery]:
+        """
+        :return: the most popular queries, most popular first
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT text, searches, searched_at FROM query_log ORDER BY score DESC LIMIT ?",
+                                    (count,)).fetchall()
+        return [LoggedQuery(*row) for row in rows]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'queries': self._db.execute("SELECT COUNT(*) FROM query_log").fetchone()[0]}
+
+    def _add_search(self, score, searched_at) -> float:
+        exponent = searched_at / self.half_life
+        if score is None:
+            return exponent
+        # log2(2^score + 2^exponent) without overflowing
+        high, low = max(score, exponent), min(score, exponent)
+        return high + math.log2(1 + 2 ** (low - high))
+
+    def _trim(self):
+        self._db.execute("""
+            DELETE FROM query_log WHERE key NOT IN (SELECT key FROM query_log ORDER BY score DESC LIMIT ?)""",
+                         (self.size,))
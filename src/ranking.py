@@ -0,0 +1,116 @@
+import base64
+import math
+import os
+import re
+
+import dotenv
+
+dotenv.load_dotenv()
+
+# score = seeds weight * log(1 + seeds) + size weight * log(1 + size in GB)
+#         + sources weight * (number of trackers - 1) + tracker weight
+RANKING_SEEDS_WEIGHT = float(os.getenv('RANKING_SEEDS_WEIGHT', 1.0))
+RANKING_SIZE_WEIGHT = float(os.getenv('RANKING_SIZE_WEIGHT', 0.0))
+RANKING_SOURCES_WEIGHT = float(os.getenv('RANKING_SOURCES_WEIGHT', 0.0))
+# Comma separated tracker=weight pairs, e.g. "rutracker=0.5,1337x=-0.2"
+RANKING_TRACKER_WEIGHTS = {
+    tracker.strip().lower(): float(weight)
+    for tracker, _, weight in (pair.partition('=') for pair in os.getenv('RANKING_TRACKER_WEIGHTS', '').split(','))
+    if tracker.strip() and weight.strip()
+}
+
+INFOHASH_PATTERN = re.compile(r'xt=urn:btih:([0-9a-fA-F]{40}|[2-7A-Za-z]{32})')
+
+
+def extract_infohash(*sources) -> str | None:
+    """
+    :param sources: infohash strings or magnet links, the first recognized one wins
+    :return: lowercase hex infohash
+    """
+    for source in sources:
+        if not source:
+            continue
+        if source.startswith('magnet:'):
+            match = INFOHASH_PATTERN.search(source)
+            if match is None:
+                continue
+            source = match.group(1)
+        if len(source) == 40:
+            return source.lower()
+        if len(source) == 32:
+            try:
+                return base64.b32decode(source.upper()).hex()
+            except ValueError:
+                continue
+    return None
+
+
+class SearchResults(list):
+    """
+    Results of a search, truncated if some of the found ones were dropped to keep only the best seeded ones
+    """
+    truncated = False
+
+    def __init__(self, results=(), truncated=False):
+        super().__init__(results)
+        self.truncated = truncated
+
+
+def is_truncated(results: list[dict]) -> bool:
+    """
+    :return: True if results of a search may miss some found ones, False for plain lists
+    """
+    return getattr(results, 'truncated', False)
+
+
+def get_dedup_key(result: dict):
+    # Same release from different trackers has the same infohash. Without it, same title and size is a good guess
+    return result.get('infohash') or ((result.get('title') or '').strip().lower(), result.get('size_bytes'))
+
+
+def merge_duplicates(results: list[dict]) -> list[dict]:
+    """
+    Collapse copies of the same release into one result in a single pass.
+    Seeds are the best of the copies (the swarm is shared), trackers and download sources are combined
+    """
+    merged = {}
+    for result in results:
+        key = get_dedup_key(result)
+        existing = merged.get(key)
+        if existing is None:
+            result = dict(result)
+            result['trackers'] = list(result.get('trackers') or ([result['tracker']] if result.get('tracker') else []))
+            merged[key] = result
+            continue
+
+        existing['seeds'] = max(existing.get('seeds') or 0, result.get('seeds') or 0)
+        existing['magnet'] = existing.get('magnet') or result.get('magnet')
+        existing['torrent'] = existing.get('torrent') or result.get('torrent')
+        existing['size_bytes'] = existing.get('size_bytes') or result.get('size_bytes')
+        for tracker in result.get('trackers') or [result.get('tracker')]:
+            if tracker and tracker not in existing['trackers']:
+                existing['trackers'].append(tracker)
+
+    for result in merged.values():
+        result['tracker'] = ', '.join(result['trackers']) or None
+    return list(merged.values())
+
+
+def score(result: dict) -> float:
+    trackers = result.get('trackers') or []
+    size_gb = (result.get('size_bytes') or 0) / (1024 ** 3)
+    tracker_weight = max((RANKING_TRACKER_WEIGHTS.get(tracker.lower(), 0) for tracker in trackers), default=0)
+    return (RANKING_SEEDS_WEIGHT * math.log1p(result.get('seeds') or 0)
+            + RANKING_SIZE_WEIGHT * math.log1p(size_gb)
+            + RANKING_SOURCES_WEIGHT * (len(trackers) - 1)
+            + tracker_weight)
+
+
+def rank_results(results: list[dict]) -> SearchResults:
+    """
+    Deduplicate and order by score. With default weights the order is by seeds, as before
+    """
+    merged = merge_duplicates(results)
+    # Tie on score keeps the input order, which is by seeds
+    merged.sort(key=score, reverse=True)
+    return SearchResults(merged, is_truncated(results))
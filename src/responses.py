@@ -0,0 +1,444 @@
+import dataclasses
+import html
+import itertools
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Callable
+
+import dotenv
+import humanize
+import telebot
+from cachetools import LRUCache
+
+from file_delivery import TELEGRAM_UPLOAD_LIMIT_BYTES
+from localization import localized, get_language
+from result_filters import ResultFilter, ResultIndex, NO_FILTER, SIZE_FILTERS, SORTS, MIN_SEEDS, encode_filter, \
+    decode_filter
+from search_scheduler import SearchRejected
+
+dotenv.load_dotenv()
+
+MAX_MESSAGE_LENGTH = 4096
+# Room for the title and the page counter
+PAGE_TEXT_LIMIT = MAX_MESSAGE_LENGTH - 512
+FILES_TO_SHOW_LIMIT = 10
+FOLDERS_TO_SHOW_LIMIT = 5
+# Telegram allows at most 50 results in an answer to an inline query
+INLINE_PAGE_SIZE = 50
+# Button of derived results, "refresh:<query hash>"
+REFRESH_ACTION = 'refresh'
+RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', 500))
+
+# Trackers with the most results get a filter button
+TRACKER_BUTTONS_LIMIT = 4
+CATEGORY_BUTTONS_PER_ROW = 4
+
+
+def format_size(size_bytes) -> str:
+    return humanize.naturalsize(size_bytes, format='%.2f', binary=False) if size_bytes else "-"
+
+
+@dataclass
+class ResponseControl:
+    title: str = ""
+    action_key: str = ""
+    action_url: str = ""
+    row: int | None = None  # controls with the same row are shown side by side
+
+
+@dataclass
+class UserResponse:
+    user_id: int
+    message: str = ""
+    controls: list[ResponseControl] = field(default_factory=list)
+    files: list = field(default_factory=list)
+
+
+@dataclass
+class ResponseFile:
+    file_name: str = ""
+    file_bytes: bytes = ""
+
+
+@dataclass
+class InlineAnswer:
+    results: list
+    next_offset: str = ""  # empty if there are no more results
+    button: telebot.types.InlineQueryResultsButton | None = None
+    cache_time: int = 0  # seconds Telegram keeps the answer for everyone who sends the same query
+
+
+@dataclass
+class ResultPages:
+    rows: list[str]  # rendered rows after the filter
+    positions: list[int]  # positions of the results of the rows
+    page_starts: list[int]  # index of the first row of every page
+    index: ResultIndex  # of all results, tells which filters are worth showing
+
+    @property
+    def page_count(self) -> int:
+        return len(self.page_starts) if self.rows else 0
+
+    def page_end(self, page) -> int:
+        return self.page_starts[page + 1] if page + 1 < len(self.page_starts) else len(self.rows)
+
+    def page_text(self, page) -> str:
+        if not self.rows:
+            return ""
+        return ''.join(self.rows[self.page_starts[page]:self.page_end(page)])
+
+
+# (query hash, version[, language, filter]) -> rendered rows, result index or pages
+render_cache = LRUCache(maxsize=RENDER_CACHE_SIZE)
+render_cache_lock = threading.Lock()
+
+
+def build_keyboard(response: UserResponse) -> telebot.types.InlineKeyboardMarkup | None:
+    if len(response.controls) == 0:
+        return None
+
+    keyboard = telebot.types.InlineKeyboardMarkup(row_width=2)
+    # Controls without a row get a row of their own
+    row_keys = (control.row if control.row is not None else f'single_{index}'
+                for index, control in enumerate(response.controls))
+    for _, row_controls in itertools.groupby(zip(row_keys, response.controls), key=lambda pair: pair[0]):
+        buttons = []
+        for _, control in row_controls:
+            params = {'text': control.title, 'callback_data': control.action_key} if control.action_key else {
+                'text': control.title, 'url': control.action_url}
+            buttons.append(telebot.types.InlineKeyboardButton(**params))
+        keyboard.row(*buttons)
+    return keyboard
+
+
+def build_text_response(message, key, *args) -> UserResponse:
+    """
+    :param key: locale key of the text, formatted with args
+    """
+    return UserResponse(
+        user_id=message.from_user.id,
+        message=localized(message, key, *args)
+    )
+
+
+def build_file_too_large_response(message, size_bytes) -> UserResponse:
+    return build_text_response(message, 'file_too_large', format_size(size_bytes),
+                               format_size(TELEGRAM_UPLOAD_LIMIT_BYTES))
+
+
+def build_searching_response(message, text, eta_seconds, queue_position=0) -> UserResponse:
+    """
+    :param queue_position: position of the search waiting for a free slot, 0 if it's running
+    """
+    searching = localized(message, 'searching_for', text)
+    if queue_position:
+        searching += "\n" + localized(message, 'search_queue_position', queue_position)
+    if eta_seconds is not None:
+        searching += "\n" + localized(message, 'search_eta', eta_seconds)
+    return UserResponse(
+        user_id=message.from_user.id,
+        message=searching
+    )
+
+
+def build_search_rejected_response(message, rejected: SearchRejected) -> UserResponse:
+    return UserResponse(
+        user_id=message.from_user.id,
+        message=localized(message, 'search_' + rejected.reason, rejected.waiting)
+    )
+
+
+def build_search_time_alert(message, eta_seconds) -> UserResponse:
+    """
+    :param eta_seconds: expected remaining time, None if the search already takes longer than usual
+    """
+    if eta_seconds is None:
+        alert = localized(message, 'search_time_alert_takes_longer')
+    else:
+        alert = localized(message, 'search_time_alert', eta_seconds)
+
+    return UserResponse(
+        user_id=message.from_user.id,
+        message=alert
+    )
+
+
+def build_inline_answer(inline_query, query_hash, results: list[dict] | None, offset=0,
+                        button_key=None, cache_time=0) -> InlineAnswer:
+    """
+    :param query_hash: saved query to /select the results from in the bot, None if they are not saved
+    :param results: None if the query is not searched yet
+    :param button_key: text of a button above the results that opens the bot
+    """
+    page = (results or [])[offset:offset + INLINE_PAGE_SIZE]
+    articles = [build_inline_result(query_hash, offset + index, result) for index, result in enumerate(page)]
+    next_offset = str(offset + INLINE_PAGE_SIZE) if results and offset + INLINE_PAGE_SIZE < len(results) else ""
+    if button_key is None and results is not None and not results:
+        button_key = 'inline_nothing_found'
+    button = telebot.types.InlineQueryResultsButton(localized(inline_query, button_key), start_parameter='inline') \
+        if button_key is not None else None
+    return InlineAnswer(articles, next_offset, button, cache_time)
+
+
+def build_inline_result(query_hash, position, result) -> telebot.types.InlineQueryResultArticle:
+    title = result.get('title') or '-'
+    details = f"📄️{format_size(result.get('size_bytes'))} 🌱{result.get('seeds')} 🏁{result.get('tracker')}"
+    # Sent to a chat the bot may not be in, so it has everything to download the torrent without the bot
+    text = f"<b>{html.escape(title)}</b>\n{html.escape(details)}"
+    if query_hash is not None:
+        text += f"\n/select_{query_hash}_{result.get('id')}"
+    magnet_link = result.get('magnet')
+    if magnet_link and len(text) + len(magnet_link) < MAX_MESSAGE_LENGTH - 32:
+        text += f"\n\n<code>{html.escape(magnet_link)}</code>"
+    return telebot.types.InlineQueryResultArticle(
+        id=str(position), title=title, description=details,
+        input_message_content=telebot.types.InputTextMessageContent(text, parse_mode='HTML'))
+
+
+def render_result_row(query_hash, result) -> str:
+    id = result.get('id')
+    title = result.get('title')
+    size = format_size(result.get('size_bytes'))
+    seeds = result.get('seeds')
+    tracker = result.get('tracker')
+    command = f"/select_{query_hash}_{id}"
+    m_t_indicator = "Ⓜ" if result.get('magnet') else ""
+    m_t_indicator += "Ⓣ" if result.get('torrent') else ""
+
+    return f"{title}\n{command}\n📄️{size} 🌱{seeds} 🏁<i>{tracker}</i> {m_t_indicator}\n\n"
+
+
+def get_result_pages(query_hash, version, message, result_filter: ResultFilter,
+                     load_results: Callable[[], list[dict]]) -> ResultPages:
+    """
+    Rendered pages of the query results, built once per results version, language and filter
+    :param version: results version from the result store, a new save invalidates rendered pages
+    :param load_results: called only when pages are not rendered yet
+    """
+    key = (query_hash, version, get_language(message), result_filter)
+    with render_cache_lock:
+        pages = render_cache.get(key)
+    if pages is not None:
+        return pages
+
+    results = None
+
+    def load_once():
+        nonlocal results
+        if results is None:
+            results = load_results()
+        return results
+
+    all_rows = get_rendered_rows(query_hash, version, load_once)
+    index = get_result_index(query_hash, version, load_once)
+    positions = index.filter(result_filter)
+    rows = [all_rows[position] for position in positions]
+
+    pages = ResultPages(rows=rows, positions=positions, page_starts=split_into_pages(rows), index=index)
+    with render_cache_lock:
+        render_cache[key] = pages
+    return pages
+
+
+def get_page_results(results, pages: ResultPages, page=0) -> list[dict]:
+    """
+    :return: results shown on the page of get_result_pages, in the same order
+    """
+    if not pages.page_count:
+        return []
+    page = max(0, min(page, pages.page_count - 1))
+    return [results[position] for position in pages.positions[pages.page_starts[page]:pages.page_end(page)]]
+
+
+def get_rendered_rows(query_hash, version, load_results: Callable[[], list[dict]]) -> list[str]:
+    # Rows don't depend on language or filter, so every filter shares them
+    key = (query_hash, version)
+    with render_cache_lock:
+        rows = render_cache.get(key)
+    if rows is None:
+        rows = [render_result_row(query_hash, result) for result in load_results()]
+        with render_cache_lock:
+            render_cache[key] = rows
+    return rows
+
+
+def get_result_index(query_hash, version, load_results: Callable[[], list[dict]]) -> ResultIndex:
+    # Built once per results version, every filter and button press of them uses it
+    key = (query_hash, version, 'index')
+    with render_cache_lock:
+        index = render_cache.get(key)
+    if index is None:
+        index = ResultIndex(load_results())
+        with render_cache_lock:
+            render_cache[key] = index
+    return index
+
+
+def split_into_pages(rows: list[str]) -> list[int]:
+    """
+    :return: index of the first row of every page
+    """
+    page_starts = [0]
+    page_length = 0
+    for index, row in enumerate(rows):
+        if page_length + len(row) > PAGE_TEXT_LIMIT and page_length > 0:
+            page_starts.append(index)
+            page_length = 0
+        page_length += len(row)
+    return page_starts
+
+
+def build_results_page(query_hash, message, pages: ResultPages, title_to_show, page=0,
+                       result_filter: ResultFilter = NO_FILTER, refresh=False,
+                       index: ResultIndex = None) -> UserResponse:
+    """
+    :param query_hash: query of the buttons, the rows can be of the results of a filtered search
+    :param index: index of the query results to build filter buttons from, the one of the pages if None
+    :param refresh: add a button to search Jackett for the query again
+    """
+    page = max(0, min(page, pages.page_count - 1))
+    footer = localized(message, 'page_counter', page + 1, pages.page_count) if pages.page_count > 1 else ""
+    body = pages.page_text(page) if pages.rows else localized(message, 'nothing_matches_filter') + "\n"
+    # Long titles (e.g. many pending indexers) are cut, rows and the counter are kept
+    title_limit = MAX_MESSAGE_LENGTH - len(body) - len(footer) - 2
+    result_message = title_to_show[:title_limit] + "\n\n" + body + footer
+
+    controls = []
+    if page > 0:
+        controls.append(ResponseControl(title="◀️", action_key=get_results_callback(query_hash, result_filter,
+                                                                                    page - 1), row=0))
+    if page < pages.page_count - 1:
+        controls.append(ResponseControl(title="▶️", action_key=get_results_callback(query_hash, result_filter,
+                                                                                    page + 1), row=0))
+    controls += create_filter_controls(query_hash, message, index or pages.index, result_filter)
+    if refresh:
+        controls.append(ResponseControl(title=localized(message, 'search_again'),
+                                        action_key=f"{REFRESH_ACTION}:{query_hash}"))
+
+    return UserResponse(
+        user_id=message.from_user.id,
+        message=result_message,
+        controls=controls
+    )
+
+
+def create_filter_controls(query_hash, message, index: ResultIndex, current: ResultFilter) -> list[ResponseControl]:
+    """
+    Sort and minimum seeds buttons switch to the next option, the others turn their filter on or off
+    """
+    if index.count < 2:
+        return []
+
+    def control(title, result_filter, row, selected=False) -> ResponseControl:
+        return ResponseControl(title=("✅ " if selected else "") + title,
+                               action_key=get_results_callback(query_hash, result_filter), row=row)
+
+    min_seeds = MIN_SEEDS[current.min_seeds]
+    controls = [
+        control(localized(message, 'sort_' + SORTS[current.sort]),
+                dataclasses.replace(current, sort=(current.sort + 1) % len(SORTS)), 'options'),
+        control(localized(message, 'min_seeds_button', min_seeds) if min_seeds else localized(message, 'any_seeds'),
+                dataclasses.replace(current, min_seeds=(current.min_seeds + 1) % len(MIN_SEEDS)), 'options'),
+    ]
+    for size in index.get_available_sizes():
+        selected = size == current.size
+        controls.append(control(localized(message, SIZE_FILTERS[size - 1].button_key),
+                                dataclasses.replace(current, size=0 if selected else size), 'sizes', selected))
+    for number, category in enumerate(index.get_available_categories()):
+        selected = category == current.category
+        controls.append(control(localized(message, f'category_{category}'),
+                                dataclasses.replace(current, category=0 if selected else category),
+                                f'categories_{number // CATEGORY_BUTTONS_PER_ROW}', selected))
+    trackers = index.get_top_trackers(TRACKER_BUTTONS_LIMIT)
+    if current.tracker and current.tracker not in trackers:
+        trackers.append(current.tracker)
+    for tracker in trackers:
+        selected = tracker == current.tracker
+        controls.append(control(index.tracker_names.get(tracker, tracker),
+                                dataclasses.replace(current, tracker='' if selected else tracker), 'trackers',
+                                selected))
+    if not current.is_empty:
+        controls.append(control(localized(message, 'reset_filters'), NO_FILTER, 'reset'))
+    return controls
+
+
+def get_filter_title(message, result_filter: ResultFilter, index: ResultIndex = None) -> str:
+    """
+    :return: localized title of the results sorted and filtered this way
+    """
+    lines = [localized(message, 'results_by_' + SORTS[result_filter.sort])]
+    if result_filter.size_filter is not None:
+        lines.append(localized(message, result_filter.size_filter.title_key))
+    if result_filter.category:
+        lines.append(localized(message, 'filter_category', localized(message, f'category_{result_filter.category}')))
+    if result_filter.tracker:
+        tracker = index.tracker_names.get(result_filter.tracker) if index is not None else None
+        lines.append(localized(message, 'filter_tracker', tracker or '?'))
+    if MIN_SEEDS[result_filter.min_seeds]:
+        lines.append(localized(message, 'filter_min_seeds', MIN_SEEDS[result_filter.min_seeds]))
+    return "\n".join(lines)
+
+
+def get_results_callback(query_hash, result_filter: ResultFilter, page=0) -> str:
+    # At most 6 + 32 + 2 + page digits, Telegram allows 64 bytes
+    return f"{encode_filter(result_filter)}:{query_hash}:{page}"
+
+
+def is_refresh_callback(data) -> bool:
+    return data.startswith(REFRESH_ACTION + ':')
+
+
+def parse_refresh_callback(data) -> str:
+    """
+    :return: query hash of a refresh button
+    """
+    return data.split(':', 1)[1]
+
+
+def parse_results_callback(data) -> tuple[ResultFilter | None, str, int]:
+    """
+    :return: filter (None if unknown), query hash and page of a results button
+    """
+    state, query_hash, *page = data.split(':')
+    # Buttons sent before pagination have no page
+    return decode_filter(state), query_hash, int(page[0]) if page else 0
+
+
+def build_select_response(message, selected_result, magnet_link, torrent_file_bytes) -> UserResponse:
+    title = selected_result["title"]
+    size = format_size(selected_result["size_bytes"])
+    seeds = selected_result["seeds"]
+    tracker = selected_result["tracker"] or 'Unknown tracker'
+
+    html_hex = f'<a href="{magnet_link}">&#129522; Your magnet link</a>'.encode('utf-8').hex()
+
+    return UserResponse(user_id=message.from_user.id,
+                        message=f'<b>{title}</b>\n\n📄️{size} 🌱{seeds} 🏁<i>{tracker}</i>',
+                        controls=[ResponseControl(title=localized(message, 'magnet_link'),
+                                                  action_url=f'https://asidko.github.io/html-render/?title=Download%20link&content={html_hex}')],
+                        files=[ResponseFile(file_name=f'{title}.torrent', file_bytes=torrent_file_bytes)])
+
+
+def add_torrent_files_to_response(message, current_response: UserResponse, torrent_info) -> UserResponse:
+    files = torrent_info.files
+    new_message = current_response.message
+    new_message += f'\n\n{localized(message, "torrent_files")}\n'
+    # Videos first, a season pack can have thousands of small files besides them
+    for f in files.get_main_files(FILES_TO_SHOW_LIMIT):
+        new_message += f'<code>{f.size} {html.escape(f.title)}</code>\n'
+        # Only files that Telegram accepts can be downloaded
+        if 0 < f.length <= TELEGRAM_UPLOAD_LIMIT_BYTES:
+            new_message += f'/download_{torrent_info.hash}_{f.id}\n'
+    if len(files) > FILES_TO_SHOW_LIMIT:
+        new_message += f'<code>{localized(message, "torrent_more_files", len(files) - FILES_TO_SHOW_LIMIT)}</code>\n'
+
+    folders = files.get_folders(FOLDERS_TO_SHOW_LIMIT)
+    if folders:
+        new_message += f'\n{localized(message, "torrent_folders")}\n'
+        for folder in folders:
+            folder_line = localized(message, 'torrent_folder', folder.size, folder.files, folder.path or '/')
+            new_message += f'<code>{html.escape(folder_line)}</code>\n'
+
+    # Files were already sent with the original message
+    return dataclasses.replace(current_response, message=new_message, files=[])
@@ -0,0 +1,235 @@
+import bisect
+import string
+import zlib
+from dataclasses import dataclass
+
+from ranking import is_truncated
+
+GB = 1024 * 1024 * 1024
+
+# Filter of a results button is encoded in 8 characters: category, tracker (4), size, min seeds and sort.
+# Telegram allows 64 bytes of callback_data, the query hash takes 32 of them
+FILTER_DIGITS = string.digits + string.ascii_lowercase
+TRACKER_CODE_LENGTH = 4
+FILTER_STATE_LENGTH = 4 + TRACKER_CODE_LENGTH
+# Buttons sent before tracker codes were 4 characters long, their tracker is dropped
+LEGACY_TRACKER_CODE_LENGTH = 2
+NO_FILTER_STATE = 'all'
+SORTS = ['popularity', 'seeds', 'size_desc', 'size_asc']
+MIN_SEEDS = [0, 1, 10, 100]
+# Top level Torznab categories, Jackett searches subcategories of a top level one too
+CATEGORIES = [1000, 2000, 3000, 4000, 5000, 6000, 7000, 8000]
+
+
+@dataclass(frozen=True)
+class SizeFilter:
+    title_key: str
+    button_key: str
+    min_bytes: int | None = None  # exclusive
+    max_bytes: int | None = None  # exclusive
+
+    def matches(self, size) -> bool:
+        return (self.min_bytes is None or size > self.min_bytes) and (self.max_bytes is None or size < self.max_bytes)
+
+
+# Encoded by position, so new ones are appended
+SIZE_FILTERS = [
+    SizeFilter('filter_less_than_2gb', 'less_than_2_gb', max_bytes=2 * GB),
+    SizeFilter('filter_more_than_4gb', 'more_than_4_gb', min_bytes=4 * GB),
+    SizeFilter('filter_more_than_10gb', 'more_than_10_gb', min_bytes=10 * GB),
+]
+# Buttons sent before the filter model had these keys
+LEGACY_SIZE_FILTER_KEYS = {'filter_less_size_2': 1, 'filter_more_size_4': 2, 'filter_more_size_10': 3}
+
+
+@dataclass(frozen=True)
+class ResultFilter:
+    category: int = 0  # top level Torznab category, 0 - any
+    tracker: str = ''  # tracker code, see get_tracker_code
+    size: int = 0  # 1-based index in SIZE_FILTERS, 0 - any
+    min_seeds: int = 0  # index in MIN_SEEDS
+    sort: int = 0  # index in SORTS
+
+    @property
+    def is_empty(self) -> bool:
+        return self == NO_FILTER
+
+    @property
+    def size_filter(self) -> SizeFilter | None:
+        return SIZE_FILTERS[self.size - 1] if self.size else None
+
+
+NO_FILTER = ResultFilter()
+
+
+@dataclass(frozen=True)
+class SearchFilter:
+    """
+    Part of a results filter that Jackett applies itself: Torznab categories and a single indexer
+    """
+    categories: tuple[int, ...] = ()
+    indexer: str = 'all'
+
+    def __str__(self):
+        return self.indexer + ''.join(f'|{category}' for category in self.categories)
+
+
+NO_SEARCH_FILTER = SearchFilter()
+
+
+def get_category_group(category) -> int:
+    """
+    :return: top level Torznab category of a category or subcategory id, 0 for custom ones of indexers
+    """
+    return category // 1000 * 1000 if category and category < 100000 else 0
+
+
+def get_tracker_code(tracker) -> str:
+    # A short hash instead of the name, so the button fits and doesn't depend on the list of trackers. "0000" is any
+    number = zlib.crc32(tracker.encode()) % (len(FILTER_DIGITS) ** TRACKER_CODE_LENGTH - 1) + 1
+    digits = []
+    for _ in range(TRACKER_CODE_LENGTH):
+        number, digit = divmod(number, len(FILTER_DIGITS))
+        digits.append(FILTER_DIGITS[digit])
+    return ''.join(reversed(digits))
+
+
+def encode_filter(result_filter: ResultFilter) -> str:
+    if result_filter.is_empty:
+        return NO_FILTER_STATE
+    category = CATEGORIES.index(result_filter.category) + 1 if result_filter.category else 0
+    return (FILTER_DIGITS[category] + (result_filter.tracker or '0' * TRACKER_CODE_LENGTH)
+            + FILTER_DIGITS[result_filter.size] + FILTER_DIGITS[result_filter.min_seeds]
+            + FILTER_DIGITS[result_filter.sort])
+
+
+def decode_filter(state) -> ResultFilter | None:
+    """
+    :return: filter of a button, None for unknown ones
+    """
+    if state == NO_FILTER_STATE:
+        return NO_FILTER
+    if state in LEGACY_SIZE_FILTER_KEYS:
+        return ResultFilter(size=LEGACY_SIZE_FILTER_KEYS[state])
+    if len(state) == 4 + LEGACY_TRACKER_CODE_LENGTH:
+        state = state[0] + '0' * TRACKER_CODE_LENGTH + state[-3:]
+    if len(state) != FILTER_STATE_LENGTH or any(char not in FILTER_DIGITS for char in state):
+        return None
+    category, size, min_seeds, sort = (FILTER_DIGITS.index(state[index]) for index in (0, -3, -2, -1))
+    tracker = state[1:-3]
+    if category > len(CATEGORIES) or size > len(SIZE_FILTERS) or min_seeds >= len(MIN_SEEDS) or sort >= len(SORTS):
+        return None
+    return ResultFilter(CATEGORIES[category - 1] if category else 0,
+                        '' if tracker == '0' * TRACKER_CODE_LENGTH else tracker, size, min_seeds, sort)
+
+
+class ResultIndex:
+    """
+    Positions of results ordered by size and by seeds, and grouped by category and tracker, built once per saved
+    results. A filter takes a bisected range of an order and intersects it with the smallest of the other ones
+    """
+
+    def __init__(self, results: list[dict]):
+        self.count = len(results)
+        # Only the best seeded results were kept, others of a category or a tracker may be missing
+        self.truncated = is_truncated(results)
+        sizes = [result.get('size_bytes') or 0 for result in results]
+        seeds = [result.get('seeds') or 0 for result in results]
+        positions = range(self.count)
+        self.size_order = sorted(positions, key=lambda position: (sizes[position], position))
+        # Largest first, equal sizes keep the ranked order
+        self.size_desc_order = sorted(positions, key=lambda position: (-sizes[position], position))
+        self.sorted_sizes = [sizes[position] for position in self.size_order]
+        self.seeds_order = sorted(positions, key=lambda position: (seeds[position], -position))
+        self.sorted_seeds = [seeds[position] for position in self.seeds_order]
+        self.known_sizes = [size for size in self.sorted_sizes if size]
+
+        self.by_category: dict[int, list[int]] = {}
+        self.by_tracker: dict[str, list[int]] = {}
+        self.tracker_names: dict[str, str] = {}  # code -> name
+        self.tracker_ids: dict[str, str] = {}  # code -> Jackett indexer id
+        self.collided_codes: set[str] = set()  # codes of several trackers, they get no filter
+        for position, result in enumerate(results):
+            self.by_category.setdefault(get_category_group(result.get('category')), []).append(position)
+            # Merged results list all their trackers, the indexer id is the one of the first
+            for index, tracker in enumerate((result.get('tracker') or '').split(', ')):
+                if not tracker:
+                    continue
+                code = get_tracker_code(tracker)
+                if self.tracker_names.setdefault(code, tracker) != tracker:
+                    self.collided_codes.add(code)
+                self.by_tracker.setdefault(code, []).append(position)
+                if index == 0 and result.get('tracker_id'):
+                    self.tracker_ids.setdefault(code, result['tracker_id'])
+
+    def get_search_filter(self, result_filter: ResultFilter) -> SearchFilter | None:
+        """
+        :return: categories and indexer to search Jackett in, if the results are truncated and the filter has them
+        """
+        indexer = self.tracker_ids.get(result_filter.tracker) \
+            if result_filter.tracker and result_filter.tracker not in self.collided_codes else None
+        if not self.truncated or (not result_filter.category and indexer is None):
+            return None
+        return SearchFilter((result_filter.category,) if result_filter.category else (), indexer or 'all')
+
+    def filter(self, result_filter: ResultFilter) -> list[int]:
+        """
+        :return: positions of the matching results in the order of the filter
+        """
+        ranges = []
+        if result_filter.category:
+            ranges.append(self.by_category.get(result_filter.category, []))
+        if result_filter.tracker:
+            ranges.append(self.by_tracker.get(result_filter.tracker, []))
+        size_filter = result_filter.size_filter
+        if size_filter is not None:
+            start = bisect.bisect_right(self.sorted_sizes, size_filter.min_bytes) \
+                if size_filter.min_bytes is not None else 0
+            end = bisect.bisect_left(self.sorted_sizes, size_filter.max_bytes) \
+                if size_filter.max_bytes is not None else self.count
+            ranges.append(self.size_order[start:end])
+        if MIN_SEEDS[result_filter.min_seeds]:
+            ranges.append(self.seeds_order[bisect.bisect_left(self.sorted_seeds, MIN_SEEDS[result_filter.min_seeds]):])
+
+        order = self.get_order(SORTS[result_filter.sort])
+        if not ranges:
+            return order
+        ranges.sort(key=len)
+        matching = set(ranges[0]).intersection(*ranges[1:])
+        if len(matching) * 4 < self.count and SORTS[result_filter.sort] == 'popularity':
+            return sorted(matching)
+        return [position for position in order if position in matching]
+
+    def get_order(self, sort) -> list[int]:
+        if sort == 'seeds':
+            return self.seeds_order[::-1]
+        if sort == 'size_desc':
+            return self.size_desc_order
+        if sort == 'size_asc':
+            return self.size_order
+        return list(range(self.count))
+
+    def get_available_sizes(self) -> list[int]:
+        """
+        :return: 1-based indexes of size filters that hide some results with known size, but not all of them
+        """
+        available = []
+        for index, size_filter in enumerate(SIZE_FILTERS, start=1):
+            matching = sum(1 for size in self.known_sizes if size_filter.matches(size))
+            if 0 < matching < len(self.known_sizes):
+                available.append(index)
+        return available
+
+    def get_available_categories(self) -> list[int]:
+        categories = [category for category in CATEGORIES if category in self.by_category]
+        # Worth showing only if results are of several categories
+        return categories if len(self.by_category) > 1 else []
+
+    def get_top_trackers(self, limit) -> list[str]:
+        """
+        :return: codes of the trackers with the most results, if there are several
+        """
+        if len(self.by_tracker) < 2:
+            return []
+        codes = [code for code in self.by_tracker if code not in self.collided_codes]
+        return sorted(codes, key=lambda code: -len(self.by_tracker[code]))[:limit]
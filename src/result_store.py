@@ -0,0 +1,290 @@
+import hashlib
+import os
+import sqlite3
+import string
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+import dotenv
+
+from ranking import get_dedup_key, SearchResults, is_truncated
+
+dotenv.load_dotenv()
+
+RESULT_STORE_MAX_BYTES = int(os.getenv('RESULT_STORE_MAX_BYTES', 64 * 1024 * 1024))
+RESULT_STORE_TTL_SECONDS = int(os.getenv('RESULT_STORE_TTL_SECONDS', 2_592_000))  # 30 days
+# Optional SQLite file to keep /select links and filters working after restarts
+RESULT_STORE_DB_PATH = os.getenv('RESULT_STORE_DB_PATH', '')
+
+ID_ALPHABET = string.ascii_uppercase + string.digits
+ID_LENGTH = 6
+MISSING_SEEDS = -1
+# Pointers in 7 lists, 3 array items and an entry of the id index
+ROW_OVERHEAD_BYTES = 7 * 8 + 3 * 8 + 100
+
+
+def make_item_id(result: dict, attempt: int = 0) -> str:
+    """
+    Deterministic id of a result, so the same release keeps its /select link when the query is searched again
+    or more trackers are merged into it
+    """
+    key = f"{attempt}|{get_dedup_key(result)}"
+    number = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+    chars = []
+    for _ in range(ID_LENGTH):
+        number, index = divmod(number, len(ID_ALPHABET))
+        chars.append(ID_ALPHABET[index])
+    return ''.join(chars)
+
+
+class StoredResults:
+    """
+    Column-oriented results of one query: a list per text field and an array per number field
+    instead of a dict per result
+    """
+    __slots__ = ('ids', 'titles', 'size_bytes', 'seeds', 'magnets', 'torrents', 'trackers', 'tracker_ids',
+                 'categories', 'infohashes', 'positions', 'created_at', 'truncated', 'nbytes')
+
+    def __init__(self, created_at: float, truncated=False):
+        self.ids = []
+        self.titles = []
+        self.size_bytes = array('q')
+        self.seeds = array('q')
+        self.magnets = []
+        self.torrents = []
+        self.trackers = []
+        self.tracker_ids = []
+        self.categories = array('q')
+        self.infohashes = []
+        self.positions = {}  # item id -> row
+        self.created_at = created_at
+        self.truncated = truncated  # see SearchResults
+        self.nbytes = 0
+
+    def append(self, item_id, title, size_bytes, seeds, magnet, torrent, tracker, tracker_id=None, category=None,
+               infohash=None):
+        self.positions[item_id] = len(self.ids)
+        self.ids.append(item_id)
+        self.titles.append(title)
+        self.size_bytes.append(int(size_bytes or 0))
+        self.seeds.append(MISSING_SEEDS if seeds is None else int(seeds))
+        self.magnets.append(magnet)
+        self.torrents.append(torrent)
+        # Only a handful of trackers, share their strings
+        self.trackers.append(sys.intern(tracker) if tracker else tracker)
+        self.tracker_ids.append(sys.intern(tracker_id) if tracker_id else tracker_id)
+        self.categories.append(int(category or 0))
+        self.infohashes.append(infohash)
+
+    def finish(self):
+        # Rough memory footprint, trackers are shared so not counted
+        text_bytes = sum(sys.getsizeof(value)
+                         for column in (self.ids, self.titles, self.magnets, self.torrents, self.infohashes)
+                         for value in column if value is not None)
+        self.nbytes = text_bytes + len(self.ids) * ROW_OVERHEAD_BYTES
+
+    def row(self, position) -> dict:
+        seeds = self.seeds[position]
+        size_bytes = self.size_bytes[position]
+        return {
+            'id': self.ids[position],
+            'title': self.titles[position],
+            'size_bytes': size_bytes,
+            'seeds': None if seeds == MISSING_SEEDS else seeds,
+            'magnet': self.magnets[position],
+            'torrent': self.torrents[position],
+            'tracker': self.trackers[position],
+            'tracker_id': self.tracker_ids[position],
+            'category': self.categories[position],
+            'infohash': self.infohashes[position]
+        }
+
+    def rows(self) -> SearchResults:
+        return SearchResults([self.row(position) for position in range(len(self.ids))], self.truncated)
+
+    def find(self, item_id) -> dict | None:
+        position = self.positions.get(item_id)
+        return None if position is None else self.row(position)
+
+
+class ResultStore:
+    """
+    Search results by query hash with an O(1) (query hash, item id) lookup.
+    Memory tier is an LRU bounded by bytes, optional SQLite tier survives restarts
+    """
+
+    def __init__(self, max_bytes=RESULT_STORE_MAX_BYTES, ttl_seconds=RESULT_STORE_TTL_SECONDS,
+                 db_path=RESULT_STORE_DB_PATH):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, StoredResults] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+        self._db = self._open_db(db_path) if db_path else None
+
+    def save(self, query_hash, results: list[dict]):
+        """
+        Store results of a query, replacing the previous ones. Assigns ids unique within the query, the stored rows
+        have them. The given results are not changed, they are shared with the Jackett cache and other queries
+        """
+        stored = StoredResults(time.time(), is_truncated(results))
+        for result in results:
+            attempt = 0
+            item_id = make_item_id(result)
+            while item_id in stored.positions:
+                attempt += 1
+                item_id = make_item_id(result, attempt)
+            stored.append(item_id, result.get('title'), result.get('size_bytes'), result.get('seeds'),
+                          result.get('magnet'), result.get('torrent'), result.get('tracker'), result.get('tracker_id'),
+                          result.get('category'), result.get('infohash'))
+        stored.finish()
+
+        with self._lock:
+            self._put(query_hash, stored)
+            if self._db is not None:
+                self._save_to_db(query_hash, stored)
+
+    def get(self, query_hash) -> SearchResults:
+        stored = self._get_stored(query_hash)
+        return stored.rows() if stored is not None else SearchResults()
+
+    def find(self, query_hash, item_id) -> dict | None:
+        with self._lock:
+            stored = self._get_from_memory(query_hash)
+            if stored is not None:
+                return stored.find(item_id)
+            if self._db is not None:
+                return self._find_in_db(query_hash, item_id)
+        return None
+
+    def get_version(self, query_hash) -> float | None:
+        """
+        :return: save time of the query results (changes on every save), None if there are no results
+        """
+        with self._lock:
+            stored = self._get_from_memory(query_hash)
+            if stored is not None:
+                return stored.created_at
+            if self._db is not None:
+                row = self._db.execute("SELECT created_at FROM results WHERE query_hash = ? AND position = 0",
+                                       (query_hash,)).fetchone()
+                if row is not None and not self._is_expired(row[0]):
+                    return row[0]
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'queries': len(self._entries), 'bytes': self._total_bytes, 'max_bytes': self.max_bytes}
+
+    def _get_stored(self, query_hash) -> StoredResults | None:
+        with self._lock:
+            stored = self._get_from_memory(query_hash)
+            if stored is None and self._db is not None:
+                stored = self._load_from_db(query_hash)
+                if stored is not None:
+                    self._put(query_hash, stored)
+            return stored
+
+    def _get_from_memory(self, query_hash) -> StoredResults | None:
+        stored = self._entries.get(query_hash)
+        if stored is None:
+            return None
+        if self._is_expired(stored.created_at):
+            self._remove(query_hash)
+            return None
+        self._entries.move_to_end(query_hash)
+        return stored
+
+    def _is_expired(self, created_at) -> bool:
+        return time.time() - created_at > self.ttl_seconds
+
+    def _put(self, query_hash, stored: StoredResults):
+        self._remove(query_hash)
+        self._entries[query_hash] = stored
+        self._total_bytes += stored.nbytes
+        # Evict least recently used queries, but always keep the newest one
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            oldest_hash = next(iter(self._entries))
+            self._remove(oldest_hash)
+
+    def _remove(self, query_hash):
+        stored = self._entries.pop(query_hash, None)
+        if stored is not None:
+            self._total_bytes -= stored.nbytes
+
+    def _open_db(self, db_path) -> sqlite3.Connection:
+        db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA mmap_size=268435456")  # read pages through mmap instead of copying them
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                query_hash TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                item_id TEXT NOT NULL,
+                title TEXT,
+                size_bytes INTEGER,
+                seeds INTEGER,
+                magnet TEXT,
+                torrent TEXT,
+                tracker TEXT,
+                created_at REAL NOT NULL,
+                tracker_id TEXT,
+                category INTEGER,
+                infohash TEXT,
+                truncated INTEGER,
+                PRIMARY KEY (query_hash, position)
+            ) WITHOUT ROWID""")
+        # Files created before results had these columns
+        columns = {row[1] for row in db.execute("PRAGMA table_info(results)")}
+        for column, column_type in (('tracker_id', 'TEXT'), ('category', 'INTEGER'), ('infohash', 'TEXT'),
+                                    ('truncated', 'INTEGER')):
+            if column not in columns:
+                db.execute(f"ALTER TABLE results ADD COLUMN {column} {column_type}")
+        db.execute("CREATE UNIQUE INDEX IF NOT EXISTS results_item ON results (query_hash, item_id)")
+        db.execute("DELETE FROM results WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        return db
+
+    def _save_to_db(self, query_hash, stored: StoredResults):
+        rows = [(query_hash, position, stored.ids[position], stored.titles[position], stored.size_bytes[position],
+                 stored.seeds[position], stored.magnets[position], stored.torrents[position],
+                 stored.trackers[position], stored.created_at, stored.tracker_ids[position],
+                 stored.categories[position], stored.infohashes[position], stored.truncated)
+                for position in range(len(stored.ids))]
+        try:
+            self._db.execute("BEGIN")
+            self._db.execute("DELETE FROM results WHERE query_hash = ?", (query_hash,))
+            self._db.executemany("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._db.execute("COMMIT")
+        except sqlite3.Error as e:
+            print("Result store: failed to save results: %s" % e)
+            self._db.execute("ROLLBACK")
+
+    def _load_from_db(self, query_hash) -> StoredResults | None:
+        rows = self._db.execute("""
+            SELECT item_id, title, size_bytes, seeds, magnet, torrent, tracker, created_at, tracker_id, category,
+                infohash, truncated
+            FROM results WHERE query_hash = ? ORDER BY position""", (query_hash,)).fetchall()
+        if not rows or self._is_expired(rows[0][7]):
+            return None
+
+        stored = StoredResults(rows[0][7], bool(rows[0][11]))
+        for item_id, title, size_bytes, seeds, magnet, torrent, tracker, _, tracker_id, category, infohash, _ in rows:
+            stored.append(item_id, title, size_bytes, seeds, magnet, torrent, tracker, tracker_id, category, infohash)
+        stored.finish()
+        return stored
+
+    def _find_in_db(self, query_hash, item_id) -> dict | None:
+        row = self._db.execute("""
+            SELECT position, title, size_bytes, seeds, magnet, torrent, tracker, created_at, tracker_id, category,
+                infohash
+            FROM results WHERE query_hash = ? AND item_id = ?""", (query_hash, item_id)).fetchone()
+        if row is None or self._is_expired(row[7]):
+            return None
+
+        stored = StoredResults(row[7])
+        stored.append(item_id, *row[1:7], *row[8:11])
+        return stored.row(0)
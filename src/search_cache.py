@@ -0,0 +1,249 @@
+import asyncio
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, Executor
+from dataclasses import dataclass
+from typing import Callable, Awaitable, Any
+
+from cachetools import LRUCache
+from cachetools_ext.fs import FSLRUCache
+
+
+@dataclass
+class CachedSearch:
+    value: Any
+    fetched_at: float
+
+
+class SearchCache:
+    """
+    Two-tier cache (memory LRU in front of a disk LRU) with request coalescing and stale-while-revalidate:
+    - concurrent lookups of the same key share one in-flight upstream call
+    - entries older than ttl but younger than stale_ttl are returned immediately and refreshed in the background
+    - a stale or missing memory entry is looked up on disk too, where another process may have saved a newer one
+    The async methods read and write the disk tier in a thread of the default executor
+    """
+
+    def __init__(self, executor: Executor, memory_size=100, disk_size=50, ttl=900, stale_ttl=3600, disk_path=None,
+                 disk=None):
+        """
+        :param executor: runs background refreshes, must not be the pool the fetch functions submit to
+        :param disk: disk tier to use instead of a FSLRUCache, e.g. one shared by several processes
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._executor = executor
+        self._memory = LRUCache(maxsize=memory_size)
+        self._disk = disk if disk is not None else FSLRUCache(maxsize=disk_size, ttl=stale_ttl, path=disk_path)
+        self._lock = threading.Lock()
+        self._in_flight: dict[str, Future] = {}
+        self._in_flight_async: dict[str, asyncio.Future] = {}
+        self._background_tasks = set()
+        self._counters = Counter()
+
+    def get_or_fetch(self, key, fetch: Callable[[], Any], refresh: Callable[[], Any] = None, force=False):
+        """
+        :param fetch: upstream call for a miss, exceptions are passed to every waiter and nothing is cached
+        :param refresh: upstream call for a background refresh of a stale entry, fetch if not set
+        :param force: fetch even if the entry is fresh, an in-flight call is still shared
+        """
+        entry = self._lookup(key) if not force else None
+        if entry is not None:
+            age = time.time() - entry.fetched_at
+            if age <= self.ttl:
+                self._count('hits')
+                return entry.value
+            if age <= self.stale_ttl:
+                self._count('stale_hits')
+                self._executor.submit(self._refresh, key, refresh or fetch)
+                return entry.value
+
+        self._count('forced' if force else 'misses')
+        return self._fetch_shared(key, fetch)
+
+    async def get_or_fetch_async(self, key, fetch: Callable[[], Awaitable], refresh: Callable[[], Awaitable] = None,
+                                 force=False):
+        """
+        Same as get_or_fetch, but coalesces coroutines of the running event loop
+        """
+        entry = await self._lookup_async(key) if not force else None
+        if entry is not None:
+            age = time.time() - entry.fetched_at
+            if age <= self.ttl:
+                self._count('hits')
+                return entry.value
+            if age <= self.stale_ttl:
+                self._count('stale_hits')
+                task = asyncio.create_task(self._refresh_async(key, refresh or fetch))
+                self._background_tasks.add(task)
+                task.add_done_callback(self._background_tasks.discard)
+                return entry.value
+
+        self._count('forced' if force else 'misses')
+        return await self._fetch_shared_async(key, fetch)
+
+    def get(self, key):
+        """
+        :return: value of a fresh or stale entry without fetching or refreshing it, None if there is none
+        """
+        entry = self._lookup(key)
+        return entry.value if entry is not None and time.time() - entry.fetched_at <= self.stale_ttl else None
+
+    async def get_async(self, key):
+        entry = await self._lookup_async(key)
+        return entry.value if entry is not None and time.time() - entry.fetched_at <= self.stale_ttl else None
+
+    def get_age(self, key) -> float | None:
+        """
+        :return: seconds since the entry was fetched, None if there is no entry
+        """
+        entry = self._lookup(key)
+        return time.time() - entry.fetched_at if entry is not None else None
+
+    def is_cached(self, key) -> bool:
+        """
+        :return: True if a lookup is answered without a new upstream call: from a fresh or stale entry,
+                 or by the call in flight
+        """
+        with self._lock:
+            if key in self._in_flight or key in self._in_flight_async:
+                return True
+        entry = self._lookup(key)
+        return entry is not None and time.time() - entry.fetched_at <= self.stale_ttl
+
+    async def is_cached_async(self, key) -> bool:
+        with self._lock:
+            if key in self._in_flight or key in self._in_flight_async:
+                return True
+        entry = await self._lookup_async(key)
+        return entry is not None and time.time() - entry.fetched_at <= self.stale_ttl
+
+    def put(self, key, value):
+        self._disk[key] = self._put_in_memory(key, value)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats['in_flight'] = len(self._in_flight) + len(self._in_flight_async)
+        hits = stats.get('hits', 0) + stats.get('stale_hits', 0)
+        lookups = hits + stats.get('misses', 0)
+        stats['hit_ratio'] = round(hits / lookups, 3) if lookups else 0
+        return stats
+
+    def _put_in_memory(self, key, value) -> CachedSearch:
+        entry = CachedSearch(value, time.time())
+        with self._lock:
+            self._memory[key] = entry
+        return entry
+
+    def _lookup(self, key) -> CachedSearch | None:
+        entry = self._get_from_memory(key)
+        if entry is not None and time.time() - entry.fetched_at <= self.ttl:
+            return entry
+        return self._get_newer(key, entry, self._read_disk(key))
+
+    async def _lookup_async(self, key) -> CachedSearch | None:
+        entry = self._get_from_memory(key)
+        if entry is not None and time.time() - entry.fetched_at <= self.ttl:
+            return entry
+        return self._get_newer(key, entry, await asyncio.to_thread(self._read_disk, key))
+
+    def _get_from_memory(self, key) -> CachedSearch | None:
+        with self._lock:
+            return self._memory.get(key)
+
+    def _read_disk(self, key) -> CachedSearch | None:
+        try:
+            entry = self._disk[key] if key in self._disk else None
+        except KeyError:
+            entry = None  # expired in between
+        # Entries written by older versions are bare result lists without a timestamp
+        return entry if isinstance(entry, CachedSearch) else None
+
+    def _get_newer(self, key, memory_entry: CachedSearch | None, disk_entry: CachedSearch | None):
+        if disk_entry is None or (memory_entry is not None and memory_entry.fetched_at >= disk_entry.fetched_at):
+            return memory_entry
+
+        self._count('disk_reads')
+        with self._lock:
+            self._memory[key] = disk_entry
+        return disk_entry
+
+    def _fetch_shared(self, key, fetch):
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self._in_flight[key] = Future()
+            else:
+                self._counters['coalesced'] += 1
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            value = fetch()
+        except BaseException as e:
+            self._finish_flight(self._in_flight, key)
+            future.set_exception(e)
+            raise
+
+        self.put(key, value)
+        self._finish_flight(self._in_flight, key)
+        future.set_result(value)
+        return value
+
+    async def _fetch_shared_async(self, key, fetch):
+        future = self._in_flight_async.get(key)
+        if future is not None:
+            self._count('coalesced')
+            return await asyncio.shield(future)
+
+        future = self._in_flight_async[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await fetch()
+        except BaseException as e:
+            self._finish_flight(self._in_flight_async, key)
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()  # mark as retrieved, the leader re-raises it anyway
+            raise
+
+        entry = self._put_in_memory(key, value)
+        self._finish_flight(self._in_flight_async, key)
+        future.set_result(value)
+        # Waiters have the value already, only the leader waits for the disk
+        await asyncio.to_thread(self._disk.__setitem__, key, entry)
+        return value
+
+    def _refresh(self, key, refresh):
+        with self._lock:
+            if key in self._in_flight:
+                return
+        self._count('refreshes')
+        try:
+            self._fetch_shared(key, refresh)
+        except Exception as e:
+            self._count('refresh_failures')
+            print("Search cache: failed to refresh %s: %s" % (key, e))
+
+    async def _refresh_async(self, key, refresh):
+        if key in self._in_flight_async:
+            return
+        self._count('refreshes')
+        try:
+            await self._fetch_shared_async(key, refresh)
+        except Exception as e:
+            self._count('refresh_failures')
+            print("Search cache: failed to refresh %s: %s" % (key, e))
+
+    def _finish_flight(self, in_flight, key):
+        with self._lock:
+            in_flight.pop(key, None)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
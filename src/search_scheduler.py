@@ -0,0 +1,297 @@
+import asyncio
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager, asynccontextmanager
+from typing import Callable, Awaitable
+
+import dotenv
+
+from metrics import record_stage
+from query_index import normalize_query
+
+dotenv.load_dotenv()
+
+# Jackett searches running at the same time in a worker process, cached queries don't take a slot
+SEARCH_MAX_PARALLEL = int(os.getenv('SEARCH_MAX_PARALLEL', 8))
+# Searches waiting for a slot, new ones are rejected beyond it
+SEARCH_QUEUE_SIZE = int(os.getenv('SEARCH_QUEUE_SIZE', 50))
+# Searches of one user waiting at the same time
+SEARCH_USER_QUEUE_SIZE = int(os.getenv('SEARCH_USER_QUEUE_SIZE', 3))
+# A query sent this soon after a still waiting one of the same user replaces it
+SEARCH_DEBOUNCE_SECONDS = float(os.getenv('SEARCH_DEBOUNCE_SECONDS', 2))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUPERSEDED = 'superseded'
+
+
+class SearchRejected(Exception):
+    """
+    The search is not run. Reasons: 'busy' - the queue is full, 'user_busy' - too many searches of the user are
+    waiting, 'duplicate' - the same query of the user is waiting or running, 'superseded' - replaced by a newer query
+    """
+
+    def __init__(self, reason, waiting=0):
+        super().__init__(reason)
+        self.reason = reason
+        self.waiting = waiting  # searches in the queue, of all users or of the user
+
+
+class QueuedSearch:
+    __slots__ = ('user_id', 'query', 'queued_at', 'state')
+
+    def __init__(self, user_id, query):
+        self.user_id = user_id
+        self.query = query  # normalized
+        self.queued_at = time.monotonic()
+        self.state = QUEUED
+
+
+class SearchQueue:
+    """
+    Admission of Jackett searches: at most max_parallel run at once, the waiting ones are started taking turns
+    between users (deficit round-robin where every search costs the same), so a burst of one user doesn't delay
+    the others. Selection logic only, SearchScheduler and AsyncSearchScheduler wait for the turn
+    """
+
+    def __init__(self, max_parallel=SEARCH_MAX_PARALLEL, queue_size=SEARCH_QUEUE_SIZE,
+                 user_queue_size=SEARCH_USER_QUEUE_SIZE, debounce_seconds=SEARCH_DEBOUNCE_SECONDS):
+        self.max_parallel = max_parallel
+        self.queue_size = queue_size
+        self.user_queue_size = user_queue_size
+        self.debounce_seconds = debounce_seconds
+        # user id -> waiting searches of the user, the order of users is the order of their turns
+        self._queues: dict[int, deque[QueuedSearch]] = {}
+        self._queued = 0
+        self._running: set[QueuedSearch] = set()
+        self._counters = Counter()
+
+    def _push(self, user_id, query) -> QueuedSearch:
+        """
+        :return: the search, started right away if there is a free slot
+        """
+        query = normalize_query(query)
+        user_queue = self._queues.get(user_id, ())
+        if any(search.user_id == user_id and search.query == query for search in (*user_queue, *self._running)):
+            self._reject('duplicate')
+
+        if user_queue and time.monotonic() - user_queue[-1].queued_at < self.debounce_seconds:
+            # Its waiting handler is woken up and tells the user, the new search takes its place
+            user_queue.pop().state = SUPERSEDED
+            self._queued -= 1
+            if not user_queue:
+                del self._queues[user_id]
+        elif len(user_queue) >= self.user_queue_size:
+            self._reject('user_busy', len(user_queue))
+        elif self._queued >= self.queue_size:
+            self._reject('busy', self._queued)
+
+        search = QueuedSearch(user_id, query)
+        if not self._queued and len(self._running) < self.max_parallel:
+            self._start(search)
+            return search
+
+        self._queues.setdefault(user_id, deque()).append(search)
+        self._queued += 1
+        self._start_next()
+        return search
+
+    def _reject(self, reason, waiting=0):
+        self._counters['rejected_' + reason] += 1
+        record_stage('search_queue_wait', '', None, reason)
+        raise SearchRejected(reason, waiting)
+
+    def _start(self, search: QueuedSearch):
+        search.state = RUNNING
+        self._running.add(search)
+        self._counters['started'] += 1
+        record_stage('search_queue_wait', '', time.monotonic() - search.queued_at)
+
+    def _start_next(self) -> bool:
+        """
+        :return: True if any waiting search was started
+        """
+        started = False
+        while self._queues and len(self._running) < self.max_parallel:
+            user_id = next(iter(self._queues))
+            user_queue = self._queues.pop(user_id)
+            search = user_queue.popleft()
+            if user_queue:
+                self._queues[user_id] = user_queue  # the next search of the user waits for the others
+            self._queued -= 1
+            self._start(search)
+            started = True
+        return started
+
+    def _finish(self, search: QueuedSearch) -> bool:
+        """
+        Free the slot of a running search or remove a waiting one
+        :return: True if any waiting search was started
+        """
+        if search.state == QUEUED:
+            user_queue = self._queues.get(search.user_id)
+            if user_queue is not None and search in user_queue:
+                user_queue.remove(search)
+                self._queued -= 1
+                if not user_queue:
+                    del self._queues[search.user_id]
+            search.state = SUPERSEDED
+        self._running.discard(search)
+        return self._start_next()
+
+    def _get_position(self, search: QueuedSearch) -> int:
+        """
+        :return: searches started before this one and this one, 0 if it's not waiting
+        """
+        user_queue = self._queues.get(search.user_id)
+        if search.state != QUEUED or user_queue is None:
+            return 0
+        turn = user_queue.index(search)
+        position = turn + 1
+        before = True  # users before the user in the turn order start one search more
+        for user_id, queue in self._queues.items():
+            if user_id == search.user_id:
+                before = False
+                continue
+            position += min(len(queue), turn + 1 if before else turn)
+        return position
+
+    def _get_superseded(self, search: QueuedSearch) -> SearchRejected:
+        self._counters['superseded'] += 1
+        record_stage('search_queue_wait', '', time.monotonic() - search.queued_at, SUPERSEDED)
+        return SearchRejected(SUPERSEDED)
+
+    def _stats(self) -> dict:
+        return dict(self._counters, queued=self._queued, running=len(self._running), waiting_users=len(self._queues))
+
+
+class SearchScheduler(SearchQueue):
+    """
+    Searches wait for their turn in the handler threads
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self, user_id, query, on_queued: Callable[[int], None] = None, cached=False):
+        """
+        Wait for a turn to search and hold the slot until the block is done
+        :param on_queued: called with the position in the queue while waiting, every time it changes
+        :param cached: the search is answered without asking Jackett, it doesn't wait
+        :raise SearchRejected: if the search is not run
+        """
+        if cached:
+            self._count('cached')
+            yield
+            return
+
+        search = self._acquire(user_id, query, on_queued)
+        try:
+            yield
+        finally:
+            with self._condition:
+                if self._finish(search):
+                    self._condition.notify_all()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return self._stats()
+
+    def _acquire(self, user_id, query, on_queued) -> QueuedSearch:
+        with self._condition:
+            search = self._push(user_id, query)
+            self._condition.notify_all()
+
+        position = 0
+        try:
+            while True:
+                with self._condition:
+                    if search.state != QUEUED:
+                        break
+                    new_position = self._get_position(search)
+                    if new_position == position or on_queued is None:
+                        self._condition.wait()
+                        continue
+                position = new_position
+                on_queued(position)
+        except BaseException:
+            with self._condition:
+                if self._finish(search):
+                    self._condition.notify_all()
+            raise
+
+        if search.state == SUPERSEDED:
+            with self._condition:
+                raise self._get_superseded(search)
+        return search
+
+    def _count(self, name):
+        with self._condition:
+            self._counters[name] += 1
+
+
+class AsyncSearchScheduler(SearchQueue):
+    """
+    Same as SearchScheduler, but searches wait for their turn in the running event loop
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._changed = None
+
+    @asynccontextmanager
+    async def slot(self, user_id, query, on_queued: Callable[[int], Awaitable] = None, cached=False):
+        """
+        Same as SearchScheduler.slot, on_queued is awaited
+        """
+        if cached:
+            self._counters['cached'] += 1
+            yield
+            return
+
+        search = await self._acquire(user_id, query, on_queued)
+        try:
+            yield
+        finally:
+            if self._finish(search):
+                self._notify()
+
+    def stats(self) -> dict:
+        return self._stats()
+
+    async def _acquire(self, user_id, query, on_queued) -> QueuedSearch:
+        search = self._push(user_id, query)
+        self._notify()
+
+        position = 0
+        try:
+            while search.state == QUEUED:
+                new_position = self._get_position(search)
+                if new_position == position or on_queued is None:
+                    await self._get_changed().wait()
+                    continue
+                position = new_position
+                await on_queued(position)
+        except BaseException:
+            if self._finish(search):
+                self._notify()
+            raise
+
+        if search.state == SUPERSEDED:
+            raise self._get_superseded(search)
+        return search
+
+    def _get_changed(self) -> asyncio.Event:
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        return self._changed
+
+    def _notify(self):
+        # Every waiting search checks its state and position again
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import threading
+import time
+from dataclasses import dataclass
+
+from cachetools import LRUCache
+
+from latency_model import latency_model, SEARCH_KEY
+from metrics import register_stats
+from query_index import normalize_query
+from result_store import ResultStore, RESULT_STORE_TTL_SECONDS
+from shared_store import SqliteCache, SHARED_STORE_PATH
+
+result_store = ResultStore()
+register_stats('result_store', result_store.stats)
+
+MAX_QUERY_TEXT_LENGTH = 255
+SAVED_QUERIES_SIZE = 1000
+# Searches are expected to take longer than this before the ETA is shown
+SHOW_ETA_MIN_SECONDS = 3
+
+
+@dataclass
+class SavedQuery:
+    text: str
+    base_query: str | None = None  # set if the results were filtered from the results of it instead of searched for
+
+    @property
+    def is_derived(self) -> bool:
+        return self.base_query is not None
+
+
+# Query hash -> query of the saved results, to search it again: with Jackett filters or instead of derived results.
+# Shared by worker processes like the results, so refresh and filter buttons work in any of them and after restarts
+saved_queries = SqliteCache(SHARED_STORE_PATH, 'saved_queries', maxsize=SAVED_QUERIES_SIZE,
+                            ttl=RESULT_STORE_TTL_SECONDS) if SHARED_STORE_PATH else LRUCache(maxsize=SAVED_QUERIES_SIZE)
+saved_queries_lock = threading.Lock()
+
+
+def get_search_eta(elapsed=0.0) -> int | None:
+    """
+    :return: seconds the search is expected to take after elapsed, None if unknown or too short to mention
+    """
+    eta = latency_model.get_eta(SEARCH_KEY, elapsed)
+    return max(1, round(eta)) if eta is not None and elapsed + eta >= SHOW_ETA_MIN_SECONDS else None
+
+
+def clean_text(text):
+    text = text[:MAX_QUERY_TEXT_LENGTH]
+    text = text.lower().strip()
+    return text
+
+
+def get_query_hash(text):
+    # Same results for the same words in another order or case
+    return hashlib.md5(normalize_query(text).encode()).hexdigest()
+
+
+def get_filtered_query_hash(query_hash, version, search_filter) -> str:
+    """
+    :param version: version of the query results, filtered results of a new search are searched again
+    :return: hash of the query results searched with Jackett filters
+    """
+    return hashlib.md5(f'{query_hash}|{version}|{search_filter}'.encode()).hexdigest()
+
+
+def save_results(query_hash, results, query: SavedQuery = None):
+    """
+    :param query: query the results are of
+    """
+    with saved_queries_lock:
+        if query is not None:
+            saved_queries[query_hash] = query
+        elif query_hash in saved_queries:
+            del saved_queries[query_hash]
+    result_store.save(query_hash, results)
+
+
+async def save_results_async(query_hash, results, query: SavedQuery = None):
+    """
+    Same as save_results, the database write runs in a thread of the default executor
+    """
+    await asyncio.to_thread(save_results, query_hash, results, query)
+
+
+def get_saved_query(query_hash) -> SavedQuery | None:
+    with saved_queries_lock:
+        return saved_queries.get(query_hash)
+
+
+def get_results(query_hash) -> list[dict]:
+    return result_store.get(query_hash)
+
+
+def get_results_version(query_hash) -> float | None:
+    return result_store.get_version(query_hash)
+
+
+def are_results_older_than(query_hash, seconds) -> bool:
+    """
+    :return: True if the results were saved more than seconds ago or are gone
+    """
+    version = get_results_version(query_hash)
+    return version is None or time.time() - version > seconds
+
+
+def find_item_by_select_key(select_key):
+    query_cache_key, item_id = select_key.split('_')
+    return result_store.find(query_cache_key, item_id)
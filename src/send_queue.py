@@ -0,0 +1,352 @@
+import asyncio
+import contextvars
+import heapq
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import count
+from typing import Callable, Any, Awaitable
+
+import dotenv
+from cachetools import LRUCache
+
+from metrics import record_stage
+
+dotenv.load_dotenv()
+
+# Telegram allows about 30 messages per second overall and about one message per second to the same chat
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 30))
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', 1))
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', 3))
+TELEGRAM_SEND_WORKERS = int(os.getenv('TELEGRAM_SEND_WORKERS', 4))
+TELEGRAM_MAX_RETRIES = int(os.getenv('TELEGRAM_MAX_RETRIES', 5))
+
+# Lower is sent first
+PRIORITY_HIGH = 0  # search results and replies to commands
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2  # background updates, e.g. files in torrent
+PRIORITY_NAMES = {PRIORITY_HIGH: 'high', PRIORITY_NORMAL: 'normal', PRIORITY_LOW: 'low'}
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at', 'paused_until')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def wait_time(self, now) -> float:
+        """
+        :return: seconds until a token is available, 0 if it's available now
+        """
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, until):
+        # Telegram asked to wait (429), the bucket is empty until then
+        self.paused_until = max(self.paused_until, until)
+        self.tokens = 0
+
+
+class OutgoingMessage:
+    __slots__ = ('chat_id', 'send', 'priority', 'edit_key', 'futures', 'not_before', 'attempts', 'cancelled',
+                 'queued_at', 'context')
+
+    def __init__(self, chat_id, send, priority, edit_key, futures):
+        self.chat_id = chat_id
+        self.send = send
+        self.priority = priority
+        self.edit_key = edit_key
+        self.futures = futures
+        self.not_before = 0.0
+        self.attempts = 0
+        self.cancelled = False  # replaced by a newer edit of the same message
+        self.queued_at = time.monotonic()
+        # The call is made with the trace id of the handler that queued it
+        self.context = contextvars.copy_context()
+
+
+def get_retry_after(e: Exception) -> float | None:
+    """
+    :return: seconds to wait if Telegram rejected the call because of flood limits
+    """
+    # Sync and async clients have different exception classes with the same fields
+    if getattr(e, 'error_code', None) != 429:
+        return None
+    parameters = (getattr(e, 'result_json', None) or {}).get('parameters') or {}
+    return float(parameters.get('retry_after', 1))
+
+
+class OutboundQueue:
+    """
+    Priority queue of Telegram calls limited by a global and per-chat token buckets.
+    Calls to the same chat are made one at a time, queued edits of the same message are coalesced
+    into the latest one and calls rejected with 429 are retried after retry_after.
+    Selection logic only, SendQueue and AsyncSendQueue run the calls
+    """
+
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE, chat_burst=TELEGRAM_CHAT_BURST,
+                 max_retries=TELEGRAM_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = LRUCache(maxsize=10000)
+        self._heap = []
+        self._sequence = count()
+        self._queued_edits: dict[Any, OutgoingMessage] = {}
+        self._busy_chats = set()
+
+    def _push(self, chat_id, send, priority, edit_key, future) -> OutgoingMessage:
+        futures = [future]
+        previous = self._queued_edits.pop(edit_key, None) if edit_key is not None else None
+        if previous is not None:
+            # Only the latest text matters, everyone waiting for the previous edit gets the result of this one
+            previous.cancelled = True
+            futures = previous.futures + futures
+            priority = min(priority, previous.priority)
+
+        message = OutgoingMessage(chat_id, send, priority, edit_key, futures)
+        if edit_key is not None:
+            self._queued_edits[edit_key] = message
+        self._requeue(message)
+        return message
+
+    def _requeue(self, message: OutgoingMessage):
+        heapq.heappush(self._heap, (message.priority, next(self._sequence), message))
+
+    def _pop_ready(self, now) -> tuple[OutgoingMessage | None, float | None]:
+        """
+        :return: message to send now, otherwise seconds to wait (None - wait for a new message)
+        """
+        global_wait = self._global_bucket.wait_time(now)
+        skipped = []
+        ready = None
+        wait = None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            message = entry[2]
+            if message.cancelled:
+                continue
+            if message.chat_id in self._busy_chats:
+                skipped.append(entry)  # will be woken up when the chat is done
+                continue
+            chat_wait = max(message.not_before - now, self._get_chat_bucket(message.chat_id).wait_time(now),
+                            global_wait)
+            if chat_wait > 0:
+                skipped.append(entry)
+                wait = chat_wait if wait is None else min(wait, chat_wait)
+                continue
+            ready = message
+            break
+
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        if ready is None:
+            return None, wait
+
+        if ready.edit_key is not None and self._queued_edits.get(ready.edit_key) is ready:
+            del self._queued_edits[ready.edit_key]
+        self._global_bucket.take()
+        self._get_chat_bucket(ready.chat_id).take()
+        self._busy_chats.add(ready.chat_id)
+        return ready, None
+
+    def _finish(self, message: OutgoingMessage, error: Exception | None) -> bool:
+        """
+        :return: True if the message was put back to the queue to be retried
+        """
+        self._busy_chats.discard(message.chat_id)
+        retry_after = get_retry_after(error) if error is not None else None
+        if retry_after is None or message.attempts >= self.max_retries:
+            return False
+
+        message.attempts += 1
+        message.not_before = time.monotonic() + retry_after
+        self._get_chat_bucket(message.chat_id).pause(message.not_before)
+        print("Send queue: flood limit for chat %s, retry in %s s" % (message.chat_id, retry_after))
+
+        if message.edit_key is not None:
+            newer = self._queued_edits.get(message.edit_key)
+            if newer is not None:
+                # The message was edited again meanwhile, the newer text is sent instead of the retry
+                newer.futures = message.futures + newer.futures
+                return True
+            self._queued_edits[message.edit_key] = message
+        self._requeue(message)
+        return True
+
+    def _record_send(self, message: OutgoingMessage, started_at, error: Exception | None):
+        priority = PRIORITY_NAMES.get(message.priority, str(message.priority))
+        if error is None:
+            outcome = 'ok'
+        else:
+            outcome = 'flood_wait' if get_retry_after(error) is not None else 'error'
+        record_stage('telegram_queue_wait', priority, started_at - message.queued_at)
+        record_stage('telegram_send', priority, time.monotonic() - started_at, outcome)
+
+    def _get_chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _stats(self) -> dict:
+        return {'queued': sum(1 for _, _, message in self._heap if not message.cancelled),
+                'sending': len(self._busy_chats)}
+
+
+class SendQueue(OutboundQueue):
+    """
+    Calls are made by a pool of worker threads, a dispatcher thread picks the next allowed call
+    """
+
+    def __init__(self, workers=TELEGRAM_SEND_WORKERS, **kwargs):
+        super().__init__(**kwargs)
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='send')
+        self._thread = None
+
+    def submit(self, chat_id, send: Callable[[], Any], priority=PRIORITY_NORMAL, edit_key=None) -> Future:
+        """
+        :param send: Telegram call, its result is the result of the future
+        :param edit_key: e.g. (chat id, message id), a queued call with the same key is replaced by this one
+        """
+        future = Future()
+        with self._condition:
+            self._start()
+            self._push(chat_id, send, priority, edit_key, future)
+            self._condition.notify()
+        return future
+
+    def reserve(self, chat_id, priority=PRIORITY_NORMAL) -> Future:
+        """
+        Take the rate limit tokens of a call the caller makes itself, e.g. a long upload that shouldn't keep
+        a send worker and the other calls to the chat waiting
+        :return: future that is done once the call is allowed
+        """
+        return self.submit(chat_id, lambda: None, priority)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return self._stats()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._dispatch, name='send-queue', daemon=True)
+            self._thread.start()
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                message, wait = self._pop_ready(time.monotonic())
+                if message is None:
+                    self._condition.wait(wait)
+                    continue
+            self._executor.submit(self._send, message)
+
+    def _send(self, message: OutgoingMessage):
+        error = result = None
+        started_at = time.monotonic()
+        try:
+            result = message.context.run(message.send)
+        except Exception as e:
+            error = e
+        message.context.run(self._record_send, message, started_at, error)
+
+        with self._condition:
+            retried = self._finish(message, error)
+            self._condition.notify()
+        if retried:
+            return
+        for future in message.futures:
+            if future.done():
+                continue  # cancelled by the caller
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+async def allow_call():
+    pass
+
+
+class AsyncSendQueue(OutboundQueue):
+    """
+    Same as SendQueue for coroutines, calls are tasks of the running event loop
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._wakeup = None
+        self._dispatcher = None
+        self._sending = set()
+
+    def submit(self, chat_id, send: Callable[[], Awaitable], priority=PRIORITY_NORMAL,
+               edit_key=None) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._start()
+        self._push(chat_id, send, priority, edit_key, future)
+        self._wakeup.set()
+        return future
+
+    def reserve(self, chat_id, priority=PRIORITY_NORMAL) -> asyncio.Future:
+        """
+        Same as SendQueue.reserve
+        """
+        return self.submit(chat_id, allow_call, priority)
+
+    def stats(self) -> dict:
+        return self._stats()
+
+    def _start(self):
+        if self._dispatcher is None:
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def _dispatch(self):
+        while True:
+            message, wait = self._pop_ready(time.monotonic())
+            if message is not None:
+                task = asyncio.create_task(self._send(message), context=message.context)
+                self._sending.add(task)
+                task.add_done_callback(self._sending.discard)
+                continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send(self, message: OutgoingMessage):
+        error = result = None
+        started_at = time.monotonic()
+        try:
+            result = await message.send()
+        except Exception as e:
+            error = e
+        self._record_send(message, started_at, error)
+
+        retried = self._finish(message, error)
+        self._wakeup.set()
+        if retried:
+            return
+        for future in message.futures:
+            if future.done():
+                continue  # cancelled by the caller
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
@@ -0,0 +1,89 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+import dotenv
+
+dotenv.load_dotenv()
+
+# SQLite file with the state shared by worker processes (Jackett cache, search times), see supervisor.py
+SHARED_STORE_PATH = os.getenv('SHARED_STORE_PATH', '')
+# Another process holding the write lock is waited for this long
+BUSY_TIMEOUT_SECONDS = 5
+
+
+def open_shared_db(path) -> sqlite3.Connection:
+    db = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False, isolation_level=None)
+    # Readers don't block the writer and each other
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+class SqliteCache:
+    """
+    Mapping of pickled values with LRU-by-write eviction and a TTL, usable from several processes at once.
+    Supports the operations SearchCache needs from its disk tier (`in`, [] and []=), get and del
+    """
+
+    def __init__(self, path, name, maxsize, ttl):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = open_shared_db(path)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                name TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (name, key)
+            ) WITHOUT ROWID""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS cache_age ON cache (name, updated_at)")
+
+    def __contains__(self, key) -> bool:
+        return self._read(key) is not None
+
+    def __getitem__(self, key):
+        value = self._read(key)
+        if value is None:
+            raise KeyError(key)
+        return pickle.loads(value)
+
+    def get(self, key, default=None):
+        value = self._read(key)
+        return pickle.loads(value) if value is not None else default
+
+    def __delitem__(self, key):
+        with self._lock:
+            self._db.execute("DELETE FROM cache WHERE name = ? AND key = ?", (self.name, key))
+
+    def __setitem__(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        with self._lock:
+            try:
+                self._db.execute("BEGIN IMMEDIATE")
+                self._db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)", (self.name, key, data, now))
+                # Expired and least recently written entries over the limit
+                self._db.execute("""
+                    DELETE FROM cache WHERE name = ? AND (updated_at < ? OR key IN (
+                        SELECT key FROM cache WHERE name = ? ORDER BY updated_at DESC LIMIT -1 OFFSET ?))""",
+                                 (self.name, now - self.ttl, self.name, self.maxsize))
+                self._db.execute("COMMIT")
+            except sqlite3.Error as e:
+                print("Shared store: failed to save %s: %s" % (key, e))
+                if self._db.in_transaction:
+                    self._db.execute("ROLLBACK")
+
+    def _read(self, key) -> bytes | None:
+        with self._lock:
+            row = self._db.execute("SELECT value, updated_at FROM cache WHERE name = ? AND key = ?",
+                                   (self.name, key)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return row[0]
+
@@ -0,0 +1,312 @@
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import dotenv
+from telebot import apihelper
+from telebot.types import Update
+
+from metrics import register_stats, start_metrics_server, METRICS_PORT
+from search_scheduler import SEARCH_MAX_PARALLEL, SEARCH_QUEUE_SIZE
+
+dotenv.load_dotenv()
+
+# Worker processes, updates of a chat always go to the same one. 1 - everything runs in this process
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', 1))
+# Handlers of other updates while every search slot and queue place holds a handler thread
+SPARE_HANDLER_THREADS = 8
+# Handler threads of a worker process, updates of a chat are handled one by one, of different chats at the same time.
+# By default a search that runs or waits for its turn never keeps other chats waiting for a thread
+BOT_WORKER_THREADS = int(os.getenv('BOT_WORKER_THREADS') or SEARCH_MAX_PARALLEL + SEARCH_QUEUE_SIZE
+                         + SPARE_HANDLER_THREADS)
+# Same in the async mode, every handler is a task
+BOT_WORKER_ASYNC_HANDLERS = int(os.getenv('BOT_WORKER_ASYNC_HANDLERS', 500))
+# Updates waiting for a busy worker process, then the supervisor stops taking new ones
+BOT_WORKER_QUEUE_SIZE = int(os.getenv('BOT_WORKER_QUEUE_SIZE', 500))
+SHARED_STATE_DIR = os.getenv('SHARED_STATE_DIR', os.path.join(tempfile.gettempdir(), 'telegram-media-bot'))
+REQUEST_TIMEOUT_SECONDS = 60
+LONG_POLLING_TIMEOUT_SECONDS = 30
+WORKER_CHECK_INTERVAL_SECONDS = 5
+
+# Fields of an update that can carry a chat or a user, in the order they are checked
+UPDATE_FIELDS = ['message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+                 'channel_post', 'edited_channel_post', 'shipping_query', 'pre_checkout_query', 'my_chat_member',
+                 'chat_member', 'chat_join_request']
+
+
+def get_shard_key(update: Update) -> int:
+    """
+    :return: chat id of the update (user id if there is no chat), update id if there is neither
+    """
+    for field in UPDATE_FIELDS:
+        item = getattr(update, field, None)
+        if item is None:
+            continue
+        chat = getattr(item, 'chat', None) or getattr(getattr(item, 'message', None), 'chat', None)
+        if chat is not None:
+            return chat.id
+        user = getattr(item, 'from_user', None)
+        if user is not None:
+            return user.id
+    return update.update_id
+
+
+def get_worker_index(shard_key, workers) -> int:
+    return shard_key % workers
+
+
+def share_state():
+    """
+    Point the result store and the shared store to files in SHARED_STATE_DIR, unless they are configured.
+    Worker processes inherit the environment, so they all open the same files
+    """
+    os.makedirs(SHARED_STATE_DIR, exist_ok=True)
+    # Empty values, e.g. copied from .env.example, count as not configured.
+    # load_dotenv() in the workers doesn't override variables that are already set
+    if not os.getenv('RESULT_STORE_DB_PATH'):
+        os.environ['RESULT_STORE_DB_PATH'] = os.path.join(SHARED_STATE_DIR, 'results.db')
+    if not os.getenv('SHARED_STORE_PATH'):
+        os.environ['SHARED_STORE_PATH'] = os.path.join(SHARED_STATE_DIR, 'shared.db')
+
+
+def run_worker(index, mode, updates: multiprocessing.Queue, threads):
+    """
+    Entry point of a worker process: runs the handlers for updates of its shard
+    """
+    print("Worker %d: started, pid %d" % (index, os.getpid()))
+    if METRICS_PORT:
+        # Every process has its own metrics, the supervisor serves METRICS_PORT
+        start_metrics_server(METRICS_PORT + 1 + index)
+    # The Jackett cache is shared, one worker keeps it warm for all of them
+    warm_cache = index == 0
+    if mode == 'async':
+        return asyncio.run(run_async_worker(updates, warm_cache))
+
+    import main
+    from cache_warmer import start_cache_warmer
+
+    if warm_cache:
+        start_cache_warmer(main.search_scheduler)
+
+    chats = ChatUpdates(main.bot, threads)
+    register_stats('chat_updates', chats.stats)
+    while (update := updates.get()) is not None:
+        chats.submit(update)
+
+
+async def run_async_worker(updates: multiprocessing.Queue, warm_cache=False):
+    import async_main
+    from cache_warmer import start_cache_warmer_async
+
+    if warm_cache:
+        start_cache_warmer_async(async_main.search_scheduler)
+
+    chats = AsyncChatUpdates(async_main.bot)
+    register_stats('chat_updates', chats.stats)
+    loop = asyncio.get_running_loop()
+    try:
+        # The multiprocessing queue blocks, it's read in a thread of the default executor
+        while (update := await loop.run_in_executor(None, updates.get)) is not None:
+            chats.submit(update)
+    finally:
+        chats.cancel()
+        await async_main.close_sessions()
+
+
+class ChatUpdates:
+    """
+    Handles updates of a chat one by one in the order they came, and updates of different chats at the same time
+    in a pool of threads. A chat with several waiting updates gives the thread to other chats after each of them
+    """
+
+    def __init__(self, bot, threads=BOT_WORKER_THREADS):
+        self.bot = bot
+        # Handlers run in the threads of this pool, not in the bot's own one
+        self.bot.threaded = False
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='handler')
+        # shard key -> updates of the chat waiting for the one being handled, the key is there while one is
+        self._pending: dict[int, deque[Update]] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, update: Update):
+        key = get_shard_key(update)
+        with self._lock:
+            waiting = self._pending.get(key)
+            if waiting is not None:
+                waiting.append(update)
+                return
+            self._pending[key] = deque([update])
+        self._executor.submit(self._handle_next, key)
+
+    def process_new_updates(self, updates: list[Update]):
+        """
+        Same signature as in TeleBot, so it can take the place of the bot in WebhookServer and poll_updates
+        """
+        for update in updates:
+            self.submit(update)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'chats': len(self._pending), 'waiting': sum(len(waiting) for waiting in self._pending.values())}
+
+    def _handle_next(self, key):
+        with self._lock:
+            update = self._pending[key].popleft()
+        handle_update(self.bot, update)
+        with self._lock:
+            if not self._pending[key]:
+                del self._pending[key]
+                return
+        self._executor.submit(self._handle_next, key)
+
+
+class AsyncChatUpdates:
+    """
+    Same as ChatUpdates for AsyncTeleBot: a task per chat with waiting updates, at most max_handlers of them
+    run a handler at the same time
+    """
+
+    def __init__(self, bot, max_handlers=BOT_WORKER_ASYNC_HANDLERS):
+        self.bot = bot
+        self._slots = asyncio.Semaphore(max_handlers)
+        self._pending: dict[int, deque[Update]] = {}
+        self._tasks = set()
+
+    def submit(self, update: Update):
+        key = get_shard_key(update)
+        waiting = self._pending.get(key)
+        if waiting is not None:
+            waiting.append(update)
+            return
+        self._pending[key] = deque([update])
+        task = asyncio.create_task(self._handle_all(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def cancel(self):
+        for task in list(self._tasks):
+            task.cancel()
+
+    def stats(self) -> dict:
+        return {'chats': len(self._pending), 'waiting': sum(len(waiting) for waiting in self._pending.values())}
+
+    async def _handle_all(self, key):
+        waiting = self._pending[key]
+        try:
+            while waiting:
+                update = waiting.popleft()
+                async with self._slots:
+                    await handle_update_async(self.bot, update)
+        finally:
+            del self._pending[key]
+
+
+def handle_update(bot, update: Update):
+    try:
+        bot.process_new_updates([update])
+    except Exception as e:
+        print("Worker: failed to process update %s: %s" % (update.update_id, e))
+
+
+async def handle_update_async(bot, update: Update):
+    try:
+        await bot.process_new_updates([update])
+    except Exception as e:
+        print("Worker: failed to process update %s: %s" % (update.update_id, e))
+
+
+def poll_updates(token, process_new_updates: Callable[[list[Update]], None]):
+    """
+    Long polling of getUpdates that passes every batch on, instead of running the handlers in the bot's thread pool
+    """
+    apihelper.delete_webhook(token)
+    offset = None
+    while True:
+        try:
+            raw_updates = apihelper.get_updates(token, offset=offset, timeout=REQUEST_TIMEOUT_SECONDS,
+                                                long_polling_timeout=LONG_POLLING_TIMEOUT_SECONDS)
+        except Exception as e:
+            print("Polling: failed to get updates: %s" % e)
+            time.sleep(1)
+            continue
+        if raw_updates:
+            offset = raw_updates[-1]['update_id'] + 1
+            process_new_updates([Update.de_json(raw_update) for raw_update in raw_updates])
+
+
+class Supervisor:
+    """
+    Receives updates in this process and shards them by chat id between worker processes.
+    State needed by every worker (search results and their queries, Jackett cache, search times) is kept in SQLite
+    files, so a /select, a filter or a refresh click works in whichever worker handles it, also after a restart.
+    Rendered pages and result indexes are cached per process and built again from the shared results
+    """
+
+    def __init__(self, mode, workers=BOT_WORKERS, threads=BOT_WORKER_THREADS, queue_size=BOT_WORKER_QUEUE_SIZE):
+        self.mode = mode
+        self.workers = workers
+        self.threads = threads
+        self.queue_size = queue_size
+        # Workers import the bot modules themselves, a fork would copy threads and sockets of this process
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = []
+        self._processes = []
+        self._lock = threading.Lock()
+        self._stopping = False
+        register_stats('supervisor', self.stats)
+
+    def start(self):
+        share_state()
+        self._queues = [self._context.Queue(maxsize=self.queue_size) for _ in range(self.workers)]
+        self._processes = [self._start_worker(index) for index in range(self.workers)]
+        threading.Thread(target=self._watch_workers, name='supervisor', daemon=True).start()
+
+    def stop(self):
+        with self._lock:
+            self._stopping = True
+        for updates in self._queues:
+            updates.put(None)
+        for process in self._processes:
+            process.join(timeout=10)
+
+    def stats(self) -> dict:
+        return {'workers_alive': sum(1 for process in self._processes if process.is_alive()),
+                'queued': sum(updates.qsize() for updates in self._queues)}
+
+    def process_new_updates(self, updates: list[Update]):
+        """
+        Same signature as in TeleBot, so the supervisor can take the place of the bot in WebhookServer
+        """
+        for update in updates:
+            # Blocks while the worker is busy, which makes the webhook queue fill up and reject updates
+            self._queues[get_worker_index(get_shard_key(update), self.workers)].put(update)
+
+    def poll(self, token):
+        """
+        Long polling in the supervisor, workers never call getUpdates
+        """
+        poll_updates(token, self.process_new_updates)
+
+    def _start_worker(self, index):
+        process = self._context.Process(target=run_worker, name=f'worker-{index}', daemon=True,
+                                        args=(index, self.mode, self._queues[index], self.threads))
+        process.start()
+        return process
+
+    def _watch_workers(self):
+        # A crashed worker is restarted with the same queue, its chats don't move to other workers
+        while True:
+            time.sleep(WORKER_CHECK_INTERVAL_SECONDS)
+            with self._lock:
+                if self._stopping:
+                    return
+                for index, process in enumerate(self._processes):
+                    if not process.is_alive():
+                        print("Supervisor: worker %d exited with %s, restarting" % (index, process.exitcode))
+                        self._processes[index] = self._start_worker(index)
@@ -0,0 +1,112 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable
+
+
+class ScheduledCall:
+    """
+    Handle of a callback registered in the DeadlineScheduler.
+    Cancelling is cheap: the entry stays in the heap and is dropped when it reaches the top
+    """
+    __slots__ = ('deadline', 'callback', 'args', 'cancelled', '_scheduler')
+
+    def __init__(self, scheduler, deadline: float, callback: Callable, args: tuple):
+        self._scheduler = scheduler
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self) -> bool:
+        """
+        Cancel the call if it didn't fire yet
+        :return: True if the call was cancelled by this invocation
+        """
+        return self._scheduler._cancel(self)
+
+
+class DeadlineScheduler:
+    """
+    Single thread that fires delayed callbacks in deadline order (binary heap).
+    Replaces a "sleep in a separate thread" per delayed action
+    """
+
+    def __init__(self, name: str = 'deadline-scheduler'):
+        self._name = name
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._cancelled_count = 0
+        self._thread = None
+
+    def call_later(self, delay_seconds: float, callback: Callable, *args) -> ScheduledCall:
+        deadline = time.monotonic() + delay_seconds
+        call = ScheduledCall(self, deadline, callback, args)
+        with self._condition:
+            self._ensure_started()
+            heapq.heappush(self._heap, (deadline, next(self._counter), call))
+            # Wake up the worker only if the new call became the nearest one
+            if self._heap[0][2] is call:
+                self._condition.notify()
+        return call
+
+    def pending_count(self) -> int:
+        with self._condition:
+            return len(self._heap) - self._cancelled_count
+
+    def _cancel(self, call: ScheduledCall) -> bool:
+        with self._condition:
+            if call.cancelled or call.callback is None:
+                return False
+            call.cancelled = True
+            self._cancelled_count += 1
+            # Rebuild the heap when most of it is garbage, so frequent cancels don't grow it forever
+            if self._cancelled_count > 64 and self._cancelled_count * 2 > len(self._heap):
+                self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+                heapq.heapify(self._heap)
+                self._cancelled_count = 0
+            return True
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                call = self._pop_due_call()
+                callback, args = call.callback, call.args
+                # Mark as fired, so late cancel() reports False
+                call.callback = None
+
+            try:
+                callback(*args)
+            except Exception as e:
+                print("Scheduler: callback failed: %s" % e)
+
+    def _pop_due_call(self) -> ScheduledCall:
+        # Must be called with the condition acquired
+        while True:
+            if not self._heap:
+                self._condition.wait()
+                continue
+
+            deadline, _, call = self._heap[0]
+            if call.cancelled:
+                heapq.heappop(self._heap)
+                self._cancelled_count -= 1
+                continue
+
+            timeout = deadline - time.monotonic()
+            if timeout > 0:
+                self._condition.wait(timeout)
+                continue
+
+            heapq.heappop(self._heap)
+            return call
+
+
+scheduler = DeadlineScheduler()
@@ -1,59 +1,215 @@
+import asyncio
 import hashlib
+import os
+import threading
 import urllib
+from concurrent.futures import Future
+from dataclasses import dataclass
 from pprint import pprint
 
-import bencodepy
 import dotenv
-import requests
+from cachetools import LRUCache
 
-from torrserver import add_torrent, get_info, get_file_as_link
+from http_pool import session, get_async_session
+from metrics import stage
+from ranking import extract_infohash
+from torrent_parser import find_info_span, get_torrent_name
+from torrserver import add_torrent, get_info, download_file
 
 dotenv.load_dotenv()
 
+# Downloaded .torrent files are kept up to this size in total
+TORRENT_CACHE_MAX_BYTES = int(os.getenv('TORRENT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
 
-def create_magnet_link_from_url(torrent_file_url) -> (str, bool, str):
+
+@dataclass
+class CachedTorrent:
+    magnet_link: str
+    is_torrent_file: bool
+    torrent_data: bytes | str
+    infohash: str | None = None
+
+    def as_result(self) -> (str, bool, str):
+        return self.magnet_link, self.is_torrent_file, self.torrent_data
+
+
+# Torrent file URL -> CachedTorrent. Redirects to magnet links are cached too, they take almost no space
+torrents_by_url = LRUCache(maxsize=TORRENT_CACHE_MAX_BYTES, getsizeof=lambda torrent: len(torrent.torrent_data) + 1)
+# Infohash -> URL of a downloaded .torrent file, the same release is often linked by several trackers
+torrent_urls_by_infohash = LRUCache(maxsize=10000)
+torrents_lock = threading.Lock()
+# Torrent file URL -> its download, a prefetch and a /select of the same result download it once
+downloads_in_flight: dict[str, Future] = {}
+downloads_in_flight_async: dict[str, asyncio.Task] = {}
+
+
+def get_cached_torrent(torrent_file_url) -> CachedTorrent | None:
+    with torrents_lock:
+        return torrents_by_url.get(torrent_file_url)
+
+
+def get_cached_torrent_by_infohash(infohash) -> CachedTorrent | None:
+    with torrents_lock:
+        url = torrent_urls_by_infohash.get(infohash)
+        return torrents_by_url.get(url) if url is not None else None
+
+
+def find_cached_torrent(torrent_file_url, infohash=None) -> CachedTorrent | None:
+    """
+    :param infohash: of the release, if known: a .torrent file of it downloaded from another tracker is used
+    """
+    cached = get_cached_torrent(torrent_file_url)
+    if cached is None and infohash is not None:
+        cached = get_cached_torrent_by_infohash(infohash)
+    return cached
+
+
+def get_result_infohash(result: dict) -> str | None:
+    return extract_infohash(result.get('infohash'), result.get('magnet'))
+
+
+def cache_torrent(torrent_file_url, result: (str, bool, str), infohash=None) -> (str, bool, str):
+    magnet_link, is_torrent_file, torrent_data = result
+    # Failed downloads are tried again next time
+    if not magnet_link:
+        return result
+
+    torrent = CachedTorrent(magnet_link, is_torrent_file, torrent_data, infohash)
+    with torrents_lock:
+        if len(torrent_data) < TORRENT_CACHE_MAX_BYTES:
+            torrents_by_url[torrent_file_url] = torrent
+        # A redirect to a magnet link of one tracker doesn't stand for a .torrent file another one may give
+        if infohash is not None and is_torrent_file:
+            torrent_urls_by_infohash[infohash] = torrent_file_url
+    return result
+
+
+def get_tracker_label(tracker) -> str:
+    # Merged results list all their trackers, the link is the one of the first
+    return tracker.split(', ')[0] if tracker else ''
+
+
+def create_magnet_link_from_url(torrent_file_url, tracker=None, infohash=None) -> (str, bool, str):
     """
     Create a magnet link from a torrent file URL
+    :param tracker: tracker of the release, downloads are measured per tracker
+    :param infohash: infohash of the release if known, see get_result_infohash
     :return: tuple of magnet link, bool representing was it converted from torrent file
     (True if magnet was created from torrent file), torrent file bytes
     """
     if not torrent_file_url:
         return "", False, ""
 
-    response = requests.get(torrent_file_url, allow_redirects=False)
-
-    # If redirect get the new location
-    if response.status_code == 302:
-        location = response.headers['Location']
-        # Go to it if it's not already a magnet link
-        if not location.startswith('magnet:'):
-            response = requests.get(location, allow_redirects=False)
-        else:
-            return location, False, ""
-
-    if response.status_code != 200:
-        return "Error downloading torrent file"
+    cached = find_cached_torrent(torrent_file_url, infohash)
+    if cached is not None:
+        return cached.as_result()
 
-    torrent_data = response.content
+    with torrents_lock:
+        future = downloads_in_flight.get(torrent_file_url)
+        is_downloading = future is not None
+        if not is_downloading:
+            future = downloads_in_flight[torrent_file_url] = Future()
+    if is_downloading:
+        return future.result()
 
-    # Decode the torrent file
     try:
-        torrent = bencodepy.decode(torrent_data)
+        future.set_result(download_torrent(torrent_file_url, tracker))
     except Exception as e:
-        return f"Error decoding torrent: {e}"
+        future.set_exception(e)
+    finally:
+        with torrents_lock:
+            downloads_in_flight.pop(torrent_file_url, None)
+    return future.result()
 
-    # Extract the info dictionary and calculate the info hash
-    info_hash = hashlib.sha1(bencodepy.encode(torrent[b'info'])).digest()
 
-    # Convert the info hash to a hexadecimal string
-    info_hash_hex = info_hash.hex()
+def download_torrent(torrent_file_url, tracker=None) -> (str, bool, str):
+    with stage('torrent_download', get_tracker_label(tracker)) as current:
+        response = session.get(torrent_file_url, allow_redirects=False)
+
+        # If redirect get the new location
+        if response.status_code == 302:
+            location = response.headers['Location']
+            # Go to it if it's not already a magnet link
+            if not location.startswith('magnet:'):
+                response = session.get(location, allow_redirects=False)
+            else:
+                return cache_torrent(torrent_file_url, (location, False, ""), extract_infohash(location))
+
+        if response.status_code != 200:
+            print("Error downloading torrent file, status: %s" % response.status_code)
+            current.outcome = 'error'
+            return "", False, ""
+
+        return cache_torrent_data(torrent_file_url, response.content)
+
+
+async def create_magnet_link_from_url_async(torrent_file_url, tracker=None, infohash=None) -> (str, bool, str):
+    """
+    Same as create_magnet_link_from_url, but uses the shared async connection pool
+    """
+    if not torrent_file_url:
+        return "", False, ""
+
+    cached = find_cached_torrent(torrent_file_url, infohash)
+    if cached is not None:
+        return cached.as_result()
+
+    task = downloads_in_flight_async.get(torrent_file_url)
+    if task is None:
+        task = downloads_in_flight_async[torrent_file_url] = asyncio.create_task(
+            download_torrent_async(torrent_file_url, tracker))
+        task.add_done_callback(lambda _: downloads_in_flight_async.pop(torrent_file_url, None))
+    # A waiter that gave up doesn't cancel the download for the others
+    return await asyncio.shield(task)
+
+
+async def download_torrent_async(torrent_file_url, tracker=None) -> (str, bool, str):
+    with stage('torrent_download', get_tracker_label(tracker)) as current:
+        http = get_async_session()
+        async with http.get(torrent_file_url, allow_redirects=False) as response:
+            status = response.status
+            location = response.headers.get('Location')
+            torrent_data = await response.read() if status == 200 else b""
+
+        # If redirect get the new location
+        if status == 302:
+            # Go to it if it's not already a magnet link
+            if location.startswith('magnet:'):
+                return cache_torrent(torrent_file_url, (location, False, ""), extract_infohash(location))
+            async with http.get(location, allow_redirects=False) as response:
+                status = response.status
+                torrent_data = await response.read() if status == 200 else b""
+
+        if status != 200:
+            print("Error downloading torrent file, status: %s" % status)
+            current.outcome = 'error'
+            return "", False, ""
+
+        return cache_torrent_data(torrent_file_url, torrent_data)
+
+
+def cache_torrent_data(torrent_file_url, torrent_data: bytes) -> (str, bool, str):
+    result = create_magnet_link_from_torrent_data(torrent_data)
+    return cache_torrent(torrent_file_url, result, extract_infohash(result[0]))
+
+
+def create_magnet_link_from_torrent_data(torrent_data: bytes) -> (str, bool, str):
+    # Find the info dictionary, it's hashed as is without decoding the whole torrent
+    try:
+        info_start, info_end = find_info_span(torrent_data)
+        display_name = get_torrent_name(torrent_data, info_start)
+    except ValueError as e:
+        print(f"Error decoding torrent: {e}")
+        return "", False, ""
+
+    # Calculate the info hash as a hexadecimal string
+    info_hash_hex = hashlib.sha1(memoryview(torrent_data)[info_start:info_end]).hexdigest()
 
     # Create the magnet link
     magnet_link = f"magnet:?xt=urn:btih:{info_hash_hex}"
 
     # Add the display name (dn) to the magnet link (optional)
-    if b'name' in torrent[b'info']:
-        display_name = torrent[b'info'][b'name'].decode('utf-8')
+    if display_name is not None:
         # Properly URL-encode the display name
         encoded_display_name = urllib.parse.quote_plus(display_name)
         magnet_link += f"&dn={encoded_display_name}"
@@ -77,8 +233,8 @@ if __name__ == '__main__':
     print("Get info result: ")
     pprint(info)
 
-    link = get_file_as_link(id_hash, 2)
-    print("Get first file link result: ")
-    pprint(link)
+    with download_file(id_hash, 2, 50 * 1024 * 1024) as file:
+        print("Downloaded second file, bytes: ")
+        pprint(file.seek(0, 2))
 
 # http://localhost:8090/stream/?link=15aae9e49cc516c0f113f702b410beaa42b2bceb&index=1&play
\ No newline at end of file
@@ -0,0 +1,114 @@
+import heapq
+import os
+from array import array
+from dataclasses import dataclass
+
+# Files shown first in a summary, before larger files of other types
+VIDEO_EXTENSIONS = {'.mkv', '.mp4', '.avi', '.m4v', '.mov', '.wmv', '.ts', '.m2ts', '.webm', '.mpg', '.mpeg', '.vob'}
+
+
+def bytes_to_human_readable(size: int) -> str:
+    if not size:
+        return "(unknown size)"
+
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size < 1024.0:
+            break
+        size /= 1024.0
+    return f"{size:.2f} {unit}"
+
+
+def is_video(path) -> bool:
+    return os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+
+@dataclass(slots=True)
+class TorrentFileInfo:
+    id: int
+    title: str  # path in the torrent
+    length: int = 0  # size in bytes, 0 if unknown
+
+    @property
+    def size(self) -> str:
+        return bytes_to_human_readable(self.length)
+
+
+@dataclass(slots=True)
+class FolderInfo:
+    path: str  # relative to the folder of the torrent, '' for files outside of subfolders
+    files: int
+    length: int
+
+    @property
+    def size(self) -> str:
+        return bytes_to_human_readable(self.length)
+
+
+class TorrentFiles:
+    """
+    Column-oriented files of one torrent: paths as given by TorrServer and arrays of ids and sizes instead of
+    an object per file. Summaries pick the files they show without sorting all of them
+    """
+    __slots__ = ('ids', 'paths', 'lengths')
+
+    def __init__(self, file_stats: list[dict] = ()):
+        self.ids = array('q')
+        self.paths = []
+        self.lengths = array('q')
+        for file in file_stats:
+            self.ids.append(int(file.get('id') or 0))
+            self.paths.append(file.get('path') or '')
+            self.lengths.append(int(file.get('length') or 0))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self):
+        return (self.get_file(position) for position in range(len(self.ids)))
+
+    @property
+    def total_length(self) -> int:
+        return sum(self.lengths)
+
+    def get_file(self, position) -> TorrentFileInfo:
+        return TorrentFileInfo(self.ids[position], self.paths[position], self.lengths[position])
+
+    def find(self, file_id) -> TorrentFileInfo | None:
+        try:
+            return self.get_file(self.ids.index(file_id))
+        except ValueError:
+            return None
+
+    def get_main_files(self, count) -> list[TorrentFileInfo]:
+        """
+        :return: the largest videos, then the largest other files, at most count
+        """
+        positions = heapq.nlargest(count, range(len(self.ids)),
+                                   key=lambda position: (is_video(self.paths[position]), self.lengths[position]))
+        return [self.get_file(position) for position in positions]
+
+    def get_folders(self, count) -> list[FolderInfo]:
+        """
+        :return: the largest first-level folders with totals of the files in them, at most count,
+                 nothing if all files are in the same folder
+        """
+        depth = self._get_root_depth()
+        folders = {}
+        for path, length in zip(self.paths, self.lengths):
+            parts = path.split('/', depth + 1)
+            folder = parts[depth] if len(parts) > depth + 1 else ''
+            totals = folders.get(folder)
+            if totals is None:
+                folders[folder] = [1, length]
+            else:
+                totals[0] += 1
+                totals[1] += length
+        if len(folders) < 2:
+            return []
+        largest = heapq.nlargest(count, folders.items(), key=lambda item: item[1][1])
+        return [FolderInfo(path, files, length) for path, (files, length) in largest]
+
+    def _get_root_depth(self) -> int:
+        # Torrents with several files usually have them in one folder named after the torrent, it's skipped
+        roots = {path.split('/', 1)[0] if '/' in path else None for path in self.paths}
+        return 1 if len(roots) == 1 and None not in roots else 0
@@ -0,0 +1,78 @@
+import hashlib
+from typing import Iterator
+
+DIGITS = b'0123456789'
+
+
+def skip_value(data: bytes, position: int) -> int:
+    """
+    Skip a bencoded value without decoding it. Strings (e.g. the piece list) are skipped by their length prefix
+    :return: position right after the value
+    """
+    depth = 0
+    try:
+        while True:
+            token = data[position]
+            if token == ord('i'):
+                position = data.index(b'e', position) + 1
+            elif token in DIGITS:
+                colon = data.index(b':', position)
+                position = colon + 1 + int(data[position:colon])
+            elif token == ord('l') or token == ord('d'):
+                depth += 1
+                position += 1
+                continue
+            elif token == ord('e') and depth > 0:
+                depth -= 1
+                position += 1
+            else:
+                raise ValueError("Unexpected bencode token %r at %d" % (chr(token), position))
+            if position > len(data):
+                raise ValueError("Bencoded string is longer than the data")
+            if depth == 0:
+                return position
+    except IndexError:
+        raise ValueError("Unexpected end of bencoded data")
+
+
+def iter_dict_items(data: bytes, position: int = 0) -> Iterator[tuple[bytes, int, int]]:
+    """
+    :param position: start of a bencoded dictionary
+    :return: key, start and end of the raw value for every item
+    """
+    if data[position:position + 1] != b'd':
+        raise ValueError("Bencoded dictionary expected at %d" % position)
+    position += 1
+    while data[position:position + 1] != b'e':
+        key_end = skip_value(data, position)
+        key = data[data.index(b':', position) + 1:key_end]
+        value_end = skip_value(data, key_end)
+        yield key, key_end, value_end
+        position = value_end
+
+
+def find_info_span(torrent_data: bytes) -> tuple[int, int]:
+    """
+    :return: start and end of the raw info dictionary in the .torrent file
+    """
+    for key, start, end in iter_dict_items(torrent_data):
+        if key == b'info':
+            return start, end
+    raise ValueError("Torrent has no info dictionary")
+
+
+def get_infohash(torrent_data: bytes) -> str:
+    """
+    Infohash is SHA-1 of the info dictionary exactly as it's encoded in the file,
+    so the original bytes are hashed in place instead of decoding and encoding them again
+    """
+    start, end = find_info_span(torrent_data)
+    return hashlib.sha1(memoryview(torrent_data)[start:end]).hexdigest()
+
+
+def get_torrent_name(torrent_data: bytes, info_start: int) -> str | None:
+    for key, start, end in iter_dict_items(torrent_data, info_start):
+        if key == b'name':
+            raw_name = torrent_data[torrent_data.index(b':', start) + 1:end]
+            return raw_name.decode('utf-8', errors='replace')
+    return None
@@ -1,70 +1,239 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
 from dataclasses import dataclass, field
-from time import sleep
 from typing import Callable
 
-from torrserver import add_torrent, get_info
-import threading
+import dotenv
+from cachetools import LRUCache
 
+from metrics import stage, register_stats, submit_traced
+from ranking import extract_infohash
+from torrent_files import TorrentFiles, TorrentFileInfo, bytes_to_human_readable
+from torrserver import add_torrent, get_info, add_torrent_async, get_info_async
 
-@dataclass
-class TorrentFileInfo:
-    id: str
-    title: str
-    size: str
+dotenv.load_dotenv()
 
+# Metadata of a magnet link is resolved by at most this many threads, other requests wait in the queue
+TORRSERVER_INFO_WORKERS = int(os.getenv('TORRSERVER_INFO_WORKERS', 4))
+TORRSERVER_INFO_CACHE_SIZE = int(os.getenv('TORRSERVER_INFO_CACHE_SIZE', 500))
+TORRSERVER_INFO_TIMEOUT_SECONDS = float(os.getenv('TORRSERVER_INFO_TIMEOUT_SECONDS', 30))
+# Poll TorrServer often at first, metadata of well seeded torrents comes in a second
+INFO_POLL_FIRST_DELAY_SECONDS = 0.25
+INFO_POLL_MAX_DELAY_SECONDS = 4
+INFO_POLL_BACKOFF = 1.6
 
 @dataclass
 class TorrentInfo:
     hash: str
     title: str
     size: str
-    files: list[TorrentFileInfo] = field(default_factory=list)
-
-
-def get_torrent_info_by_magnet_link(magnet_link, callback: Callable[[TorrentInfo | None], None]) -> None:
-    def worker():
-        attempt = 0
-        tor_info = None
-        id_hash = None
-        max_attempts = 20
-        while attempt < max_attempts:
-            attempt += 1
-            print("Waiting for torrent info... Attempt %d" % attempt)
+    files: TorrentFiles = field(default_factory=TorrentFiles)
+
+
+info_executor = ThreadPoolExecutor(max_workers=TORRSERVER_INFO_WORKERS, thread_name_prefix='torrent-info')
+# infohash (or magnet link without one) -> TorrentInfo
+torrent_infos = LRUCache(maxsize=TORRSERVER_INFO_CACHE_SIZE)
+torrent_infos_lock = threading.Lock()
+# Same release selected by several users is resolved once, everyone waits for the same future
+in_flight: dict[str, Future] = {}
+in_flight_async: dict[str, asyncio.Task] = {}
+
+
+def get_stats() -> dict:
+    with torrent_infos_lock:
+        return {'cached': len(torrent_infos), 'in_flight': len(in_flight) + len(in_flight_async)}
+
+
+register_stats('torrent_info', get_stats)
+
+
+def get_torrent_info_key(magnet_link) -> str:
+    return extract_infohash(magnet_link) or magnet_link
+
+
+def get_poll_delays():
+    """
+    Exponentially growing pauses between TorrServer polls until the timeout
+    """
+    deadline = time.monotonic() + TORRSERVER_INFO_TIMEOUT_SECONDS
+    delay = INFO_POLL_FIRST_DELAY_SECONDS
+    while (left := deadline - time.monotonic()) > 0:
+        yield min(delay, left)
+        delay = min(delay * INFO_POLL_BACKOFF, INFO_POLL_MAX_DELAY_SECONDS)
+
+
+def get_resolved_torrent(info) -> dict | None:
+    torrent = info.get('Torrent') if info is not None else None
+    # Files are known only when metadata is downloaded
+    return torrent if torrent is not None and torrent.get('file_stats') is not None else None
+
+
+def get_torrent_info_by_magnet_link(magnet_link, callback: Callable[[TorrentInfo], None]) -> None:
+    """
+    Resolve files of the torrent in the worker pool, the callback is called only if they are resolved
+    """
+    key = get_torrent_info_key(magnet_link)
+    with torrent_infos_lock:
+        torrent_info = torrent_infos.get(key)
+        if torrent_info is None:
+            future = in_flight.get(key)
+            if future is None:
+                future = in_flight[key] = submit_traced(info_executor, resolve_torrent_info, key, magnet_link)
+
+    if torrent_info is not None:
+        return callback(torrent_info)
+
+    def on_resolved(resolved: Future):
+        if resolved.cancelled():
+            # A prefetch stopped resolving, resolve the torrent for this /select
+            return get_torrent_info_by_magnet_link(magnet_link, callback)
+        if resolved.result() is not None:
+            callback(resolved.result())
+
+    future.add_done_callback(on_resolved)
+
+
+def prefetch_torrent_info(magnet_link, should_stop: Callable[[], bool]):
+    """
+    Resolve files of the torrent in the calling thread, so a later /select finds them cached.
+    A /select made in the meantime waits for this instead of resolving the torrent again
+    :param should_stop: polled between TorrServer requests, stops resolving if it returns True
+    """
+    key = get_torrent_info_key(magnet_link)
+    with torrent_infos_lock:
+        if key in torrent_infos or key in in_flight:
+            return
+        future = in_flight[key] = Future()
+    torrent_info = resolve_torrent_info(key, magnet_link, should_stop, 'prefetch')
+    if torrent_info is None and should_stop():
+        # A /select waiting for it resolves the torrent itself
+        future.cancel()
+    else:
+        future.set_result(torrent_info)
+
+
+def resolve_torrent_info(key, magnet_link, should_stop: Callable[[], bool] = None, source='') -> TorrentInfo | None:
+    try:
+        with stage('torrserver_metadata', source) as current:
             id_hash = add_torrent(magnet_link)
-            _tor_info = get_info(id_hash)
-            # Got some data
-            if _tor_info is not None and _tor_info.get('Torrent') is not None:
-                tor_info = _tor_info['Torrent']
-                break
-            sleep(1)
-
-        if tor_info is None:
+            for attempt, delay in enumerate(get_poll_delays(), start=1):
+                if should_stop is not None and should_stop():
+                    current.outcome = 'cancelled'
+                    return None
+                print("Waiting for torrent info... Attempt %d" % attempt)
+                tor_info = get_resolved_torrent(get_info(id_hash))
+                # Got some data
+                if tor_info is not None:
+                    return remember_torrent_info(key, build_torrent_info(id_hash, tor_info))
+                time.sleep(delay)
             print("Failed to get torrent info")
+            current.outcome = 'timeout'
+    except Exception as e:
+        print("Failed to get torrent info: %s" % e)
+    finally:
+        with torrent_infos_lock:
+            in_flight.pop(key, None)
+    return None
+
+
+async def get_torrent_info_by_magnet_link_async(magnet_link) -> TorrentInfo | None:
+    """
+    Same as get_torrent_info_by_magnet_link, but waits in the event loop instead of the worker pool
+    """
+    key = get_torrent_info_key(magnet_link)
+    while True:
+        with torrent_infos_lock:
+            torrent_info = torrent_infos.get(key)
+        if torrent_info is not None:
+            return torrent_info
+
+        task = in_flight_async.get(key)
+        if task is None:
+            task = in_flight_async[key] = asyncio.create_task(resolve_torrent_info_async(key, magnet_link))
+            task.add_done_callback(lambda _: in_flight_async.pop(key, None))
+        try:
+            # A waiter that gave up doesn't cancel resolving for the others
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # A prefetch stopped resolving, then it's resolved for this waiter
+            if not task.cancelled():
+                raise
+
+
+async def prefetch_torrent_info_async(magnet_link, should_stop: Callable[[], bool]):
+    """
+    Same as prefetch_torrent_info, but resolves in a task of the running event loop
+    """
+    key = get_torrent_info_key(magnet_link)
+    with torrent_infos_lock:
+        if key in torrent_infos:
             return
+    if key in in_flight_async:
+        return
+
+    task = in_flight_async[key] = asyncio.create_task(prefetch_resolve_async(key, magnet_link, should_stop))
+    task.add_done_callback(lambda _: in_flight_async.pop(key, None))
+    try:
+        await asyncio.shield(task)
+    except asyncio.CancelledError:
+        if not task.cancelled():
+            raise
+
+
+async def prefetch_resolve_async(key, magnet_link, should_stop: Callable[[], bool]) -> TorrentInfo | None:
+    torrent_info = await resolve_torrent_info_async(key, magnet_link, should_stop, 'prefetch')
+    if torrent_info is None and should_stop():
+        # A /select waiting for it resolves the torrent itself
+        raise asyncio.CancelledError
+    return torrent_info
+
+
+async def resolve_torrent_info_async(key, magnet_link, should_stop: Callable[[], bool] = None,
+                                     source='') -> TorrentInfo | None:
+    try:
+        with stage('torrserver_metadata', source) as current:
+            id_hash = await add_torrent_async(magnet_link)
+            for attempt, delay in enumerate(get_poll_delays(), start=1):
+                if should_stop is not None and should_stop():
+                    current.outcome = 'cancelled'
+                    return None
+                print("Waiting for torrent info... Attempt %d" % attempt)
+                tor_info = get_resolved_torrent(await get_info_async(id_hash))
+                # Got some data
+                if tor_info is not None:
+                    return remember_torrent_info(key, build_torrent_info(id_hash, tor_info))
+                await asyncio.sleep(delay)
+            print("Failed to get torrent info")
+            current.outcome = 'timeout'
+    except Exception as e:
+        print("Failed to get torrent info: %s" % e)
+    return None
+
+
+def find_torrent_file(torrent_hash, file_id) -> TorrentFileInfo | None:
+    """
+    :return: file of an already resolved torrent
+    """
+    with torrent_infos_lock:
+        torrent_info = torrent_infos.get(torrent_hash)
+    if torrent_info is None:
+        return None
+    return torrent_info.files.find(file_id)
+
+
+def remember_torrent_info(key, torrent_info: TorrentInfo) -> TorrentInfo:
+    with torrent_infos_lock:
+        torrent_infos[key] = torrent_info
+    return torrent_info
+
 
-        torrent_info = TorrentInfo(
-            hash=id_hash,
-            title=tor_info.get('title'),
-            size=bytes_to_human_readable(tor_info.get('torrent_size'))
-        )
-        for file in tor_info['file_stats']:
-            torrent_info.files.append(TorrentFileInfo(
-                id=file.get('id'),
-                title=file.get('path'),
-                size=bytes_to_human_readable(file.get('length'))
-            ))
-        callback(torrent_info)
-
-    thread = threading.Thread(target=worker)
-    thread.start()
-
-
-def bytes_to_human_readable(size: int) -> str:
-    if not size:
-        return "(unknown size)"
-
-    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-        if size < 1024.0:
-            break
-        size /= 1024.0
-    return f"{size:.2f} {unit}"
+def build_torrent_info(id_hash, tor_info) -> TorrentInfo:
+    return TorrentInfo(
+        hash=id_hash,
+        title=tor_info.get('title'),
+        size=bytes_to_human_readable(tor_info.get('torrent_size')),
+        files=TorrentFiles(tor_info['file_stats'])
+    )
@@ -1,15 +1,54 @@
-import io
 import json
 import os
-from io import BytesIO
+import time
+from tempfile import SpooledTemporaryFile
 
+import aiohttp
 import dotenv
-import requests
+
+from http_pool import session, get_async_session, HTTP_CONNECT_TIMEOUT_SECONDS
 
 dotenv.load_dotenv()
 
 torrserver_url = os.getenv("TORRSERVER_URL")
 
+# Downloaded file is kept in memory up to this size, bigger files are spooled to a temporary file
+DOWNLOAD_MEMORY_BYTES = int(os.getenv('DOWNLOAD_MEMORY_BYTES', 4 * 1024 * 1024))
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+# TorrServer sends nothing while it looks for peers, a download without new data for this long is stalled
+DOWNLOAD_READ_TIMEOUT_SECONDS = int(os.getenv('DOWNLOAD_READ_TIMEOUT_SECONDS', 60))
+# Longest download of a file, so stalled torrents don't hold download workers forever
+DOWNLOAD_TIMEOUT_SECONDS = int(os.getenv('DOWNLOAD_TIMEOUT_SECONDS', 600))
+
+
+class FileTooLargeError(Exception):
+    def __init__(self, size):
+        super().__init__("File is too large: %s bytes" % size)
+        self.size = size
+
+headers = {
+    "accept": "application/json, text/plain, */*",
+    "content-type": "application/json",
+}
+
+
+def get_add_torrent_request(magnet_link) -> dict:
+    return {
+        "action": "add",
+        "link": magnet_link,
+        "title": "",
+        "poster": "",
+        "save_to_db": False
+    }
+
+
+def get_info_request(id: str) -> dict:
+    return {
+        "action": "get",
+        "hash": id
+    }
+
+
 def add_torrent(magnet_link) -> str:
     """
     Add a torrent to the client
@@ -17,18 +56,7 @@ def add_torrent(magnet_link) -> str:
     :return: identifier of the torrent
     """
     url = torrserver_url + "/torrents"
-    headers = {
-        "accept": "application/json, text/plain, */*",
-        "content-type": "application/json",
-    }
-    data = {
-        "action": "add",
-        "link": magnet_link,
-        "title": "",
-        "poster": "",
-        "save_to_db": False
-    }
-    response = requests.post(url, headers=headers, json=data)
+    response = session.post(url, headers=headers, json=get_add_torrent_request(magnet_link))
     json_str = response.text
 
     # Convert the response text to a Python dictionary
@@ -39,25 +67,85 @@ def add_torrent(magnet_link) -> str:
 
 def get_info(id: str) -> dict:
     url = torrserver_url + "/cache"
-    headers = {
-        "accept": "application/json, text/plain, */*",
-        "content-type": "application/json",
-    }
-    data = {
-        "action": "get",
-        "hash": id
-    }
-    response = requests.post(url, headers=headers, json=data)
+    response = session.post(url, headers=headers, json=get_info_request(id))
     data = json.loads(response.text)
     return data
 
 
-def get_file_as_link(id: str, file_num: int) -> BytesIO:
+async def add_torrent_async(magnet_link) -> str:
+    url = torrserver_url + "/torrents"
+    async with get_async_session().post(url, headers=headers, json=get_add_torrent_request(magnet_link)) as response:
+        data = json.loads(await response.text())
+    return data['hash']
+
+
+async def get_info_async(id: str) -> dict:
+    url = torrserver_url + "/cache"
+    async with get_async_session().post(url, headers=headers, json=get_info_request(id)) as response:
+        return json.loads(await response.text())
+
+
+def get_play_url(id: str, file_num: int) -> str:
     # http://localhost:8090/play/<hash_id>/<file_id>
+    return f"{torrserver_url}/play/{id}/{file_num}"
+
+
+def check_file_size(size, max_bytes):
+    if size is not None and int(size) > max_bytes:
+        raise FileTooLargeError(int(size))
 
-    url = f"${torrserver_url}/play/{id}/{file_num}"
 
-    download_response = requests.get(url, stream=True)
-    download_response.raise_for_status()  # Ensure we got a successful response
+def download_file(id: str, file_num: int, max_bytes: int) -> SpooledTemporaryFile:
+    """
+    Stream a file of the torrent in chunks, only DOWNLOAD_MEMORY_BYTES of it are kept in memory
+    :raise FileTooLargeError: before downloading if the size is known, otherwise as soon as it's exceeded
+    :return: file positioned at the start, the caller closes it
+    """
+    deadline = time.monotonic() + DOWNLOAD_TIMEOUT_SECONDS
+    with session.get(get_play_url(id, file_num), stream=True,
+                     timeout=(HTTP_CONNECT_TIMEOUT_SECONDS, DOWNLOAD_READ_TIMEOUT_SECONDS)) as response:
+        response.raise_for_status()
+        check_file_size(response.headers.get('Content-Length'), max_bytes)
+        return spool_chunks(response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE), max_bytes, deadline)
+
 
-    return io.BytesIO(download_response.content)
+async def download_file_async(id: str, file_num: int, max_bytes: int) -> SpooledTemporaryFile:
+    timeout = aiohttp.ClientTimeout(total=DOWNLOAD_TIMEOUT_SECONDS, sock_connect=HTTP_CONNECT_TIMEOUT_SECONDS,
+                                    sock_read=DOWNLOAD_READ_TIMEOUT_SECONDS)
+    async with get_async_session().get(get_play_url(id, file_num), timeout=timeout) as response:
+        response.raise_for_status()
+        check_file_size(response.headers.get('Content-Length'), max_bytes)
+
+        file = SpooledTemporaryFile(max_size=DOWNLOAD_MEMORY_BYTES)
+        try:
+            size = 0
+            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                check_file_size(size, max_bytes)
+                # Spooled to disk in the event loop thread, writes are buffered by the OS
+                file.write(chunk)
+        except BaseException:
+            file.close()
+            raise
+        file.seek(0)
+        return file
+
+
+def spool_chunks(chunks, max_bytes, deadline=None) -> SpooledTemporaryFile:
+    """
+    :param deadline: time.monotonic() after which the download fails with TimeoutError, checked after every chunk
+    """
+    file = SpooledTemporaryFile(max_size=DOWNLOAD_MEMORY_BYTES)
+    try:
+        size = 0
+        for chunk in chunks:
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError("Download took longer than %s seconds" % DOWNLOAD_TIMEOUT_SECONDS)
+            size += len(chunk)
+            check_file_size(size, max_bytes)
+            file.write(chunk)
+    except BaseException:
+        file.close()
+        raise
+    file.seek(0)
+    return file
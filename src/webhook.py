@@ -0,0 +1,251 @@
+import asyncio
+import hmac
+import json
+import os
+import queue
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import dotenv
+from aiohttp import web
+from telebot.types import Update
+
+from metrics import register_stats, render_metrics
+
+dotenv.load_dotenv()
+
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# Public URL of WEBHOOK_PATH registered in Telegram, without it updates are only accepted locally
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')
+# Updates waiting for a worker, when it's full Telegram is asked to retry later
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 8))
+# Handlers running at once in the async mode, every update is a task of its own
+WEBHOOK_ASYNC_HANDLERS = int(os.getenv('WEBHOOK_ASYNC_HANDLERS', 500))
+# Telegram retries a failed delivery, this only hints when
+RETRY_AFTER_SECONDS = 5
+
+
+class WebhookIngress:
+    """
+    Accepting side of the webhook shared by the sync and async servers: request checks, queue and counters
+    """
+
+    def __init__(self, path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET_TOKEN):
+        self.path = path
+        self.secret_token = secret_token
+        self._counters = Counter()
+        self._counters_lock = threading.Lock()
+
+    def check_request(self, path, secret_token) -> int | None:
+        """
+        :return: HTTP status to reject the request with, None if it's accepted
+        """
+        if path != self.path:
+            return 404
+        if self.secret_token and not hmac.compare_digest(secret_token or '', self.secret_token):
+            self.count('unauthorized')
+            return 403
+        return None
+
+    def parse_update(self, body: bytes) -> Update | None:
+        try:
+            return Update.de_json(json.loads(body))
+        except (ValueError, KeyError, TypeError) as e:
+            self.count('invalid')
+            print("Webhook: invalid update: %s" % e)
+            return None
+
+    def count(self, name):
+        with self._counters_lock:
+            self._counters[name] += 1
+
+    def get_stats(self, queued, queue_size) -> dict:
+        with self._counters_lock:
+            stats = dict(self._counters)
+        stats['queued'] = queued
+        stats['queue_size'] = queue_size
+        return stats
+
+
+class WebhookServer(WebhookIngress):
+    """
+    Threaded HTTP server for TeleBot: requests only put updates into a bounded queue,
+    a fixed pool of workers runs the handlers
+    """
+
+    def __init__(self, bot, host=WEBHOOK_HOST, port=WEBHOOK_PORT, queue_size=WEBHOOK_QUEUE_SIZE,
+                 workers=WEBHOOK_WORKERS, **kwargs):
+        super().__init__(**kwargs)
+        self.bot = bot
+        # Handlers run in our workers, otherwise the bot's own pool would queue them without a limit
+        self.bot.threaded = False
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._http = ThreadingHTTPServer((host, port), self._create_request_handler())
+        self._http.daemon_threads = True
+        register_stats('webhook', self.stats)
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self._http.server_address
+
+    def serve_forever(self):
+        for index in range(self.workers):
+            threading.Thread(target=self._work, name=f'webhook-{index}', daemon=True).start()
+        print("Webhook: listening on %s:%s%s" % (*self.address, self.path))
+        self._http.serve_forever()
+
+    def shutdown(self):
+        self._http.shutdown()
+        self._http.server_close()
+
+    def stats(self) -> dict:
+        return self.get_stats(self._queue.qsize(), self._queue.maxsize)
+
+    def accept(self, body: bytes) -> int:
+        """
+        :return: HTTP status of the webhook response
+        """
+        update = self.parse_update(body)
+        if update is None:
+            return 400
+        try:
+            self._queue.put_nowait(update)
+        except queue.Full:
+            self.count('rejected')
+            return 503
+        self.count('accepted')
+        return 200
+
+    def _work(self):
+        while True:
+            update = self._queue.get()
+            try:
+                self.bot.process_new_updates([update])
+            except Exception as e:
+                self.count('failed')
+                print("Webhook: failed to process update %s: %s" % (update.update_id, e))
+
+    def _create_request_handler(self):
+        server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                status = server.check_request(self.path, self.headers.get('X-Telegram-Bot-Api-Secret-Token'))
+                if status is None:
+                    body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                    status = server.accept(body)
+                self._respond(status)
+
+            def do_GET(self):
+                if self.path == '/health':
+                    return self._respond(200, json.dumps(server.stats()).encode())
+                if self.path == '/metrics':
+                    return self._respond(200, render_metrics().encode(), 'text/plain; version=0.0.4')
+                self._respond(404)
+
+            def _respond(self, status, body=b'', content_type='application/json'):
+                self.send_response(status)
+                if status == 503:
+                    self.send_header('Retry-After', str(RETRY_AFTER_SECONDS))
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # every update would be logged otherwise
+
+        return RequestHandler
+
+
+class AsyncWebhookServer(WebhookIngress):
+    """
+    Same as WebhookServer for AsyncTeleBot: an aiohttp server and a task per update. Handlers of AsyncTeleBot
+    are awaited until they finish, so a fixed number of workers would wait for the slowest searches and downloads
+    """
+
+    def __init__(self, bot, host=WEBHOOK_HOST, port=WEBHOOK_PORT, queue_size=WEBHOOK_QUEUE_SIZE,
+                 max_handlers=WEBHOOK_ASYNC_HANDLERS, **kwargs):
+        super().__init__(**kwargs)
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.max_handlers = max_handlers
+        self._queue = None
+        self._handlers = set()
+        register_stats('webhook', self.stats)
+
+    def stats(self) -> dict:
+        stats = self.get_stats(self._queue.qsize() if self._queue is not None else 0, self.queue_size)
+        stats['handling'] = len(self._handlers)
+        return stats
+
+    async def serve_forever(self):
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        app = web.Application()
+        app.router.add_post(self.path, self._receive)
+        app.router.add_get('/health', self._health)
+        app.router.add_get('/metrics', self._metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+        dispatcher = asyncio.create_task(self._dispatch())
+        print("Webhook: listening on %s:%s%s" % (self.host, self.port, self.path))
+        try:
+            await asyncio.Event().wait()
+        finally:
+            dispatcher.cancel()
+            for handler in list(self._handlers):
+                handler.cancel()
+            await runner.cleanup()
+
+    async def _receive(self, request: web.Request) -> web.Response:
+        status = self.check_request(request.path, request.headers.get('X-Telegram-Bot-Api-Secret-Token'))
+        if status is None:
+            status = self.accept(await request.read())
+        headers = {'Retry-After': str(RETRY_AFTER_SECONDS)} if status == 503 else None
+        return web.Response(status=status, headers=headers)
+
+    async def _health(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=render_metrics(), content_type='text/plain')
+
+    def accept(self, body: bytes) -> int:
+        update = self.parse_update(body)
+        if update is None:
+            return 400
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.count('rejected')
+            return 503
+        self.count('accepted')
+        return 200
+
+    async def _dispatch(self):
+        # Updates beyond max_handlers wait in the queue, so a full queue still makes Telegram retry later
+        slots = asyncio.Semaphore(self.max_handlers)
+        while True:
+            update = await self._queue.get()
+            await slots.acquire()
+            handler = asyncio.create_task(self._handle(update, slots))
+            self._handlers.add(handler)
+            handler.add_done_callback(self._handlers.discard)
+
+    async def _handle(self, update: Update, slots: asyncio.Semaphore):
+        try:
+            await self.bot.process_new_updates([update])
+        except Exception as e:
+            self.count('failed')
+            print("Webhook: failed to process update %s: %s" % (update.update_id, e))
+        finally:
+            slots.release()
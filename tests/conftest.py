@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+# The bot modules are configured through the environment when they are imported, like in a deployment
+os.environ.update({
+    'BOT_TOKEN': '123456:test',
+    'JACKETT_SERVER_URL': 'http://127.0.0.1:9',
+    'JACKETT_API_KEY': 'test',
+    'TORRSERVER_URL': 'http://127.0.0.1:9',
+    'SHARED_STORE_PATH': ':memory:',
+    'RESULT_STORE_DB_PATH': '',
+})
+# Caches are created in the working directory
+os.chdir(tempfile.mkdtemp(prefix='bot-tests-'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
@@ -0,0 +1,67 @@
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+import jackett
+
+SLOW_INDEXER_SECONDS = 5
+
+
+class IndexerHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if '/slow/' in self.path:
+            # Jackett answers only once the indexer has, nothing is sent meanwhile
+            self.server.stopped.wait(SLOW_INDEXER_SECONDS)
+        body = json.dumps({'Results': [{'Title': 'Ubuntu 24.04', 'Seeders': 10}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def jackett_server(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), IndexerHandler)
+    server.daemon_threads = True
+    server.stopped = threading.Event()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(jackett, 'JACKETT_SERVER_URL', 'http://127.0.0.1:%d' % server.server_address[1])
+    monkeypatch.setattr(jackett, 'JACKETT_INDEXERS', ['fast', 'slow'])
+    yield server
+    server.stopped.set()
+    server.shutdown()
+
+
+def test_stragglers_are_cut_and_free_their_threads(jackett_server, monkeypatch):
+    finished = {}
+    search_indexer = jackett.search_indexer
+
+    def track_search_indexer(indexer_id, *args):
+        try:
+            return search_indexer(indexer_id, *args)
+        finally:
+            finished[indexer_id] = time.monotonic()
+
+    # The slow indexer usually brings nothing, the search stops waiting for it soon after the fast one answers
+    monkeypatch.setattr(jackett, 'search_indexer', track_search_indexer)
+    monkeypatch.setattr(jackett.latency_model, 'get_results_share', lambda keys, all_keys: 0.0)
+    monkeypatch.setattr(jackett, 'JACKETT_STRAGGLERS_GRACE_SECONDS', 0.2)
+
+    start_time = time.monotonic()
+    progress = jackett.fan_out_search('ubuntu', None, deadline_seconds=30)
+
+    assert time.monotonic() - start_time < 2
+    assert progress.timed_out == ['slow']
+    assert [result['title'] for result in progress.results] == ['Ubuntu 24.04']
+    # The request is cut, not left waiting for the answer in a thread of the shared pool
+    deadline = time.monotonic() + 2
+    while 'slow' not in finished and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert finished['slow'] - start_time < 2
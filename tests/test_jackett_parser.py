@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from jackett_parser import JsonArrayStreamParser, iter_results, select_top_results
+from ranking import rank_results
+
+RESULTS = [
+    {'Title': 'Ubuntu 24.04 "Noble" [x64]', 'Seeders': 10, 'Category': [4000]},
+    {'Title': 'Убунту, ÿ и 日本語', 'Seeders': 3, 'Tags': ['a]', '{b}']},
+    {'Title': 'Nested', 'Seeders': 0, 'Extra': {'Results': [1, 2]}},
+]
+DOCUMENT = json.dumps({'Indexers': [{'ID': 'x'}], 'Results': RESULTS, 'After': 'ignored'}, ensure_ascii=False)
+
+
+def split_every(data: bytes, size):
+    return [data[position:position + size] for position in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64, 1 << 20])
+def test_items_split_across_chunks(chunk_size):
+    # Small chunks split the key, the items and multi-byte characters
+    assert list(iter_results(split_every(DOCUMENT.encode(), chunk_size))) == RESULTS
+
+
+def test_every_split_point():
+    data = DOCUMENT.encode()
+    for split in range(1, len(data)):
+        assert list(iter_results([data[:split], data[split:]])) == RESULTS
+
+
+def test_items_are_returned_as_soon_as_they_are_complete():
+    parser = JsonArrayStreamParser()
+    assert parser.feed('{"Res') == []
+    assert parser.feed('ults": [{"a": 1}, {"b"') == [{'a': 1}]
+    assert parser.feed(': 2}') == [{'b': 2}]
+    assert parser.feed(']}') == []
+    parser.close()
+
+
+def test_empty_array():
+    assert list(iter_results([b'{"Results": []}'])) == []
+
+
+def test_missing_key():
+    assert list(iter_results([b'{"Other": [1, 2]}'])) == []
+
+
+def test_truncated_document():
+    with pytest.raises(ValueError):
+        list(iter_results([DOCUMENT.encode()[:len(DOCUMENT) // 2]]))
+
+
+def test_dropped_results_mark_the_top_results_truncated():
+    assert not select_top_results(RESULTS, limit=3).truncated
+    top_results = select_top_results(RESULTS, limit=2)
+    assert [result['seeds'] for result in top_results] == [10, 3]
+    # Ranking merges duplicates, the results are still missing the dropped ones
+    assert top_results.truncated and rank_results(top_results).truncated
@@ -0,0 +1,68 @@
+import os
+import threading
+import time
+
+import latency_model
+from latency_model import LatencyModel, LatencyStats, get_ewma, get_indexer_key
+
+
+def make_model(tmp_path, name='latency.db') -> LatencyModel:
+    return LatencyModel(os.path.join(tmp_path, name), samples=10)
+
+
+def test_eta_of_the_samples_longer_than_elapsed():
+    stats = LatencyStats([1, 2, 3, 4, 10], [])
+    assert stats.get_eta() == 3
+    assert stats.get_eta(2.5) == 1.5
+    # Takes longer than ever before
+    assert stats.get_eta(10) is None
+    assert LatencyStats([1, 2], []).get_eta() is None
+
+
+def test_ewma_weights_recent_samples():
+    assert get_ewma([]) is None
+    assert get_ewma([10, 0], alpha=0.5) == 5
+
+
+def test_recorded_samples_are_estimated_right_away(tmp_path):
+    model = make_model(tmp_path)
+    for seconds in range(1, 16):
+        model.record('search', seconds, 1)
+    # Only the last samples are kept
+    assert model.get_stats('search').seconds == list(range(6, 16))
+    assert model.get_eta('search') == 11
+
+
+def test_results_share_of_the_indexers(tmp_path):
+    model = make_model(tmp_path)
+    fast, slow = get_indexer_key('fast'), get_indexer_key('slow')
+    for _ in range(5):
+        model.record(fast, 1, 90)
+        model.record(slow, 5, 10)
+    assert model.get_results_share([slow], [fast, slow]) == 0.1
+    assert model.get_results_share([get_indexer_key('new')], [fast, get_indexer_key('new')]) is None
+
+
+def test_estimates_do_not_wait_for_the_database(tmp_path):
+    model = make_model(tmp_path)
+    model.record('search', 1, 1)
+    # e.g. a write waiting for another process to release the database
+    with model._lock:
+        thread = threading.Thread(target=model.get_stats, args=('search',))
+        start_time = time.monotonic()
+        thread.start()
+        thread.join(1)
+        assert not thread.is_alive()
+        assert time.monotonic() - start_time < 1
+
+
+def test_samples_of_other_processes_are_read_in_the_background(tmp_path, monkeypatch):
+    model = make_model(tmp_path)
+    other = make_model(tmp_path)
+    other.record('search', 7, 1)
+    assert model.get_stats('search').seconds == []
+
+    monkeypatch.setattr(latency_model, 'SNAPSHOT_TTL_SECONDS', 0)
+    model.get_stats('search')
+    model._writer.submit(lambda: None).result()
+    assert model.get_stats('search').seconds == [7]
@@ -0,0 +1,78 @@
+import time
+
+from query_index import QueryIndex, normalize_query
+
+RESULTS = [
+    {'title': 'Ubuntu 24.04 Desktop amd64'},
+    {'title': 'Ubuntu 24.04 Server amd64'},
+    {'title': 'ubuntu-24.04-desktop-arm64'},
+    {'title': 'Ubuntu 22.04 Desktop'},
+    {'title': 'Kubuntu 24.04 Desktop'},
+]
+
+
+def get_titles(derived) -> list[str]:
+    return [result['title'] for result in derived.results]
+
+
+def test_normalize_query():
+    assert normalize_query('Ubuntu  24.04, DESKTOP!') == normalize_query('desktop ubuntu 24 04')
+    assert normalize_query('Ёлки') == normalize_query('елки')
+
+
+def test_refinement_filters_by_title_words():
+    index = QueryIndex(ttl=60, min_results=1)
+    index.add('ubuntu', RESULTS)
+
+    derived = index.find_refinement('Ubuntu desktop 24.04')
+    assert derived.base_query == 'ubuntu'
+    assert get_titles(derived) == ['Ubuntu 24.04 Desktop amd64', 'ubuntu-24.04-desktop-arm64', 'Kubuntu 24.04 Desktop']
+    # Longer words match beginnings of title words
+    assert get_titles(index.find_refinement('ubuntu serv')) == ['Ubuntu 24.04 Server amd64']
+
+
+def test_closest_query_is_used():
+    index = QueryIndex(ttl=60, min_results=1)
+    index.add('ubuntu', RESULTS)
+    index.add('ubuntu desktop', RESULTS[:1])
+
+    assert index.find_refinement('ubuntu desktop amd64').base_query == 'ubuntu desktop'
+
+
+def test_no_refinement():
+    index = QueryIndex(ttl=60, min_results=2)
+    index.add('ubuntu', RESULTS)
+
+    # Fetched as is, the search cache answers it
+    assert index.find_refinement('UBUNTU') is None
+    # Too few local matches
+    assert index.find_refinement('ubuntu server') is None
+    # Not a narrower query
+    assert index.find_refinement('debian desktop') is None
+
+
+def test_stale_queries_are_ignored():
+    index = QueryIndex(ttl=60, min_results=1)
+    index.add('ubuntu', RESULTS, fetched_at=time.time() - 61)
+
+    assert index.find_refinement('ubuntu desktop') is None
+    assert index.find_completion('ubuntu desk') is None
+
+
+def test_completion_of_the_last_word():
+    index = QueryIndex(ttl=60)
+    index.add('ubuntu desktop', RESULTS)
+
+    assert index.find_completion('ubuntu desk').base_query == 'ubuntu desktop'
+    assert get_titles(index.find_completion('ubuntu desktop serv')) == ['Ubuntu 24.04 Server amd64']
+    assert index.find_completion('ubuntu x') is None
+
+
+def test_oldest_queries_are_evicted():
+    index = QueryIndex(ttl=60, size=2, min_results=1)
+    index.add('ubuntu', RESULTS)
+    index.add('kubuntu', RESULTS[4:])
+    index.add('debian', [])
+
+    assert index.find_refinement('ubuntu desktop') is None
+    assert index.find_refinement('kubuntu desktop').base_query == 'kubuntu'
@@ -0,0 +1,52 @@
+import ranking
+from ranking import extract_infohash, merge_duplicates, rank_results
+
+INFOHASH = 'c9e15763f722f23e98a29decdfae341b98d53056'
+# Same infohash in base32, as some magnet links have it
+INFOHASH_BASE32 = 'ZHQVOY7XELZD5GFCTXWN7LRUDOMNKMCW'
+
+
+def make_result(title, seeds, tracker, infohash=None, **fields) -> dict:
+    return {'title': title, 'seeds': seeds, 'tracker': tracker, 'size_bytes': 100, 'infohash': infohash,
+            'magnet': None, 'torrent': None, **fields}
+
+
+def test_infohash_of_hex_and_base32_magnet_links():
+    assert extract_infohash(None, 'magnet:?xt=urn:btih:' + INFOHASH.upper() + '&dn=x') == INFOHASH
+    assert extract_infohash('magnet:?xt=urn:btih:' + INFOHASH_BASE32) == INFOHASH
+    assert extract_infohash('magnet:?dn=no-hash', 'not a hash') is None
+
+
+def test_copies_of_a_release_are_merged():
+    results = [make_result('Ubuntu', 10, 'rutracker', INFOHASH, torrent='http://rutracker/1'),
+               make_result('Ubuntu (other name)', 30, 'kinozal', INFOHASH, magnet='magnet:?xt=urn:btih:' + INFOHASH),
+               make_result('Debian', 5, 'rutracker', 'd' * 40)]
+    merged = merge_duplicates(results)
+
+    assert [result['title'] for result in merged] == ['Ubuntu', 'Debian']
+    ubuntu = merged[0]
+    # The swarm is shared: the best seeds, every tracker and download source of the copies
+    assert ubuntu['seeds'] == 30
+    assert ubuntu['tracker'] == 'rutracker, kinozal'
+    assert ubuntu['torrent'] == 'http://rutracker/1' and ubuntu['magnet'].endswith(INFOHASH)
+    # Input results are not changed, they may be cached
+    assert results[0]['seeds'] == 10 and 'trackers' not in results[0]
+
+
+def test_without_infohash_same_title_and_size_is_the_same_release():
+    merged = merge_duplicates([make_result('Ubuntu 24.04', 1, 'a'), make_result(' ubuntu 24.04 ', 2, 'b'),
+                               make_result('Ubuntu 24.04', 3, 'c', size_bytes=200)])
+    assert [result['tracker'] for result in merged] == ['a, b', 'c']
+
+
+def test_default_ranking_is_by_seeds_keeping_the_order_of_ties():
+    ranked = rank_results([make_result('one', 1, 'a', '1' * 40), make_result('ten', 10, 'a', '2' * 40),
+                           make_result('other one', 1, 'a', '3' * 40)])
+    assert [result['title'] for result in ranked] == ['ten', 'one', 'other one']
+
+
+def test_tracker_weights(monkeypatch):
+    monkeypatch.setattr(ranking, 'RANKING_TRACKER_WEIGHTS', {'kinozal': 5.0})
+    ranked = rank_results([make_result('popular', 100, 'rutracker', '1' * 40),
+                           make_result('preferred', 10, 'Kinozal', '2' * 40)])
+    assert [result['title'] for result in ranked] == ['preferred', 'popular']
@@ -0,0 +1,82 @@
+from ranking import SearchResults
+from result_filters import ResultIndex, ResultFilter, SearchFilter, get_tracker_code, encode_filter, decode_filter, \
+    NO_FILTER, GB
+
+RESULTS = [
+    {'title': 'movie 1080p', 'size_bytes': 3 * GB, 'seeds': 50, 'category': 2040, 'tracker': 'rutracker',
+     'tracker_id': 'rutracker'},
+    {'title': 'movie 2160p', 'size_bytes': 20 * GB, 'seeds': 5, 'category': 2045, 'tracker': 'kinozal, rutracker',
+     'tracker_id': 'kinozal'},
+    {'title': 'movie soundtrack', 'size_bytes': 200 * 1024 * 1024, 'seeds': 120, 'category': 3010,
+     'tracker': 'rutracker', 'tracker_id': 'rutracker'},
+    {'title': 'movie 720p', 'size_bytes': 1 * GB, 'seeds': 0, 'category': 2030, 'tracker': 'kinozal',
+     'tracker_id': 'kinozal'},
+    {'title': 'movie unknown size', 'size_bytes': 0, 'seeds': 10, 'category': 100500, 'tracker': 'nnm',
+     'tracker_id': 'nnmclub'},
+]
+RUTRACKER = get_tracker_code('rutracker')
+KINOZAL = get_tracker_code('kinozal')
+
+
+def test_no_filter_keeps_the_ranked_order():
+    assert ResultIndex(RESULTS).filter(NO_FILTER) == [0, 1, 2, 3, 4]
+
+
+def test_sorts():
+    index = ResultIndex(RESULTS)
+    assert index.filter(ResultFilter(sort=1)) == [2, 0, 4, 1, 3]
+    assert index.filter(ResultFilter(sort=2)) == [1, 0, 3, 2, 4]
+    assert index.filter(ResultFilter(sort=3)) == [4, 2, 3, 0, 1]
+
+
+def test_single_filters():
+    index = ResultIndex(RESULTS)
+    assert index.filter(ResultFilter(category=2000)) == [0, 1, 3]
+    assert index.filter(ResultFilter(tracker=RUTRACKER)) == [0, 1, 2]
+    # Unknown sizes are less than 2 GB
+    assert index.filter(ResultFilter(size=1)) == [2, 3, 4]
+    assert index.filter(ResultFilter(size=2)) == [1]
+    assert index.filter(ResultFilter(min_seeds=2)) == [0, 2, 4]
+
+
+def test_combined_filters_in_order_of_the_sort():
+    index = ResultIndex(RESULTS)
+    assert index.filter(ResultFilter(category=2000, tracker=KINOZAL)) == [1, 3]
+    assert index.filter(ResultFilter(category=2000, tracker=KINOZAL, sort=3)) == [3, 1]
+    assert index.filter(ResultFilter(category=2000, min_seeds=1, sort=1)) == [0, 1]
+    assert index.filter(ResultFilter(category=5000)) == []
+
+
+def test_available_filters():
+    index = ResultIndex(RESULTS)
+    assert index.get_available_sizes() == [1, 2, 3]
+    assert index.get_available_categories() == [2000, 3000]
+    assert index.get_top_trackers(2) == [RUTRACKER, KINOZAL]
+    assert index.tracker_names[RUTRACKER] == 'rutracker'
+
+
+def test_search_filter_only_for_truncated_results():
+    index = ResultIndex(RESULTS)
+    assert index.get_search_filter(ResultFilter(category=2000)) is None
+
+    index = ResultIndex(SearchResults(RESULTS, truncated=True))
+    assert index.get_search_filter(ResultFilter(category=2000)) == SearchFilter((2000,))
+    # The indexer id of a merged result is the one of its first tracker
+    assert index.get_search_filter(ResultFilter(tracker=KINOZAL)) == SearchFilter((), 'kinozal')
+    assert index.get_search_filter(ResultFilter(size=1)) is None
+
+
+def test_filter_state_round_trip():
+    for result_filter in [NO_FILTER, ResultFilter(category=2000), ResultFilter(3000, KINOZAL, 2, 3, 1)]:
+        assert decode_filter(encode_filter(result_filter)) == result_filter
+    assert decode_filter('filter_more_size_4') == ResultFilter(size=2)
+    assert decode_filter('zzzzzzzz') is None
+    # Buttons with 2 character tracker codes keep the rest of their filter
+    assert decode_filter('2ab310') == ResultFilter(2000, '', 3, 1, 0)
+
+
+def test_trackers_with_the_same_code_get_no_filter(monkeypatch):
+    monkeypatch.setattr('result_filters.get_tracker_code', lambda tracker: 'same' if tracker != 'nnm' else 'nnmc')
+    index = ResultIndex(SearchResults(RESULTS, truncated=True))
+    assert index.get_top_trackers(3) == ['nnmc']
+    assert index.get_search_filter(ResultFilter(tracker='same')) is None
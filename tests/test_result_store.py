@@ -0,0 +1,79 @@
+import os
+import time
+
+from result_store import ResultStore, make_item_id
+
+RESULTS = [
+    {'title': 'Ubuntu 24.04', 'size_bytes': 6 * 1024 ** 3, 'seeds': 100, 'magnet': 'magnet:?xt=urn:btih:' + 'a' * 40,
+     'torrent': None, 'tracker': 'rutracker', 'tracker_id': 'rutracker', 'category': 4000, 'infohash': 'a' * 40},
+    {'title': 'Ubuntu 22.04', 'size_bytes': 0, 'seeds': None, 'magnet': None, 'torrent': 'http://jackett/dl/2',
+     'tracker': 'kinozal', 'tracker_id': 'kinozal', 'category': 0, 'infohash': None},
+]
+
+
+def make_store(tmp_path=None, **kwargs) -> ResultStore:
+    return ResultStore(db_path=os.path.join(tmp_path, 'results.db') if tmp_path else '', **kwargs)
+
+
+def without_ids(results):
+    return [{key: value for key, value in result.items() if key != 'id'} for result in results]
+
+
+def test_saved_results_are_read_back_with_ids():
+    store = make_store()
+    store.save('query', RESULTS)
+    # The saved ones are cached results of Jackett, shared with other queries
+    assert all('id' not in result for result in RESULTS)
+    results = store.get('query')
+    assert without_ids(results) == RESULTS
+    assert store.find('query', results[1]['id']) == results[1]
+    assert store.find('query', 'NOPE00') is None
+    assert store.get('other') == []
+
+
+def test_ids_are_stable_and_unique_within_a_query():
+    store = make_store()
+    # Same release twice, e.g. not merged because the copies differ in size
+    store.save('query', [RESULTS[0], dict(RESULTS[0])])
+    first, second = store.get('query')
+    assert first['id'] == make_item_id(RESULTS[0])
+    assert second['id'] != first['id']
+
+
+def test_new_results_replace_the_old_ones():
+    store = make_store()
+    store.save('query', RESULTS)
+    version = store.get_version('query')
+    time.sleep(0.01)
+    store.save('query', RESULTS[:1])
+    assert len(store.get('query')) == 1
+    assert store.get_version('query') > version
+
+
+def test_least_recently_used_queries_are_evicted_by_size():
+    store = make_store(max_bytes=1)
+    store.save('old', RESULTS)
+    store.save('new', RESULTS)
+    # The newest one is kept even if it's larger than the limit
+    assert store.get('old') == []
+    assert len(store.get('new')) == 2
+
+
+def test_expired_results_are_gone(monkeypatch):
+    store = make_store(ttl_seconds=60)
+    store.save('query', RESULTS)
+    expired_at = store.get_version('query') + 61
+    monkeypatch.setattr(time, 'time', lambda: expired_at)
+    assert store.get('query') == []
+    assert store.get_version('query') is None
+
+
+def test_results_survive_a_restart_with_a_database(tmp_path):
+    store = make_store(tmp_path)
+    store.save('query', RESULTS)
+    item_id = store.get('query')[0]['id']
+
+    restarted = make_store(tmp_path)
+    assert restarted.get_version('query') == store.get_version('query')
+    assert restarted.find('query', item_id)['title'] == 'Ubuntu 24.04'
+    assert without_ids(restarted.get('query')) == RESULTS
@@ -0,0 +1,54 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import jackett
+import main
+
+
+def make_message(user_id=1):
+    return SimpleNamespace(from_user=SimpleNamespace(id=user_id, language_code='en'))
+
+
+def test_cached_search_returns_without_alert(monkeypatch):
+    text = 'ubuntu cached'
+    results = [{'title': 'Ubuntu 24.04', 'magnet': 'magnet:?xt=urn:btih:' + '0' * 40}]
+    jackett.cache.put(jackett.get_cache_key(text), results)
+
+    def fetch_jackett(*args):
+        raise AssertionError("a cached search must not ask Jackett")
+
+    alerts = []
+    alert_fired = threading.Event()
+
+    def say_later(*args, **kwargs):
+        alerts.append(args)
+        alert_fired.set()
+
+    monkeypatch.setattr(jackett, 'fetch_jackett', fetch_jackett)
+    monkeypatch.setattr(main, 'say_later', say_later)
+    monkeypatch.setattr(main, 'WAIT_TIMEOUT_TO_NOTIFY_SECONDS', 0.5)
+
+    start_time = time.monotonic()
+    found = main.search_jackett_with_progress_alert(text, make_message(), cached=jackett.is_search_cached(text))
+    elapsed = time.monotonic() - start_time
+
+    assert found == results
+    assert elapsed < 1
+    # The alert would have fired by now if the search had not cancelled it
+    assert not alert_fired.wait(1)
+    assert alerts == []
+
+
+def test_slow_search_fires_alert(monkeypatch):
+    alert_fired = threading.Event()
+
+    def search(text):
+        alert_fired.wait(2)
+        return []
+
+    monkeypatch.setattr(main, 'say_later', lambda *args, **kwargs: alert_fired.set())
+    monkeypatch.setattr(main, 'WAIT_TIMEOUT_TO_NOTIFY_SECONDS', 0.1)
+
+    assert main.search_jackett_with_progress_alert('ubuntu slow', make_message(2), search) == []
+    assert alert_fired.is_set()
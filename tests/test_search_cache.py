@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from search_cache import SearchCache, CachedSearch
+
+
+def make_cache(**kwargs) -> SearchCache:
+    kwargs.setdefault('ttl', 60)
+    kwargs.setdefault('stale_ttl', 600)
+    # A dict is enough for the disk tier, the shared one is a SqliteCache
+    kwargs.setdefault('disk', {})
+    return SearchCache(ThreadPoolExecutor(max_workers=1), **kwargs)
+
+
+def test_concurrent_lookups_share_one_fetch():
+    cache = make_cache()
+    calls = []
+    release = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return ['result']
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        futures = [pool.submit(cache.get_or_fetch, 'key', fetch) for _ in range(5)]
+        time.sleep(0.2)
+        release.set()
+        assert [future.result() for future in futures] == [['result']] * 5
+    assert len(calls) == 1
+    assert cache.stats()['coalesced'] == 4
+
+
+def test_concurrent_coroutines_share_one_fetch():
+    cache = make_cache()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return ['result']
+
+    async def search_all():
+        return await asyncio.gather(*(cache.get_or_fetch_async('key', fetch) for _ in range(5)))
+
+    assert asyncio.run(search_all()) == [['result']] * 5
+    assert len(calls) == 1
+    # Saved in both tiers
+    assert asyncio.run(cache.get_async('key')) == ['result']
+
+
+def test_failures_are_not_cached():
+    cache = make_cache()
+
+    def fail():
+        raise ValueError("Jackett is down")
+
+    with pytest.raises(ValueError):
+        cache.get_or_fetch('key', fail)
+    assert cache.get_or_fetch('key', lambda: ['result']) == ['result']
+
+
+def test_stale_entry_is_returned_and_refreshed_in_the_background():
+    cache = make_cache()
+    cache.put('key', ['old'])
+    cache._memory['key'].fetched_at -= 120
+    refreshed = threading.Event()
+
+    def refresh():
+        refreshed.set()
+        return ['new']
+
+    assert cache.get_or_fetch('key', lambda: ['fetched'], refresh) == ['old']
+    assert refreshed.wait(5)
+    cache._executor.submit(lambda: None).result()
+    assert cache.get_or_fetch('key', lambda: ['fetched']) == ['new']
+    assert cache.stats()['stale_hits'] == 1
+
+
+def test_expired_entry_is_fetched():
+    cache = make_cache()
+    cache.put('key', ['old'])
+    # The same entry is in both tiers
+    cache._memory['key'].fetched_at -= 1000
+    assert cache.get_or_fetch('key', lambda: ['fetched']) == ['fetched']
+
+
+def test_newer_disk_entry_of_another_process_replaces_a_stale_one():
+    disk = {}
+    cache = make_cache(disk=disk)
+    cache.put('key', ['old'])
+    cache._memory['key'] = CachedSearch(['old'], time.time() - 120)
+    # Refreshed by another worker
+    disk['key'] = CachedSearch(['new'], time.time())
+
+    assert cache.get('key') == ['new']
+    assert asyncio.run(cache.is_cached_async('key'))
+    assert cache.stats()['disk_reads'] == 1
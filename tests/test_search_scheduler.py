@@ -0,0 +1,88 @@
+import pytest
+
+from search_scheduler import SearchQueue, SearchRejected, QUEUED, RUNNING, SUPERSEDED
+
+
+def make_queue(**kwargs) -> SearchQueue:
+    kwargs.setdefault('max_parallel', 1)
+    kwargs.setdefault('debounce_seconds', 0)
+    return SearchQueue(**kwargs)
+
+
+def run_all(queue: SearchQueue, first) -> list:
+    """
+    :return: (user id, query) of the searches in the order they were started, each finished right away
+    """
+    started = []
+    search = first
+    while search is not None:
+        started.append((search.user_id, search.query))
+        queue._finish(search)
+        search = next(iter(queue._running), None)
+    return started
+
+
+def test_users_take_turns():
+    queue = make_queue()
+    first = queue._push(1, 'a1')
+    for user_id, query in [(1, 'a2'), (1, 'a3'), (2, 'b1'), (3, 'c1'), (2, 'b2')]:
+        queue._push(user_id, query)
+
+    # A burst of user 1 doesn't delay the others
+    assert run_all(queue, first) == [(1, 'a1'), (1, 'a2'), (2, 'b1'), (3, 'c1'), (1, 'a3'), (2, 'b2')]
+    assert queue._stats()['queued'] == 0
+
+
+def test_positions_follow_turns():
+    queue = make_queue()
+    queue._push(1, 'a1')
+    a2, a3 = queue._push(1, 'a2'), queue._push(1, 'a3')
+    b1, b2 = queue._push(2, 'b1'), queue._push(2, 'b2')
+
+    assert [queue._get_position(search) for search in (a2, b1, a3, b2)] == [1, 2, 3, 4]
+
+
+def test_free_slots_start_right_away():
+    queue = make_queue(max_parallel=2)
+    assert queue._push(1, 'a').state == RUNNING
+    assert queue._push(2, 'b').state == RUNNING
+    waiting = queue._push(3, 'c')
+    assert waiting.state == QUEUED
+
+
+def test_rejections():
+    queue = make_queue(queue_size=2, user_queue_size=1)
+    queue._push(1, 'running')
+    queue._push(1, 'waiting')
+
+    with pytest.raises(SearchRejected) as rejected:
+        queue._push(1, 'Waiting!')
+    assert rejected.value.reason == 'duplicate'
+    with pytest.raises(SearchRejected) as rejected:
+        queue._push(1, 'another')
+    assert rejected.value.reason == 'user_busy'
+    queue._push(2, 'second user')
+    with pytest.raises(SearchRejected) as rejected:
+        queue._push(3, 'third user')
+    assert (rejected.value.reason, rejected.value.waiting) == ('busy', 2)
+
+
+def test_newer_query_supersedes_waiting_one():
+    queue = make_queue(debounce_seconds=60)
+    queue._push(1, 'running')
+    typo = queue._push(1, 'ubunt')
+    fixed = queue._push(1, 'ubuntu')
+
+    assert typo.state == SUPERSEDED
+    assert fixed.state == QUEUED
+    assert queue._stats()['queued'] == 1
+
+
+def test_cancelled_waiting_search_is_removed():
+    queue = make_queue()
+    running = queue._push(1, 'a')
+    waiting = queue._push(2, 'b')
+    queue._finish(waiting)
+    queue._finish(running)
+
+    assert queue._stats() == {'started': 1, 'queued': 0, 'running': 0, 'waiting_users': 0}
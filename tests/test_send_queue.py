@@ -0,0 +1,122 @@
+import time
+
+from send_queue import TokenBucket, OutboundQueue, SendQueue, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+
+
+def make_queue(**kwargs) -> OutboundQueue:
+    kwargs.setdefault('global_rate', 1000)
+    kwargs.setdefault('chat_rate', 1)
+    kwargs.setdefault('chat_burst', 1000)
+    return OutboundQueue(**kwargs)
+
+
+def get_now() -> float:
+    # Later than the creation of the buckets, including the ones created on the first pop
+    return time.monotonic() + 0.01
+
+
+def push(queue: OutboundQueue, chat_id, name, priority=PRIORITY_NORMAL, edit_key=None):
+    return queue._push(chat_id, name, priority, edit_key, None)
+
+
+def pop_all(queue: OutboundQueue, now) -> list:
+    """
+    :return: sends of the messages ready at now, each finished right away
+    """
+    sent = []
+    while True:
+        message, _ = queue._pop_ready(now)
+        if message is None:
+            return sent
+        sent.append(message.send)
+        queue._finish(message, None)
+
+
+def test_bucket_burst_then_rate():
+    bucket = TokenBucket(rate=2, capacity=3)
+    now = bucket.updated_at
+    for _ in range(3):
+        assert bucket.wait_time(now) == 0
+        bucket.take()
+    assert bucket.wait_time(now) == 0.5
+    assert bucket.wait_time(now + 0.5) == 0
+    bucket.take()
+    # Tokens don't pile up beyond the capacity
+    assert bucket.wait_time(now + 100) == 0
+    assert bucket.tokens == 3
+
+
+def test_bucket_pause():
+    bucket = TokenBucket(rate=10, capacity=10)
+    now = bucket.updated_at
+    bucket.pause(now + 5)
+    assert bucket.wait_time(now + 1) == 4
+    assert bucket.wait_time(now + 5) == 0
+
+
+def test_priority_order_then_fifo():
+    queue = make_queue()
+    push(queue, 1, 'low', PRIORITY_LOW)
+    push(queue, 2, 'normal 1')
+    push(queue, 3, 'high', PRIORITY_HIGH)
+    push(queue, 4, 'normal 2')
+
+    assert pop_all(queue, get_now()) == ['high', 'normal 1', 'normal 2', 'low']
+
+
+def test_chat_rate_limit():
+    queue = make_queue(chat_burst=1)
+    push(queue, 1, 'first')
+    push(queue, 1, 'second')
+    push(queue, 2, 'other chat')
+    now = get_now()
+
+    assert pop_all(queue, now) == ['first', 'other chat']
+    message, wait = queue._pop_ready(now)
+    assert message is None and 0 < wait <= 1
+    assert pop_all(queue, now + 1) == ['second']
+
+
+def test_global_rate_limit():
+    queue = make_queue(global_rate=2)
+    for chat_id in range(4):
+        push(queue, chat_id, chat_id)
+    now = get_now()
+
+    assert pop_all(queue, now) == [0, 1]
+    assert pop_all(queue, now + 0.5) == [2]
+    assert pop_all(queue, now + 1) == [3]
+
+
+def test_one_call_at_a_time_per_chat():
+    queue = make_queue()
+    push(queue, 1, 'first')
+    push(queue, 1, 'second')
+    now = get_now()
+
+    first, _ = queue._pop_ready(now)
+    assert queue._pop_ready(now) == (None, None)
+    queue._finish(first, None)
+    second, _ = queue._pop_ready(now)
+    assert second.send == 'second'
+
+
+def test_queued_edits_are_coalesced():
+    queue = make_queue()
+    push(queue, 1, 'edit 1', PRIORITY_LOW, edit_key=(1, 10))
+    push(queue, 1, 'edit 2', PRIORITY_HIGH, edit_key=(1, 10))
+    push(queue, 1, 'edit 3', PRIORITY_NORMAL, edit_key=(1, 10))
+
+    message, _ = queue._pop_ready(get_now())
+    assert message.send == 'edit 3'
+    assert message.priority == PRIORITY_HIGH
+    assert len(message.futures) == 3
+    assert queue._stats()['queued'] == 0
+
+
+def test_reserved_call_does_not_keep_the_chat_busy():
+    queue = SendQueue(workers=1, global_rate=1000, chat_rate=1000, chat_burst=1000)
+    queue.reserve(1, PRIORITY_LOW).result(timeout=1)
+    # The upload would run now in the thread of the caller, other messages to the chat still go out
+    assert queue.submit(1, lambda: 'reply').result(timeout=1) == 'reply'
+    assert queue.stats() == {'queued': 0, 'sending': 0}
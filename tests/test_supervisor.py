@@ -0,0 +1,106 @@
+import asyncio
+import queue
+import threading
+import time
+
+from telebot.types import Update
+
+from supervisor import AsyncChatUpdates, ChatUpdates, Supervisor, get_shard_key, get_worker_index
+
+USER = {'id': 7, 'is_bot': False, 'first_name': 'User'}
+
+
+def make_message(chat_id, text='/start') -> dict:
+    return {'message_id': 1, 'date': 0, 'chat': {'id': chat_id, 'type': 'private'}, 'from': USER, 'text': text}
+
+
+def make_update(update_id, **fields) -> Update:
+    return Update.de_json({'update_id': update_id, **fields})
+
+
+def test_updates_are_sharded_by_chat():
+    assert get_shard_key(make_update(1, message=make_message(10))) == 10
+    # A button click goes where the message with the button was handled
+    callback_query = {'id': '1', 'from': USER, 'chat_instance': '1', 'data': 'page', 'message': make_message(20)}
+    assert get_shard_key(make_update(2, callback_query=callback_query)) == 20
+    # Inline queries have no chat
+    inline_query = {'id': '1', 'from': USER, 'query': 'ubuntu', 'offset': ''}
+    assert get_shard_key(make_update(3, inline_query=inline_query)) == 7
+    assert get_shard_key(make_update(4)) == 4
+
+
+def test_chat_always_goes_to_the_same_worker():
+    assert get_worker_index(10, 4) == get_worker_index(10, 4) == 2
+    assert get_worker_index(-1001234, 4) in range(4)
+
+    supervisor = Supervisor('sync', workers=2)
+    supervisor._queues = [queue.Queue(), queue.Queue()]
+    supervisor.process_new_updates([make_update(1, message=make_message(10)), make_update(2, message=make_message(11)),
+                                    make_update(3, message=make_message(10))])
+    assert [update.update_id for update in supervisor._queues[0].queue] == [1, 3]
+    assert [update.update_id for update in supervisor._queues[1].queue] == [2]
+
+
+class SlowBot:
+    """
+    Records the handled updates, the first one of a chat blocks until it's released
+    """
+
+    def __init__(self):
+        self.handled = []
+        self.release = threading.Event()
+
+    def process_new_updates(self, updates):
+        update = updates[0]
+        if update.message.text == 'slow':
+            self.release.wait(5)
+        self.handled.append(update.update_id)
+
+
+def test_chats_are_handled_concurrently_and_each_one_in_order():
+    bot = SlowBot()
+    chats = ChatUpdates(bot, threads=4)
+    chats.process_new_updates([make_update(1, message=make_message(10, 'slow')),
+                               make_update(2, message=make_message(10)),
+                               make_update(3, message=make_message(11))])
+
+    # The other chat doesn't wait for the slow search
+    deadline = time.monotonic() + 5
+    while 3 not in bot.handled and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert bot.handled == [3]
+    assert chats.stats() == {'chats': 1, 'waiting': 1}
+
+    bot.release.set()
+    while len(bot.handled) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert bot.handled == [3, 1, 2]
+    assert chats.stats() == {'chats': 0, 'waiting': 0}
+
+
+class AsyncSlowBot(SlowBot):
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Event()
+
+    async def process_new_updates(self, updates):
+        update = updates[0]
+        if update.message.text == 'slow':
+            await self.release.wait()
+        self.handled.append(update.update_id)
+
+
+def test_async_chats_are_handled_concurrently_and_each_one_in_order():
+    async def handle_all():
+        bot = AsyncSlowBot()
+        chats = AsyncChatUpdates(bot)
+        for update in [make_update(1, message=make_message(10, 'slow')), make_update(2, message=make_message(10)),
+                       make_update(3, message=make_message(11))]:
+            chats.submit(update)
+        await asyncio.sleep(0.05)
+        handled = list(bot.handled)
+        bot.release.set()
+        await asyncio.sleep(0.05)
+        return handled, bot.handled
+
+    assert asyncio.run(handle_all()) == ([3], [3, 1, 2])
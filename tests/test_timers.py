@@ -0,0 +1,79 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import timers
+from timers import DeadlineScheduler
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_calls_fire_in_deadline_order():
+    scheduler = DeadlineScheduler('test-order')
+    fired = []
+    lock = threading.Lock()
+
+    def record(name):
+        with lock:
+            fired.append(name)
+
+    # Scheduled out of order, the nearest one is added last
+    scheduler.call_later(0.3, record, 'third')
+    scheduler.call_later(0.2, record, 'second')
+    scheduler.call_later(0.1, record, 'first')
+
+    assert wait_for(lambda: len(fired) == 3)
+    assert fired == ['first', 'second', 'third']
+    assert scheduler.pending_count() == 0
+
+
+def test_calls_with_the_same_deadline_fire_in_order_of_scheduling(monkeypatch):
+    # Frozen clock of the scheduler, so all deadlines are equal and due
+    monkeypatch.setattr(timers, 'time', SimpleNamespace(monotonic=lambda: 100.0))
+    scheduler = DeadlineScheduler('test-ties')
+    fired = []
+    calls = [scheduler.call_later(0, fired.append, index) for index in range(5)]
+
+    assert wait_for(lambda: len(fired) == 5)
+    assert fired == [0, 1, 2, 3, 4]
+    assert not any(call.cancel() for call in calls)
+    monkeypatch.undo()
+
+
+def test_cancelled_call_does_not_fire():
+    scheduler = DeadlineScheduler('test-cancel')
+    fired = []
+    cancelled = scheduler.call_later(0.1, fired.append, 'cancelled')
+    scheduler.call_later(0.2, fired.append, 'kept')
+
+    assert cancelled.cancel()
+    assert not cancelled.cancel()
+    assert scheduler.pending_count() == 1
+    assert wait_for(lambda: fired == ['kept'])
+    time.sleep(0.1)
+    assert fired == ['kept']
+
+
+def test_cancel_after_firing_returns_false():
+    scheduler = DeadlineScheduler('test-fired')
+    fired = threading.Event()
+    call = scheduler.call_later(0, fired.set)
+
+    assert fired.wait(2)
+    assert wait_for(lambda: scheduler.pending_count() == 0)
+    assert not call.cancel()
+
+
+def test_many_cancels_keep_the_heap_small():
+    scheduler = DeadlineScheduler('test-rebuild')
+    calls = [scheduler.call_later(60, lambda: None) for _ in range(200)]
+    for call in calls:
+        call.cancel()
+
+    assert scheduler.pending_count() == 0
+    assert len(scheduler._heap) <= 100
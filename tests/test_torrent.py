@@ -0,0 +1,76 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+import torrent
+from http_pool import close_async_session
+from torrent import create_magnet_link_from_url, create_magnet_link_from_url_async
+
+TORRENT_DATA = b'd4:infod6:lengthi100e4:name6:ubuntuee'
+
+
+class TrackerHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        # Slow enough for the other requests to come meanwhile
+        self.server.release.wait(5)
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(TORRENT_DATA)))
+        self.end_headers()
+        self.wfile.write(TORRENT_DATA)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def torrent_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), TrackerHandler)
+    server.daemon_threads = True
+    server.requests = []
+    server.release = threading.Event()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    torrent.torrents_by_url.clear()
+    yield server, 'http://127.0.0.1:%d/download/1' % server.server_address[1]
+    server.release.set()
+    server.shutdown()
+    torrent.torrents_by_url.clear()
+
+
+def test_concurrent_downloads_of_a_torrent_file_are_merged(torrent_url):
+    server, url = torrent_url
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(create_magnet_link_from_url, url, 'rutracker') for _ in range(3)]
+        while not server.requests:
+            time.sleep(0.01)
+        server.release.set()
+        results = [future.result(5) for future in futures]
+
+    magnet_link, is_torrent_file, torrent_data = results[0]
+    assert magnet_link.startswith('magnet:?xt=urn:btih:') and is_torrent_file and torrent_data == TORRENT_DATA
+    assert results == [results[0]] * 3
+    assert len(server.requests) == 1
+    assert torrent.downloads_in_flight == {}
+
+
+def test_concurrent_async_downloads_of_a_torrent_file_are_merged(torrent_url):
+    server, url = torrent_url
+
+    async def download_all():
+        try:
+            downloads = [asyncio.create_task(create_magnet_link_from_url_async(url, 'rutracker')) for _ in range(3)]
+            while not server.requests:
+                await asyncio.sleep(0.01)
+            server.release.set()
+            return await asyncio.gather(*downloads)
+        finally:
+            await close_async_session()
+
+    results = asyncio.run(download_all())
+    assert results[0][0].startswith('magnet:?xt=urn:btih:')
+    assert results == [results[0]] * 3
+    assert len(server.requests) == 1
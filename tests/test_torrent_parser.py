@@ -0,0 +1,45 @@
+import pytest
+
+from torrent_parser import find_info_span, get_infohash, get_torrent_name, skip_value
+
+PIECES = b'A' * 20
+# Info dictionaries with their SHA-1, the second one has keys out of the canonical order
+INFO = b'd6:lengthi1048576e4:name10:ubuntu.iso12:piece lengthi262144e6:pieces20:' + PIECES + b'e'
+INFO_HASH = 'adc3dae763c91127410ec3d3792657714f9eb356'
+UNSORTED_INFO = b'd4:name10:ubuntu.iso6:lengthi1048576e12:piece lengthi262144e6:pieces20:' + PIECES + b'e'
+UNSORTED_INFO_HASH = 'db265fccbce0cae2aeb03337882880ff3a99a1e1'
+
+
+def make_torrent(info: bytes) -> bytes:
+    announce = b'23:http://tracker/announce'
+    return b'd8:announce' + announce + b'13:announce-listll' + announce + b'ee10:created by4:test4:info' + info + b'e'
+
+
+
+def test_infohash_of_the_info_span():
+    torrent = make_torrent(INFO)
+
+    start, end = find_info_span(torrent)
+    assert torrent[start:end] == INFO
+    assert get_infohash(torrent) == INFO_HASH
+    assert get_torrent_name(torrent, start) == 'ubuntu.iso'
+
+
+def test_infohash_keeps_the_original_encoding():
+    # Same values as INFO, encoding them again would sort the keys and give the hash of INFO
+    torrent = make_torrent(UNSORTED_INFO)
+
+    assert get_infohash(torrent) == UNSORTED_INFO_HASH != INFO_HASH
+
+
+def test_skip_value():
+    data = b'li42ed1:a3:xyz1:bl1:cee4:spame'
+    assert skip_value(data, 0) == len(data)
+    assert skip_value(data, 1) == 5
+    assert skip_value(b'i-3e', 0) == 4
+
+
+@pytest.mark.parametrize('data', [b'', b'd4:info', b'd4:infod4:name10:short', b'x', b'd4:name4:test'])
+def test_broken_torrents(data):
+    with pytest.raises(ValueError):
+        get_infohash(data)
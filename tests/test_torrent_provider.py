@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+import torrent_provider
+from torrent_provider import get_torrent_info_by_magnet_link, get_torrent_info_by_magnet_link_async, \
+    prefetch_torrent_info, prefetch_torrent_info_async
+
+MAGNET_LINK = 'magnet:?xt=urn:btih:' + 'a' * 40
+TORRENT = {'title': 'Ubuntu', 'torrent_size': 100, 'file_stats': [{'id': 1, 'path': 'ubuntu.iso', 'length': 100}]}
+
+
+@pytest.fixture
+def torrserver(monkeypatch):
+    """
+    TorrServer that never gets the metadata while the prefetch polls it, only when the torrent is added again
+    """
+    stopped = threading.Event()
+    added = []
+
+    def add_torrent(magnet_link):
+        added.append(magnet_link)
+        return str(len(added))
+
+    def get_info(id_hash):
+        return {'Torrent': TORRENT} if id_hash != '1' else {'Torrent': {}}
+
+    async def get_info_async(id_hash):
+        return get_info(id_hash)
+
+    async def add_torrent_async(magnet_link):
+        return add_torrent(magnet_link)
+
+    monkeypatch.setattr(torrent_provider, 'add_torrent', add_torrent)
+    monkeypatch.setattr(torrent_provider, 'get_info', get_info)
+    monkeypatch.setattr(torrent_provider, 'add_torrent_async', add_torrent_async)
+    monkeypatch.setattr(torrent_provider, 'get_info_async', get_info_async)
+    monkeypatch.setattr(torrent_provider, 'INFO_POLL_FIRST_DELAY_SECONDS', 0.01)
+    torrent_provider.torrent_infos.clear()
+    yield stopped, added
+    torrent_provider.torrent_infos.clear()
+
+
+def test_select_waiting_for_a_stopped_prefetch_resolves_the_torrent_itself(torrserver):
+    stopped, added = torrserver
+    prefetch = threading.Thread(target=prefetch_torrent_info, args=(MAGNET_LINK, stopped.is_set))
+    prefetch.start()
+    while not added:
+        time.sleep(0.01)
+
+    selected = Future()
+    get_torrent_info_by_magnet_link(MAGNET_LINK, selected.set_result)
+    # The results of the prefetch expire
+    stopped.set()
+    prefetch.join(5)
+
+    assert selected.result(5).title == 'Ubuntu'
+    assert len(added) == 2
+
+
+def test_async_select_waiting_for_a_stopped_prefetch_resolves_the_torrent_itself(torrserver):
+    stopped, added = torrserver
+
+    async def prefetch_and_select():
+        prefetch = asyncio.create_task(prefetch_torrent_info_async(MAGNET_LINK, stopped.is_set))
+        await asyncio.sleep(0.05)
+        select = asyncio.create_task(get_torrent_info_by_magnet_link_async(MAGNET_LINK))
+        await asyncio.sleep(0.05)
+        stopped.set()
+        # The prefetch itself ends without an error
+        await prefetch
+        return await asyncio.wait_for(select, 5)
+
+    assert asyncio.run(prefetch_and_select()).title == 'Ubuntu'
+    assert len(added) == 2
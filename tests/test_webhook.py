@@ -0,0 +1,77 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from webhook import WebhookServer
+
+SECRET_TOKEN = 'secret'
+UPDATE = {'update_id': 1, 'message': {'message_id': 1, 'date': 0, 'chat': {'id': 10, 'type': 'private'},
+                                      'from': {'id': 10, 'is_bot': False, 'first_name': 'User'}, 'text': '/start'}}
+
+
+class FakeBot:
+    def __init__(self):
+        self.threaded = True
+        self.updates = []
+
+    def process_new_updates(self, updates):
+        self.updates.extend(updates)
+
+
+@pytest.fixture
+def start_server():
+    servers = []
+
+    def start(**kwargs) -> WebhookServer:
+        server = WebhookServer(FakeBot(), host='127.0.0.1', port=0, secret_token=SECRET_TOKEN, **kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def post(server, body, path='/telegram', secret_token=SECRET_TOKEN) -> int:
+    request = urllib.request.Request('http://127.0.0.1:%d%s' % (server.address[1], path), data=body,
+                                     headers={'X-Telegram-Bot-Api-Secret-Token': secret_token})
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_updates_are_handled_by_the_workers(start_server):
+    server = start_server()
+    # Handlers run in the workers of the server, not in a pool of the bot
+    assert server.bot.threaded is False
+
+    assert post(server, json.dumps(UPDATE).encode()) == 200
+    deadline = time.monotonic() + 5
+    while not server.bot.updates and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [update.message.text for update in server.bot.updates] == ['/start']
+    assert server.stats()['accepted'] == 1
+
+
+def test_requests_not_from_telegram_are_rejected(start_server):
+    server = start_server()
+    assert post(server, json.dumps(UPDATE).encode(), secret_token='wrong') == 403
+    assert post(server, json.dumps(UPDATE).encode(), path='/other') == 404
+    assert post(server, b'not json') == 400
+    assert server.bot.updates == []
+    assert server.stats() == {'unauthorized': 1, 'invalid': 1, 'queued': 0, 'queue_size': 1000}
+
+
+def test_telegram_retries_later_when_the_queue_is_full(start_server):
+    # No workers, the queue is not drained
+    server = start_server(queue_size=1, workers=0)
+    assert post(server, json.dumps(UPDATE).encode()) == 200
+    assert post(server, json.dumps(UPDATE).encode()) == 503
+    assert server.stats()['rejected'] == 1